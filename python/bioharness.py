@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+bioharness.py
+
+Incremental feature extraction for the Zephyr BioHarness channels delivered
+by AcqKnowledge (see resources/BioHarnessTemplate6inputs.gtl): heart rate and
+heart rate variability from the ECG, breathing rate from the breathing
+channel, and activity and posture from the acceleration and posture channels.
+
+The extractor runs on the blocks received by an AcqNdtDataServer.  Every
+detector keeps a fixed amount of state and does an amount of work
+proportional to the size of the block, so it can run next to the receive
+path for the whole length of a session.  Instead of every raw sample, only
+low-rate feature messages are sent over OSC:
+
+    <address>/beat          int32 hardware index of the R peak, float32 heart rate in bpm
+    <address>/hr            float32 heart rate in bpm averaged over the last beats
+    <address>/hrv           float32 RMSSD of the last RR intervals in ms
+    <address>/breath        float32 breathing rate in breaths per minute
+    <address>/activity      float32 mean acceleration magnitude
+    <address>/posture       float32 mean posture in degrees
+
+The /beat message is sent for every detected beat, the other ones once per
+interval of acquired data.
+"""
+
+import math
+import collections
+
+import numpy
+
+from pythonosc import udp_client
+
+import biopacndt
+
+
+## labels of the channels in resources/BioHarnessTemplate6inputs.gtl
+ECGLabel = "ECG Raw"
+BreathingLabel = "Breathing Data"
+PostureLabel = "Posture"
+AccelerationLabels = ("X Acceleration Peak", "Y Acceleration Peak", "Z Acceleration Peak")
+
+
+class RPeakDetector:
+    """Incremental R peak detector for a single ECG channel.
+
+    A simplified Pan-Tompkins detector: the ECG is band-pass filtered
+    between 5 and 15 Hz, differentiated, and its moving RMS over 150 ms is
+    compared with an adaptive threshold between the running signal and
+    noise levels.  The maximum of every excursion above the threshold is an
+    R peak, unless it follows the previous one within the refractory period.
+
+    Peak positions are corrected for the delay of the filters.  The first
+    two seconds are used to learn the signal and noise levels.
+    """
+
+    def __init__(self, sampleRate, step=1, refractory=0.25):
+        """Default constructor.
+
+        sampleRate:	hardware acquisition sampling rate in Hz.
+        step:		hardware sample indexes between consecutive ECG samples,
+                    the SamplingDivider of the channel.
+        refractory:	minimum time in seconds between two R peaks.
+        """
+
+        self.__step = step
+        rate = float(sampleRate)/step
+        self.__rate = rate
+
+        taps = int(0.2*rate) | 1
+        bandPass = biopacndt.AcqNdtDecimateStage.LowPass(min(15.0/rate, 0.45), taps) \
+                   - biopacndt.AcqNdtDecimateStage.LowPass(5.0/rate, taps)
+        window = max(1, int(0.15*rate))
+
+        self.__bandPass = biopacndt.AcqNdtFilterStage(bandPass)
+        self.__derivative = biopacndt.AcqNdtFilterStage([1.0, -1.0])
+        self.__integrator = biopacndt.AcqNdtMovingRMSStage(window)
+        self.__delay = (taps - 1)/2.0 + 0.5 + (window - 1)/2.0
+        self.__refractory = int(refractory*rate)
+        self.__learning = int(2.0*rate)
+        self.__searchBack = int(2.0*rate)
+
+        channel = biopacndt.AcqNdtChannel()
+        channel.SamplingDivider = 1
+        for stage in (self.__bandPass, self.__derivative, self.__integrator):
+            stage.Configure([channel])
+
+        self.Reset()
+
+    def Reset(self):
+        """Forget the state, e.g. when a new acquisition starts.
+        """
+
+        for stage in (self.__bandPass, self.__derivative, self.__integrator):
+            stage.Reset()
+
+        self.__originIndex = None
+        self.__position = 0
+        self.__signalLevel = 0.0
+        self.__noiseLevel = 0.0
+        self.__inPeak = False
+        self.__peakValue = 0.0
+        self.__peakPosition = 0
+        self.__lastPeak = None
+        self.__lastLowering = 0
+
+    def Process(self, startIndex, samples):
+        """Process the next ECG samples.
+
+        startIndex:	hardware sample index of the first sample.
+        samples:	1-D numpy array of ECG samples.
+
+        Returns a list of the hardware sample indexes of the detected R peaks.
+        """
+
+        if self.__originIndex is None:
+            self.__originIndex = startIndex
+
+        column = numpy.reshape(samples, (-1, 1))
+        (i, column) = self.__bandPass.Process(startIndex, column)
+        (i, column) = self.__derivative.Process(startIndex, column)
+        (i, column) = self.__integrator.Process(startIndex, column)
+        signal = column[:, 0]
+
+        first = self.__position
+        self.__position += len(signal)
+
+        # learn the initial signal and noise levels
+        if first < self.__learning:
+            learned = signal[:self.__learning - first]
+            self.__signalLevel = max(self.__signalLevel, float(numpy.max(learned)) if len(learned) else 0.0)
+            self.__noiseLevel = 0.5*self.__signalLevel
+            if self.__position <= self.__learning:
+                return []
+            signal = signal[self.__learning - first:]
+            first = self.__learning
+
+        threshold = self.__noiseLevel + 0.25*(self.__signalLevel - self.__noiseLevel)
+        above = signal > threshold
+
+        below = signal[~above]
+        if len(below):
+            self.__noiseLevel = 0.875*self.__noiseLevel + 0.125*float(numpy.mean(below))
+
+        peaks = []
+
+        # an excursion continued from the previous block may have ended right at its end
+        if self.__inPeak and len(above) and not above[0]:
+            self.__inPeak = False
+            peaks += self.__FinishPeak()
+
+        # boundaries of the excursions above the threshold within the block
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], above, [False])).astype(numpy.int8)))
+
+        for k in range(0, len(edges), 2):
+            (begin, end) = (edges[k], edges[k + 1])
+            top = begin + int(numpy.argmax(signal[begin:end]))
+            if not (begin == 0 and self.__inPeak) or signal[top] > self.__peakValue:
+                self.__peakValue = float(signal[top])
+                self.__peakPosition = first + top
+
+            # the last excursion may continue in the next block
+            self.__inPeak = end == len(signal)
+            if not self.__inPeak:
+                peaks += self.__FinishPeak()
+
+        # lower the threshold when no beat was found for a while
+        last = max(self.__lastPeak or self.__learning, self.__lastLowering)
+        if not self.__inPeak and self.__position - last > self.__searchBack:
+            self.__signalLevel *= 0.5
+            self.__lastLowering = self.__position
+
+        return peaks
+
+    def __FinishPeak(self):
+        """Accept or reject the peak of the excursion that just ended.  Returns a list with its hardware sample index, or an empty list."""
+
+        position = self.__peakPosition
+        if self.__lastPeak is not None and position - self.__lastPeak < self.__refractory:
+            return []
+
+        self.__signalLevel = 0.875*self.__signalLevel + 0.125*self.__peakValue
+        self.__lastPeak = position
+        return [self.__originIndex + int(round(position - self.__delay))*self.__step]
+
+
+class BreathDetector:
+    """Incremental breathing rate detector for a single breathing channel.
+
+    The breathing signal is decimated to about 25 Hz and band-passed
+    between about 0.05 and 0.7 Hz by the difference of two one pole
+    low-pass filters.  Every rising crossing of zero with a hysteresis
+    proportional to the running amplitude starts a breath.
+    """
+
+    def __init__(self, sampleRate, step=1, breaths=4):
+        """Default constructor.
+
+        sampleRate:	hardware acquisition sampling rate in Hz.
+        step:		hardware sample indexes between consecutive samples of the channel.
+        breaths:	number of breaths the rate is averaged over.
+        """
+
+        rate = float(sampleRate)/step
+        factor = max(1, int(rate/25.0))
+        self.__rate = rate/factor
+
+        channel = biopacndt.AcqNdtChannel()
+        channel.SamplingDivider = step
+        self.__decimate = biopacndt.AcqNdtDecimateStage(factor)
+        self.__decimate.Configure([channel])
+
+        self.__fast = self.__OnePole(0.7)
+        self.__slow = self.__OnePole(0.05)
+        self.__periods = collections.deque(maxlen=breaths)
+        self.Reset()
+
+    def __OnePole(self, cutoff):
+        """One pole low-pass filter stage with the given cutoff frequency in Hz."""
+
+        alpha = 1.0 - math.exp(-2*math.pi*cutoff/self.__rate)
+        stage = biopacndt.AcqNdtFilterStage([alpha], [1.0, alpha - 1.0])
+        channel = biopacndt.AcqNdtChannel()
+        channel.SamplingDivider = 1
+        stage.Configure([channel])
+        return stage
+
+    def Reset(self):
+        """Forget the state, e.g. when a new acquisition starts.
+        """
+
+        for stage in (self.__decimate, self.__fast, self.__slow):
+            stage.Reset()
+
+        self.__position = 0
+        self.__amplitude = 0.0
+        self.__state = 0
+        self.__lastBreath = None
+        self.__periods.clear()
+
+    def Process(self, startIndex, samples):
+        """Process the next breathing samples.
+
+        Returns the number of breaths started within the samples.
+        """
+
+        (i, column) = self.__decimate.Process(startIndex, numpy.reshape(samples, (-1, 1)))
+        if len(column) == 0:
+            return 0
+        (i, fast) = self.__fast.Process(i, column)
+        (i, slow) = self.__slow.Process(i, column)
+        signal = (fast - slow)[:, 0]
+
+        first = self.__position
+        self.__position += len(signal)
+
+        self.__amplitude = 0.9*self.__amplitude + 0.1*float(numpy.mean(numpy.abs(signal)))
+        hysteresis = 0.3*self.__amplitude
+
+        # +1 above the upper level, -1 below the lower one; breaths start at
+        # the first +1 following a -1
+        levels = numpy.where(signal > hysteresis, 1, numpy.where(signal < -hysteresis, -1, 0))
+        positions = numpy.flatnonzero(levels)
+        if len(positions) == 0:
+            return 0
+        values = numpy.concatenate(([self.__state], levels[positions]))
+        starts = positions[(values[1:] == 1) & (values[:-1] == -1)]
+        self.__state = int(values[-1])
+
+        for position in first + starts:
+            if self.__lastBreath is not None:
+                period = float(position - self.__lastBreath)/self.__rate
+                if 1.5 <= period <= 15.0:
+                    self.__periods.append(period)
+            self.__lastBreath = position
+
+        return len(starts)
+
+    def GetRate(self):
+        """Returns the breathing rate in breaths per minute, or None before two breaths were detected.
+        """
+        if len(self.__periods) == 0:
+            return None
+        return 60.0*len(self.__periods)/sum(self.__periods)
+
+
+class BioHarnessFeatures:
+    """Extracts heart rate, heart rate variability, breathing rate, activity and posture from BioHarness blocks.
+
+    Register the Write member function as a block callback of the
+    AcqNdtDataServer receiving the BioHarness channels:
+
+        features = BioHarnessFeatures(dataServer.GetOutputSchedule(), sampleRate,
+                                      columns, OSCHostname, OSCport)
+        dataServer.RegisterBlockCallback("Features", features.Write)
+
+    All channels must share the same SamplingDivider.
+    """
+
+    def __init__(self, schedule, sampleRate, columns, OSCHostname=None, OSCport=None,
+                 address="/BioHarness/features", interval=1.0, beats=8, rrIntervals=30, callback=None):
+        """Default constructor.
+
+        schedule:	AcqNdtFrameSchedule of the blocks, see AcqNdtDataServer.GetOutputSchedule().
+        sampleRate:	hardware acquisition sampling rate in Hz.
+        columns:	dictionary with the block columns of the channels, with the
+                    keys "ecg", "breathing", "posture" and "acceleration" (a
+                    tuple of columns).  Missing keys disable the corresponding
+                    features.  See ColumnsFromLabels().
+        OSCHostname:	host name of the OSC receiver of the features, or None.
+        OSCport:	UDP port of the OSC receiver.
+        address:	OSC address prefix of the feature messages.
+        interval:	time in seconds of acquired data between feature messages.
+        beats:		number of beats the heart rate is averaged over.
+        rrIntervals:	number of RR intervals the heart rate variability is computed over.
+        callback:	optional function "f(index, features)" invoked with the
+                    hardware sample index and the dictionary of features
+                    every interval.
+        """
+
+        if not schedule.IsUniform():
+            raise biopacndt.ACQException("Feature extraction requires all channels to share the same SamplingDivider")
+
+        self.__step = schedule.GetPeriod()
+        self.__columns = dict(columns)
+        self.__address = address
+        self.__callback = callback
+        self.__interval = int(round(interval*sampleRate))
+
+        self.__OSCClient = None
+        if OSCHostname is not None:
+            self.__OSCClient = udp_client.SimpleUDPClient(OSCHostname, OSCport)
+
+        self.__rPeaks = None
+        if "ecg" in self.__columns:
+            self.__rPeaks = RPeakDetector(sampleRate, self.__step)
+        self.__breaths = None
+        if "breathing" in self.__columns:
+            self.__breaths = BreathDetector(sampleRate, self.__step)
+
+        self.__sampleRate = float(sampleRate)
+        self.__rr = collections.deque(maxlen=max(beats, rrIntervals))
+        self.__beats = beats
+        self.__rrIntervals = rrIntervals
+        self.Reset()
+
+    @staticmethod
+    def ColumnsFromLabels(labels):
+        """Returns the columns dictionary for the constructor from the labels of the channels in block column order.
+        """
+
+        columns = {}
+        if ECGLabel in labels:
+            columns["ecg"] = labels.index(ECGLabel)
+        if BreathingLabel in labels:
+            columns["breathing"] = labels.index(BreathingLabel)
+        if PostureLabel in labels:
+            columns["posture"] = labels.index(PostureLabel)
+        if all([label in labels for label in AccelerationLabels]):
+            columns["acceleration"] = tuple([labels.index(label) for label in AccelerationLabels])
+        return columns
+
+    def Reset(self):
+        """Forget all state, e.g. when a new acquisition starts.
+        """
+
+        if self.__rPeaks is not None:
+            self.__rPeaks.Reset()
+        if self.__breaths is not None:
+            self.__breaths.Reset()
+
+        self.__rr.clear()
+        self.__lastPeak = None
+        self.__nextReport = None
+        self.__activitySum = 0.0
+        self.__postureSum = 0.0
+        self.__count = 0
+        self.__features = {}
+
+    def GetFeatures(self):
+        """Returns a dictionary with the most recent features: "hr", "hrv", "breath", "activity" and "posture".
+        """
+        return dict(self.__features)
+
+    def Write(self, startIndex, block):
+        """Block callback extracting the features from a block and sending the messages that are due.
+
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (frames, channels)
+        """
+
+        if self.__nextReport is None or startIndex < self.__nextReport - self.__interval:
+            # first block, or a new acquisition restarted the indexes
+            if self.__nextReport is not None:
+                self.Reset()
+            self.__nextReport = startIndex + self.__interval
+
+        if self.__rPeaks is not None:
+            for peak in self.__rPeaks.Process(startIndex, block[:, self.__columns["ecg"]]):
+                self.__Beat(peak)
+
+        if self.__breaths is not None:
+            self.__breaths.Process(startIndex, block[:, self.__columns["breathing"]])
+
+        # accumulate activity and posture up to every report that is due
+        position = 0
+        while position < len(block):
+            due = max(0, (self.__nextReport - startIndex - position*self.__step + self.__step - 1)//self.__step)
+            if due >= len(block) - position:
+                self.__Accumulate(block[position:])
+                break
+            self.__Accumulate(block[position:position + due])
+            position += due
+            self.__Report(self.__nextReport)
+            self.__nextReport += self.__interval
+
+    def __Accumulate(self, rows):
+        """Add rows to the activity and posture sums of the current interval."""
+
+        if len(rows) == 0:
+            return
+        if "acceleration" in self.__columns:
+            acceleration = rows[:, list(self.__columns["acceleration"])].astype(float)
+            self.__activitySum += float(numpy.sum(numpy.sqrt(numpy.sum(acceleration*acceleration, axis=1))))
+        if "posture" in self.__columns:
+            self.__postureSum += float(numpy.sum(rows[:, self.__columns["posture"]], dtype=float))
+        self.__count += len(rows)
+
+    def __Beat(self, peak):
+        """Handle a detected R peak."""
+
+        heartRate = None
+        if self.__lastPeak is not None:
+            rr = (peak - self.__lastPeak)/self.__sampleRate
+            if 0.25 <= rr <= 2.5:
+                self.__rr.append(rr)
+                heartRate = 60.0/rr
+        self.__lastPeak = peak
+
+        if heartRate is not None and self.__OSCClient is not None:
+            self.__OSCClient.send_message(self.__address + "/beat", [int(peak), float(heartRate)])
+
+    def __Report(self, index):
+        """Compute the features of the interval ending at a hardware sample index and send them."""
+
+        features = {}
+        rr = list(self.__rr)
+        if len(rr):
+            recent = rr[-self.__beats:]
+            features["hr"] = 60.0*len(recent)/sum(recent)
+        if len(rr) > 2:
+            differences = numpy.diff(rr[-self.__rrIntervals:])
+            features["hrv"] = 1000.0*math.sqrt(float(numpy.mean(differences*differences)))
+        if self.__breaths is not None and self.__breaths.GetRate() is not None:
+            features["breath"] = self.__breaths.GetRate()
+        if self.__count:
+            if "acceleration" in self.__columns:
+                features["activity"] = self.__activitySum/self.__count
+            if "posture" in self.__columns:
+                features["posture"] = self.__postureSum/self.__count
+
+        self.__activitySum = 0.0
+        self.__postureSum = 0.0
+        self.__count = 0
+        self.__features = features
+
+        if self.__OSCClient is not None:
+            for (name, value) in features.items():
+                self.__OSCClient.send_message(self.__address + "/" + name, float(value))
+
+        if self.__callback is not None:
+            self.__callback(index, dict(features))
@@ -14,6 +14,7 @@ This program is an edited version of the original code provided by BIOPAC.
 Copyright (c) 2009-2010 BIOPAC Systems, Inc. All rights reserved.
 """
 
+import abc
 import socket
 import xmlrpc.client as xc
 import socketserver
@@ -21,7 +22,34 @@ import threading
 import struct
 import time
 import inspect
-import sys
+import math
+import collections
+import json
+import os
+import concurrent.futures
+import http.client
+import asyncio
+import functools
+import ctypes
+import errno
+import hashlib
+import select
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy
+
+# scipy is optional, it only speeds up filter stages
+try:
+    from scipy import signal as scipysignal
+except ImportError:
+    scipysignal = None
+
+# recvmmsg() receives many datagrams with a single system call where the C
+# library provides it (Linux)
+try:
+    recvmmsg = ctypes.CDLL(None, use_errno=True).recvmmsg
+except (OSError, AttributeError, TypeError):
+    recvmmsg = None
 
 #for osc messages
 from pythonosc import udp_client
@@ -38,10 +66,20 @@ class AcqNdtChannel:
     This class should not be created or manipulated directly.
     
     AcqNdtServer returns AcqNdtChannel and populates the information. 
+    
+    Channels are compact (their attributes are slots) and immutable: an
+    attribute may only be set while it is None.  Channels compare equal and
+    hash by their configuration, all attributes but EnabledForDelivery, so
+    they may be used as dictionary keys once populated.
     """
+    
+    __slots__ = ("Type", "Index", "DataSize", "SamplingDivider", "Scale", "Offset", "EnabledForDelivery")
 
-    def __init__(self):
+    def __init__(self, Type=None, Index=None, DataSize=None, SamplingDivider=None, Scale=None, Offset=None, EnabledForDelivery=None):
         """ Default constructor
+        
+        All attributes may be given as arguments, otherwise they are None
+        and may be set once.
         """
         
         ## Lists the channel type.  One of the following strings:
@@ -51,18 +89,18 @@ class AcqNdtChannel:
         ## "calc"		for calculation channels showing derived data
         ## "FaceReader"		for FaceReader channels showing emotional states
         ##                      received from FaceReader
-        self.Type = None
+        self.Type = Type
         
         ## Index of the channel.  Each individual channel type has an
         ## index starting at 0.
-        self.Index = None
+        self.Index = Index
         
         ## Number of bytes occupied by a single sample of binary data
         ## delivered over a network connection.
         ##
         ## For this release of the module, this will always be a fixed
         ## value of 8 bytes for all channels.
-        self.DataSize = None
+        self.DataSize = DataSize
         
         ## Downsampling divider for the channel.  The hardware
         ## acquisition sampling rate may be divided by this value to
@@ -73,7 +111,7 @@ class AcqNdtChannel:
         ## sampling rate.  If varying channel sampling rates are used,
         ## it is recommended to use the "multiple" communication mode
         ## to avoid the need to process frames.
-        self.SamplingDivider = None
+        self.SamplingDivider = SamplingDivider
         
         ## Scaling factor for converting channel data.  This is used
         ## primarily to convert integer formatted data into actual
@@ -84,7 +122,7 @@ class AcqNdtChannel:
         ## For this release of the module, this will always be a fixed
         ## value of 1.0 for all channels.  This may change in future
         ## module revisions.
-        self.Scale = None
+        self.Scale = Scale
         
         ## Offset factor for converting channel data.  This is used
         ## primarily to convert integer formatted data into actual
@@ -95,7 +133,7 @@ class AcqNdtChannel:
         ## For this release of the module, this will always be a fixed
         ## value of 0.0 for all channels.  This may change in future
         ## module revisions.
-        self.Offset = None
+        self.Offset = Offset
         
         ## Boolean value indicating if AcqKnowledge will stream the
         ## data of this channel over a network connection during
@@ -107,7 +145,7 @@ class AcqNdtChannel:
         ## If this is False, the channel may only be used for 
         ## "getMostRecentSampleValue" style XML-RPC calls.  Binary
         ## data will not be streamed to the client application.
-        self.EnabledForDelivery = None
+        self.EnabledForDelivery = EnabledForDelivery
                     
     def GetSimpleChannelStruct(self):
         """ Converts the instance into a simple channel index structure.
@@ -120,12 +158,26 @@ class AcqNdtChannel:
         
     def __str__(self):
         """ Return printable string representation. """
-        return "%s" % self.__dict__
+        return "%s" % dict([(name, getattr(self, name)) for name in self.__slots__])
     
     def __repr__(self):
         """ Return printable string representation. """
         return self.__str__()
     
+    def __eq__(self, other):
+        """ Channels are equal when their configuration is equal. """
+        if not isinstance(other, AcqNdtChannel):
+            return NotImplemented
+        return self.__Key() == other.__Key()
+    
+    def __hash__(self):
+        """ Hash of the configuration of the channel. """
+        return hash(self.__Key())
+    
+    def __Key(self):
+        """Returns the immutable configuration of the channel."""
+        return (self.Type, self.Index, self.DataSize, self.SamplingDivider, self.Scale, self.Offset)
+    
     def __setattr__(self, name, value):
         """ Used to enforce attributes that are read-only and may be set only once.
         
@@ -133,31 +185,65 @@ class AcqNdtChannel:
         Any of the properties of a channel cannot be changed in local
         objects, but rather must be configured through control connection
         XML-RPC calls.  This is why these attributes are read-only.
+        EnabledForDelivery is changed with UpdateDelivery().
         """
         
-        #if (not self.__dict__.has_key(name)) or (self.__dict__[name] is None):
-        if (not name in self.__dict__) or (self.__dict__[name] is None):
-            self.__dict__[name]=value
-        else:
-            if name == 'EnabledForDelivery':
-                # We will allow only our specific AcqNdtServer Deliver function which
-                # toggles channel delivery to modify this attribute since
-                # it will explicitly sync it with the remote AcqKnowledge
-                # application over the control connection.  All other callers
-                # will be denied modification privileges.
-                #
-                # This of course isn't perfect, but is close enough to
-                # remind callers of object immutability while adding a
-                # 'friend' class.
-                
-                if sys._getframe(1).f_code.co_name == 'Deliver':
-                    self.__dict__[name]=value
-                else:
-                    raise ACQException("AcqNdtChannel instances cannot be modified!")
-                
-            else:
-                raise ACQException("AcqNdtChannel instances cannot be modified!")
+        if getattr(self, name, None) is not None:
+            raise ACQException("AcqNdtChannel instances cannot be modified!")
+        object.__setattr__(self, name, value)
+    
+    def UpdateDelivery(self, state):
+        """Change the EnabledForDelivery attribute.
         
+        Should only be used by AcqNdtServer and AcqNdtAsyncServer, which
+        change the delivery of the channel within AcqKnowledge over the
+        control connection at the same time.
+        
+        state:	True if the data of the channel is delivered, False otherwise
+        """
+        object.__setattr__(self, "EnabledForDelivery", state)
+
+
+class AcqNdtTransport(xc.Transport):
+    """XML-RPC transport keeping persistent HTTP/1.1 connections to AcqKnowledge.
+    
+    The default transport of xmlrpc.client shares one connection object and
+    may not be used from several threads at once.  This transport keeps one
+    keep-alive connection per thread instead, so every thread reuses its own
+    TCP connection for all of its requests and one control connection call
+    costs a single round trip instead of a TCP handshake plus a round trip.
+    
+    Used internally by AcqNdtServer.
+    """
+    
+    def __init__(self):
+        """Default constructor."""
+        xc.Transport.__init__(self)
+        self.__local = threading.local()
+    
+    def make_connection(self, host):
+        """Returns the connection of the calling thread, creating it when needed."""
+        
+        cached = getattr(self.__local, "connection", None)
+        if cached is not None and cached[0] == host:
+            return cached[1]
+        
+        if cached is not None:
+            cached[1].close()
+        
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        connection = http.client.HTTPConnection(chost)
+        self.__local.connection = (host, connection)
+        return connection
+    
+    def close(self):
+        """Close the connection of the calling thread."""
+        
+        cached = getattr(self.__local, "connection", None)
+        if cached is not None:
+            self.__local.connection = None
+            cached[1].close()
+
 
 class AcqNdtServer:
     """ Used to control a remote AcqKnowledge application.
@@ -191,8 +277,26 @@ class AcqNdtServer:
     protocol with 2 second timeouts and native endian double valued
     channel data delivery.  Code using this class should not modfiy
     any of these transfer settings.
+    
+    Control connection calls reuse one persistent HTTP connection per
+    calling thread (see AcqNdtTransport), so instances may be shared
+    between threads.
     """
     
+    ## channel types of AcqKnowledge, in the order of GetAllChannels()
+    ChannelTypes = ('analog', 'digital', 'calc', 'FaceReader')
+    
+    ## encoded loadTemplate requests, keyed by the path of the template
+    ## file and kept with its modification time, size and SHA-1 digest
+    TemplateCache = {}
+    
+    ## SHA-1 digest of the template last loaded by this process into every
+    ## AcqKnowledge instance and the graph fingerprint after loading it,
+    ## keyed by (host, port)
+    LoadedTemplates = {}
+    
+    TemplateLock = threading.Lock()
+    
     def __init__(self, host, port):
         """ Constructs an AcqKnowledge Data Transfer server.
         
@@ -206,6 +310,8 @@ class AcqNdtServer:
               request.
         """
         
+        self.__rpcStubs = {}
+        
         self.__Host = str(host)
         self.__ControlPort = int(port)
         
@@ -217,27 +323,49 @@ class AcqNdtServer:
         
         self.__rpcServerURL = "http://%s:%s/RPC2" % (self.__Host, self.__ControlPort)
         
-        self.__RPC =  xc.ServerProxy(self.__rpcServerURL)
+        self.__RPC =  xc.ServerProxy(self.__rpcServerURL, transport=AcqNdtTransport())
         
         # we will strip off the leading prefix from all of the XML-RPC method
         # names so we can access them directly as member functions in the
         # AcqNdtServer class.
         self.__acqRPCNamespace = "acq."
+        self.__rpcMethods = []
         fullList = self.__RPC.system.listMethods()
         #searches the full list of methods, if it starts with the acq namespace remove the acq prefix and add it to the list
         self.__rpcMethods = [m.replace(self.__acqRPCNamespace,"",1) for m in fullList if m.startswith(self.__acqRPCNamespace)]
+        
+        # build the callable stubs of all dispatched methods once.  Stubs are
+        # also stored as instance attributes, unless a helper of this class
+        # has the same name, so calling them does not go through __getattr__.
+        for name in self.__rpcMethods:
+            stub = getattr(self.__RPC, self.__acqRPCNamespace + name)
+            self.__rpcStubs[name] = stub
+            if not hasattr(AcqNdtServer, name):
+                self.__dict__[name] = stub
+        
+        # batches of calls are sent as a single system.multicall request when
+        # AcqKnowledge supports it, otherwise they are issued concurrently
+        # over a small pool of threads, each with its own connection.
+        self.__supportsMulticall = "system.multicall" in fullList
+        self.__maxConcurrentCalls = 8
+        
+        # channel objects discovered by GetChannels(), keyed by channel type
+        self.__channelCache = {}
           
         #added by user
         self.__inBetweenMessageTime = 0.25 #time between messages, used in WaitForAcquisitionEnd function
+        self.__maxPollingTime = 2.0 #longest time between messages once polling backs off
+        self.__dataConnectionTimeout = 2
         #always use tcp
         self.changeTransportType('tcp')
         #tcp timeout
-        self.setDataConnectionTimeoutSec(2)
+        self.setDataConnectionTimeoutSec(self.__dataConnectionTimeout)
     
-    def LoadTemplate(self, filename):
+    def LoadTemplate(self, filename, force=False):
         """ Sends a graph template file to AcqKnowledge to create a new graph window with its hardware settings.
         
         filename: path to the graph template file on disk that should be transferred to AcqKnowledge 
+        force:    send the template even if AcqKnowledge already has it open.
 
         CAUTION:  Always remember to use the capitalized "LoadTemplate"!
         The lowercase XML-RPC control connection loadTemplate() function does
@@ -247,26 +375,36 @@ class AcqNdtServer:
         CAUTION:  If the file specified is not an AcqKnowledge graph template
         file, sending it may crash AcqKnowledge.
         
+        The file is read once and its encoded request is cached until the
+        file changes, so loading the same template again does not read or
+        encode it again.  If this process already loaded the same template
+        into the same AcqKnowledge instance and the front most graph still
+        has the same fingerprint (see GetGraphFingerprint()), the upload and
+        the reconfiguration are skipped, at the cost of a single batch of
+        calls.  Use force if the graph may have been modified within
+        AcqKnowledge without changing its fingerprint.
+        
+        The channel cache of GetChannels() is invalidated in either case,
+        since the fingerprint does not cover the delivery settings.
+        
+        Returns True if the template was sent, False if it was already loaded.
         """
         
-        # specify "rb" for cross platform  (http://bugs.python.org/issue1735418)
-        fd = open(filename, "rb")
+        (digest, request) = self.__EncodeTemplate(filename)
+        key = (self.__Host, self.__ControlPort)
         
-        # read arbitrary size file
-        data = b''
-
-        while True:
-            partial = fd.read(1024)
-            data += partial
-            
-            if b'' == partial:
-                break
-                
-        fd.close()
+        # the new graph has its own channels, and the delivery settings of
+        # an unchanged graph may have been modified within AcqKnowledge
+        self.InvalidateChannelCache()
         
-        binaryFile = xc.Binary(data)
+        if not force:
+            with AcqNdtServer.TemplateLock:
+                loaded = AcqNdtServer.LoadedTemplates.get(key)
+            if loaded is not None and loaded[0] == digest \
+                    and loaded[1] == self.GetGraphFingerprint(AcqNdtServer.FingerprintChannels(loaded[1])):
+                return False
         
-        self.loadTemplate(binaryFile)
+        self.__RPC("transport").request("%s:%s" % (self.__Host, self.__ControlPort), "/RPC2", request)
         
         # Note that after we load a new graph template file, the graph
         # template itself may contain previously saved network settings.
@@ -277,11 +415,120 @@ class AcqNdtServer:
         # completion of the acquisition to deliver the final data samples,
         # we will always reset the transfer mode and timeout after we
         # load the settings from a new graph template within AcqKnowledge.
+        #
+        # The enabled channels of the new graph, needed to request its
+        # fingerprint, are requested in the same batch.
         
-        #always use tcp
-        self.changeTransportType('tcp')
-        #tcp timeout
-        self.setDataConnectionTimeoutSec(2)
+        calls = [("changeTransportType", ('tcp',)),
+                 ("setDataConnectionTimeoutSec", (self.__dataConnectionTimeout,))]
+        results = self.CallBatch(calls + self.GraphFingerprintCalls())
+        fingerprint = self.GetGraphFingerprint(AcqNdtServer.FingerprintChannels(results[len(calls):]))
+        
+        with AcqNdtServer.TemplateLock:
+            AcqNdtServer.LoadedTemplates[key] = (digest, fingerprint)
+        return True
+    
+    def GetLoadedTemplate(self):
+        """Returns the SHA-1 digest of the template last loaded by this process into this AcqKnowledge instance, or None.
+        """
+        with AcqNdtServer.TemplateLock:
+            loaded = AcqNdtServer.LoadedTemplates.get((self.__Host, self.__ControlPort))
+        if loaded is None:
+            return None
+        return loaded[0]
+    
+    def GetGraphFingerprint(self, channels=None):
+        """Returns a list describing the front most graph in AcqKnowledge.
+        
+        The fingerprint holds the enabled channels of every type, the
+        transport settings, the sampling rate if available and the
+        downsampling divider of every channel.  Two equal fingerprints mean
+        the channels and the frames AcqKnowledge sends have not changed.
+        The delivery settings of the channels, which clients change with
+        Deliver(), are not part of the fingerprint.
+        
+        channels:	list of (type, index) tuples of the channels expected to
+                    be enabled, usually FingerprintChannels() of an earlier
+                    fingerprint.  The fingerprint is then requested with a
+                    single batch of calls, and differs from the earlier one
+                    if other channels are enabled.  By default the enabled
+                    channels are requested with one more batch.
+        """
+        
+        if channels is None:
+            channels = AcqNdtServer.FingerprintChannels(self.CallBatch(self.GraphFingerprintCalls()))
+        return self.CallBatch(self.GraphFingerprintCalls(channels))
+    
+    def GraphFingerprintCalls(self, channels=()):
+        """Returns the batch of (methodName, arguments) calls of GetGraphFingerprint().
+        
+        Should only be used by LoadTemplate() and AcqNdtConfigurationCache,
+        to request the fingerprint within a larger batch.
+        
+        channels:	list of (type, index) tuples of the channels whose dividers
+                    are requested.
+        """
+        
+        calls = [("getEnabledChannels", (t,)) for t in AcqNdtServer.ChannelTypes]
+        calls += [("getTransportType", ()), ("getDataConnectionTimeoutSec", ())]
+        if "getSamplingRate" in self.__rpcMethods:
+            calls.append(("getSamplingRate", ()))
+        calls += [("getDownsamplingDivider", ({"type":t,"index":i},)) for (t, i) in channels]
+        return calls
+    
+    @staticmethod
+    def FingerprintChannels(fingerprint):
+        """Returns the list of (type, index) tuples of the channels enabled in a fingerprint.
+        
+        fingerprint:	result of GetGraphFingerprint(), or of the calls of
+                        GraphFingerprintCalls()
+        """
+        
+        channelTypes = AcqNdtServer.ChannelTypes
+        return [(t, i) for (t, indexes) in zip(channelTypes, fingerprint[:len(channelTypes)]) for i in indexes]
+    
+    def GetTemplateDigest(self, filename):
+        """Returns the SHA-1 digest of a graph template file, as used by GetLoadedTemplate().
+        
+        Like LoadTemplate(), the file is only read again when it changed.
+        """
+        return self.__EncodeTemplate(filename)[0]
+    
+    def RestoreLoadedTemplate(self, digest, fingerprint):
+        """Record a template as loaded into this AcqKnowledge instance by this process.
+        
+        Should only be used by AcqNdtConfigurationCache, once the graph has
+        been validated against a configuration stored by another process.
+        """
+        with AcqNdtServer.TemplateLock:
+            AcqNdtServer.LoadedTemplates[(self.__Host, self.__ControlPort)] = (digest, fingerprint)
+    
+    def GetControlAddress(self):
+        """Returns the (hostname, port) tuple of the control connection."""
+        return (self.__Host, self.__ControlPort)
+    
+    def __EncodeTemplate(self, filename):
+        """Returns the SHA-1 digest of a template file and the encoded loadTemplate request sending it, cached until the file changes."""
+        
+        path = os.path.abspath(filename)
+        info = os.stat(path)
+        version = (info.st_mtime_ns, info.st_size)
+        
+        with AcqNdtServer.TemplateLock:
+            cached = AcqNdtServer.TemplateCache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1:]
+        
+        # specify "rb" for cross platform  (http://bugs.python.org/issue1735418)
+        with open(path, "rb") as fd:
+            data = fd.read()
+        
+        digest = hashlib.sha1(data).hexdigest()
+        request = xc.dumps((xc.Binary(data),), self.__acqRPCNamespace + "loadTemplate").encode("utf-8")
+        
+        with AcqNdtServer.TemplateLock:
+            AcqNdtServer.TemplateCache[path] = (version, digest, request)
+        return (digest, request)
 
     
     def GetChannels(self, channelType):
@@ -298,33 +545,18 @@ class AcqNdtServer:
         Returns a list of AcqNdtChannel objects describing all channels of the specified type.
         
         To be compatible with the AcqNdtDataServer class, this will configure
-        all of the channels to be transferred to our Python code using double
-        precision floating point native endian format.  Code using 
-        AcqNdtDataServer should *not* change the data type!
-        
+        all of the channels to be transferred to our Python code using 32 bit
+        big endian floating point format.  Code using AcqNdtDataServer should
+        *not* change the data type!
+        
+        The channel settings are requested with one batch of calls for all
+        channels and cached; later calls return the cached channel objects
+        without any network calls until LoadTemplate() or
+        InvalidateChannelCache() is used.
         """
         
-        aChannels = []
-        enabledCH = self.getEnabledChannels(channelType)
-        
-        for index in enabledCH:
-            aCH = AcqNdtChannel()
-            aCH.Type = channelType
-            aCH.Index = index
-        
-            aCH.SamplingDivider = self.getDownsamplingDivider(aCH.GetSimpleChannelStruct())
-            
-            #for simplicity only handle 32 bits big endian channels
-            dataTypeStruct = {"type":"float","endian":"big"}
-            self.changeDataType(aCH.GetSimpleChannelStruct(), dataTypeStruct)
-            aCH.DataSize = 4 #data type size in bytes 32 bits
-            aCH.Scale = 1.0
-            aCH.Offset = 0.0
-            
-            aCH.EnabledForDelivery = self.getDataDeliveryEnabled(aCH.GetSimpleChannelStruct())
-            aChannels.append(aCH)
-        
-        return aChannels
+        self.__DiscoverChannels([channelType])
+        return list(self.__channelCache[channelType])
     
     def GetAllChannels(self):
         """Get a list of all of the data channels enabled for acquisition in the front most graph in AcqKnowledge.
@@ -337,12 +569,136 @@ class AcqNdtServer:
         Returns a list of AcqNdtChannel objects describing all channels of the specified type.
         
         To be compatible with the AcqNdtDataServer class, this will configure
-        all of the channels to be transferred to our Python code using double
-        precision floating point native endian format.  Code using 
-        AcqNdtDataServer should *not* change the data type!
+        all of the channels to be transferred to our Python code using 32 bit
+        big endian floating point format.  Code using AcqNdtDataServer should
+        *not* change the data type!
+        
+        Like GetChannels(), the result is cached.
+        """
+        
+        channelTypes = list(AcqNdtServer.ChannelTypes)
+        self.__DiscoverChannels(channelTypes)
+        return sum([self.__channelCache[t] for t in channelTypes], [])
+    
+    def InvalidateChannelCache(self):
+        """Forget the channels cached by GetChannels() so they are requested again from AcqKnowledge.
+        
+        Use this if the channel settings were changed within AcqKnowledge
+        itself.  LoadTemplate() invalidates the cache automatically.
+        """
+        self.__channelCache = {}
+    
+    def RestoreChannels(self, acqChannels):
+        """Replace the channels cached by GetChannels() with previously discovered channels.
+        
+        Should only be used by AcqNdtConfigurationCache, once the channels
+        have been validated against AcqKnowledge.
+        
+        acqChannels:	list of all AcqNdtChannel objects enabled for acquisition
+        """
+        
+        self.__channelCache = dict([(t, []) for t in AcqNdtServer.ChannelTypes])
+        for acqChannel in acqChannels:
+            self.__channelCache[acqChannel.Type].append(acqChannel)
+    
+    def __DiscoverChannels(self, channelTypes):
+        """Request and cache the channels of the given types not cached yet.
+        
+        Uses two batches of calls regardless of the number of channels: one
+        enumerating the enabled channels of every type and one requesting
+        the settings of every channel and configuring its data type.
+        """
+        
+        channelTypes = [t for t in channelTypes if t not in self.__channelCache]
+        if len(channelTypes) == 0:
+            return
+        
+        enabled = self.CallBatch([("getEnabledChannels", (t,)) for t in channelTypes])
+        (discovered, calls) = AcqNdtServer.ChannelSettingCalls(channelTypes, enabled)
+        results = self.CallBatch(calls)
+        self.__channelCache.update(AcqNdtServer.ChannelsFromSettings(channelTypes, discovered, results))
+    
+    @staticmethod
+    def ChannelSettingCalls(channelTypes, enabled):
+        """Build the batch of calls requesting the settings of enabled channels.
+        
+        Should only be used by the channel discovery implementation.
+        
+        channelTypes:	list of channel types
+        enabled:		list with the result of getEnabledChannels() for each type
+        
+        Returns a tuple (discovered, calls): the list of (type, index) of the
+        channels and the list of (methodName, arguments) calls for CallBatch().
+        """
+        
+        #for simplicity only handle 32 bits big endian channels
+        dataTypeStruct = {"type":"float","endian":"big"}
+        
+        discovered = []
+        calls = []
+        for (channelType, indexes) in zip(channelTypes, enabled):
+            for index in indexes:
+                simple = {"type":channelType,"index":index}
+                discovered.append((channelType, index))
+                calls.append(("getDownsamplingDivider", (simple,)))
+                calls.append(("changeDataType", (simple, dataTypeStruct)))
+                calls.append(("getDataDeliveryEnabled", (simple,)))
+        
+        return (discovered, calls)
+    
+    @staticmethod
+    def ChannelsFromSettings(channelTypes, discovered, results):
+        """Create the AcqNdtChannel objects from the results of the ChannelSettingCalls() batch.
+        
+        Should only be used by the channel discovery implementation.
+        
+        Returns a dictionary with the list of channels of each type.
+        """
+        
+        channels = dict([(t, []) for t in channelTypes])
+        for (i, (channelType, index)) in enumerate(discovered):
+            aCH = AcqNdtChannel()
+            aCH.Type = channelType
+            aCH.Index = index
+            aCH.SamplingDivider = results[3*i]
+            aCH.DataSize = 4 #data type size in bytes 32 bits
+            aCH.Scale = 1.0
+            aCH.Offset = 0.0
+            aCH.EnabledForDelivery = results[3*i + 2]
+            channels[channelType].append(aCH)
+        
+        return channels
+    
+    def CallBatch(self, calls):
+        """Invoke several control connection methods with as few network round trips as possible.
+        
+        If AcqKnowledge supports system.multicall, all calls are sent in a
+        single request.  Otherwise they are issued concurrently from a small
+        pool of threads, each using its own connection.
+        
+        calls:	list of (methodName, arguments) tuples, where methodName is the
+                name of a dispatched method without the "acq." prefix and
+                arguments a tuple of its arguments.
+        
+        Returns the list of results in the order of the calls.  A failed call
+        raises its xmlrpc.client.Fault.
         """
         
-        return self.GetChannels('analog') + self.GetChannels('digital') + self.GetChannels('calc') + self.GetChannels('FaceReader')
+        if len(calls) == 0:
+            return []
+        
+        if self.__supportsMulticall:
+            multicall = xc.MultiCall(self.__RPC)
+            for (name, args) in calls:
+                getattr(multicall, self.__acqRPCNamespace + name)(*args)
+            return list(multicall())
+        
+        def invoke(call):
+            (name, args) = call
+            return getattr(self.__RPC, self.__acqRPCNamespace + name)(*args)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(self.__maxConcurrentCalls, len(calls))) as pool:
+            return list(pool.map(invoke, calls))
     
     def GetChannelLabel(self, acqChannel):
         """Get the label for a specified channel
@@ -401,10 +757,11 @@ class AcqNdtServer:
         Returns a list of all of the AcqNdtChannel objects enabled for data
         delivery.
         """
-        for c in self.GetAllChannels():
-            self.Deliver(c, True)
-            
-        return self.GetAllChannels()
+        
+        channels = self.GetAllChannels()
+        self.DeliverChannels([c for c in channels if not c.EnabledForDelivery], True)
+        
+        return channels
         
     def Deliver(self, acqChannel, state):
         """Change whether the data of a specific channel will be delivered by AcqKnowledge to an AcqNdtDataServer.
@@ -428,9 +785,31 @@ class AcqNdtServer:
         """
         
         self.changeDataDeliveryEnabled(acqChannel.GetSimpleChannelStruct(), state)
-        acqChannel.EnabledForDelivery = state
+        acqChannel.UpdateDelivery(state)
+        self.__UpdateCachedDelivery(acqChannel, state)
+    
+    def DeliverChannels(self, acqChannels, state):
+        """Change whether the data of several channels will be delivered, using a single batch of calls.
+        
+        See Deliver() for details.
+        
+        acqChannels:	list of AcqNdtChannel objects
+        state:			True to deliver the data of the channels, False otherwise
+        """
+        
+        self.CallBatch([("changeDataDeliveryEnabled", (c.GetSimpleChannelStruct(), state)) for c in acqChannels])
+        for acqChannel in acqChannels:
+            acqChannel.UpdateDelivery(state)
+            self.__UpdateCachedDelivery(acqChannel, state)
+    
+    def __UpdateCachedDelivery(self, acqChannel, state):
+        """Keep the cached channel object in sync when another object for the same channel changed."""
+        
+        for cached in self.__channelCache.get(acqChannel.Type, []):
+            if cached.Index == acqChannel.Index and cached is not acqChannel:
+                cached.UpdateDelivery(state)
         
-    def WaitForAcquisitionEnd(self):
+    def WaitForAcquisitionEnd(self, dataServers=None, timeout=None):
         """Blocks until any data acquisition within AcqKnowledge has completed.
         
         While blocked, all AcqNdtDataServer instances and registered data
@@ -440,23 +819,71 @@ class AcqNdtServer:
         Use this instead of writing custom loops calling getAcquisitionInProgress().
         This helper method helps reduce control thread network requests which
         helps AcqKnowledge and network data delivery to function more efficiently.
+        
+        dataServers:	optional AcqNdtDataServer or AcqNdtDataUDPServer, or list
+                        of them, receiving the data of the acquisition.  The call
+                        then returns as soon as all of their data ended
+                        and their last frames have been processed.  Polling the
+                        control connection is only a fallback whose interval
+                        backs off while the acquisition runs.
+        timeout:		optional maximum time to wait in seconds.
+        
+        Returns True if the acquisition ended, False if the timeout expired.
         """
         
-        while self.getAcquisitionInProgress():
-            time.sleep(self.__inBetweenMessageTime)
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        
+        def remaining(limit):
+            if deadline is None:
+                return limit
+            return max(0.0, min(limit, deadline - time.monotonic()))
+        
+        if dataServers is None:
+            dataServers = []
+        elif isinstance(dataServers, AcqNdtDataReceiver):
+            dataServers = [dataServers]
+        
+        def waitForServers(limit):
+            # wait up to limit seconds in total for every data server to end
+            end = time.monotonic() + limit
+            for dataServer in dataServers:
+                if not dataServer.WaitForEnd(max(0.0, end - time.monotonic())):
+                    return False
+            return True
+        
+        interval = self.__inBetweenMessageTime
+        while True:
+            if len(dataServers) and waitForServers(0):
+                return True
+            if not self.getAcquisitionInProgress():
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            
+            if len(dataServers):
+                waitForServers(remaining(interval))
+            else:
+                time.sleep(remaining(interval))
+            interval = min(interval*2, self.__maxPollingTime)
         
-        # sleep for an additional 1.5 second here.  when the data acquisition
-        # ends within AcqKnowledge, the final samples of data from the
-        # acquisition will still be transferred after the acquisition has
-        # halted (due to our 'connection timeout' of 2 sec.).
+        # when the data acquisition ends within AcqKnowledge, the final
+        # samples of data from the acquisition will still be transferred
+        # after the acquisition has halted (due to our 'connection timeout'
+        # of 2 sec.).
         #
-        # by waiting for an additional period, we'll hopefully be able to 
-        # catch and process the final bits of data coming in over the
-        # network connection.  This will hopefully prevent the majority of
-        # cases where Python code using this module starts invoking cleanup
-        # functions before all of the data has actually been received.
+        # with data servers we wait until they have received and processed
+        # the end of their data connections, at most for the connection
+        # timeout.  without them, sleep for an additional 1.5 second to
+        # hopefully catch and process the final bits of data before Python
+        # code using this module starts invoking cleanup functions.
         
-        time.sleep(1.5)
+        if len(dataServers):
+            return waitForServers(remaining(self.__dataConnectionTimeout + 0.5))
+        
+        time.sleep(remaining(1.5))
+        return deadline is None or time.monotonic() < deadline
 
     ## functions added by user
     def getReceiveTime(self):
@@ -487,14 +914,256 @@ class AcqNdtServer:
         """
 
         # all redirect methods that are actually an rpc method
-        if item not in self.__rpcMethods:
+        try:
+            return self.__dict__['_AcqNdtServer__rpcStubs'][item]
+        except KeyError:
             raise AttributeError(item)
+
             
+class AcqNdtConfigurationCache:
+    """Persistent cache of the data delivery configuration of AcqKnowledge graphs.
+    
+    Discovering the channels of a graph, enabling their delivery and
+    requesting the data connection settings takes several batches of calls
+    and changes the data type of every channel.  This class keeps the
+    resulting configuration in a JSON file, by default ~/.acqndt/configuration.json,
+    keyed by the control connection of the AcqKnowledge instance and the
+    SHA-1 digest of its graph template, so a program restarted during a
+    session (for example after a crash) gets it back after validating it
+    with a single batch of calls.
+    
+    A configuration is a dictionary with the keys:
+    
+        channels:                   list of the AcqNdtChannel objects delivered
+        labels:                     list of the labels of the channels
+        dataConnectionMethod:       'single' or 'multiple'
+        dataConnectionHostname:     hostname AcqKnowledge connects to for data
+        singleConnectionModePort:   data connection port of 'single' mode
+        dataConnectionPorts:        list of the data connection ports of the
+                                    channels in 'multiple' mode, otherwise None
+        samplingRate:               nominal sampling rate, or None if unknown
+    
+    Example:
+    
+        cache = AcqNdtConfigurationCache()
+        configuration = cache.Restore(acqServer, "template.gtl")
+        if configuration is None:
+            acqServer.LoadTemplate("template.gtl")
+            configuration = cache.Refresh(acqServer, "template.gtl")
+    """
+    
+    ## version of the file format, files of other versions are ignored
+    Version = 2
+    
+    def __init__(self, filename=None):
+        """Create the cache, reading the stored configurations if the file exists.
+        
+        filename:	path of the JSON file, by default ~/.acqndt/configuration.json
+        """
+        
+        if filename is None:
+            filename = os.path.join(os.path.expanduser("~"), ".acqndt", "configuration.json")
+        self.__filename = filename
+        self.__entries = {}
+        
         try:
-            rpc_name = self.__acqRPCNamespace + item
-            return self.__RPC.__getattr__(rpc_name)
-        except:
-            raise AttributeError(item)
+            with open(self.__filename, "r") as fd:
+                stored = json.load(fd)
+            if stored.get("version") == AcqNdtConfigurationCache.Version:
+                self.__entries = stored["configurations"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            # a missing or damaged file is an empty cache
+            self.__entries = {}
+    
+    def GetFilename(self):
+        """Returns the path of the JSON file."""
+        return self.__filename
+    
+    def Restore(self, acqServer, template=None):
+        """Returns the stored configuration of the front most graph if it is still valid, otherwise None.
+        
+        The stored configuration is validated with a single batch of calls
+        requesting the graph fingerprint (see AcqNdtServer.GetGraphFingerprint()),
+        which includes the channel dividers, the data connection settings and
+        the data type, delivery, label and port of every stored channel.  If
+        AcqKnowledge cannot report the data type of the channels, the same
+        batch sets it again instead; otherwise nothing is changed within
+        AcqKnowledge.
+        
+        When valid, the channels are also restored into the channel cache of
+        acqServer and, if a template is given, the template is recorded as
+        loaded so AcqNdtServer.LoadTemplate() does not send it again.
+        
+        acqServer:	AcqNdtServer of the AcqKnowledge instance
+        template:	path of the graph template file the configuration was
+                    stored for, or None if no template is used.
+        """
+        
+        digest = ""
+        if template is not None:
+            digest = acqServer.GetTemplateDigest(template)
+        
+        entry = self.__entries.get(AcqNdtConfigurationCache.__Key(acqServer, digest))
+        if entry is None:
+            return None
+        
+        channels = [AcqNdtChannel(**stored) for stored in entry["channels"]]
+        multiple = entry["dataConnectionMethod"] == "multiple"
+        (calls, channelCalls) = AcqNdtConfigurationCache.__ValidationCalls(acqServer, channels, multiple)
+        first = len(acqServer.GraphFingerprintCalls([(c.Type, c.Index) for c in channels])) + 3
+        
+        try:
+            results = acqServer.CallBatch(calls)
+        except xc.Fault:
+            # a stored channel does not exist any more
+            return None
+        
+        fingerprint = results[:first - 3]
+        settings = [entry["dataConnectionMethod"], entry["dataConnectionHostname"], entry["singleConnectionModePort"]]
+        if fingerprint != entry["fingerprint"] or results[first - 3:first] != settings:
+            return None
+        
+        labels = []
+        ports = []
+        # the result of getDataType(), or 0 for a successful changeDataType()
+        dataType = 0
+        if "getDataType" in acqServer.DispatchedMethodList():
+            dataType = {"type":"float","endian":"big"}
+        
+        for (i, acqChannel) in enumerate(channels):
+            result = results[first + i*channelCalls:first + (i + 1)*channelCalls]
+            (delivery, label) = result[:2]
+            if delivery != acqChannel.EnabledForDelivery or result[2] != dataType:
+                return None
+            labels.append(label)
+            if multiple:
+                ports.append(result[-1])
+        
+        if labels != entry["labels"] or (multiple and ports != entry["dataConnectionPorts"]):
+            return None
+        
+        acqServer.RestoreChannels(channels)
+        if template is not None:
+            acqServer.RestoreLoadedTemplate(digest, fingerprint)
+        
+        return AcqNdtConfigurationCache.__Configuration(channels, entry)
+    
+    def Refresh(self, acqServer, template=None):
+        """Deliver all enabled channels of the front most graph and store the resulting configuration.
+        
+        The channels are discovered with AcqNdtServer.DeliverAllEnabledChannels(),
+        everything else is requested with a single batch of calls.  The data
+        connection method and ports should be changed before.
+        
+        acqServer:	AcqNdtServer of the AcqKnowledge instance
+        template:	path of the graph template file loaded into the graph, or None.
+        
+        Returns the configuration.
+        """
+        
+        channels = acqServer.DeliverAllEnabledChannels()
+        
+        calls = acqServer.GraphFingerprintCalls([(c.Type, c.Index) for c in channels])
+        first = len(calls) + 3
+        calls += [("getDataConnectionMethod", ()), ("getDataConnectionHostname", ()), ("getSingleConnectionModePort", ())]
+        calls += [("getChannelLabel", (c.GetSimpleChannelStruct(),)) for c in channels]
+        results = acqServer.CallBatch(calls)
+        
+        fingerprint = results[:first - 3]
+        (method, hostname, port) = results[first - 3:first]
+        
+        ports = None
+        if method == "multiple":
+            ports = acqServer.CallBatch([("getDataConnectionPort", (c.GetSimpleChannelStruct(),)) for c in channels])
+        
+        # the sampling rate, if available, follows the enabled channels and
+        # the transport settings in the fingerprint
+        samplingRate = None
+        if "getSamplingRate" in acqServer.DispatchedMethodList():
+            samplingRate = fingerprint[6]
+        
+        entry = {"fingerprint": fingerprint,
+                 "channels": [dict([(name, getattr(c, name)) for name in AcqNdtChannel.__slots__]) for c in channels],
+                 "labels": results[first:],
+                 "dataConnectionMethod": method,
+                 "dataConnectionHostname": hostname,
+                 "singleConnectionModePort": port,
+                 "dataConnectionPorts": ports,
+                 "samplingRate": samplingRate}
+        
+        digest = ""
+        if template is not None:
+            digest = acqServer.GetTemplateDigest(template)
+        self.__entries[AcqNdtConfigurationCache.__Key(acqServer, digest)] = entry
+        self.__Save()
+        
+        return AcqNdtConfigurationCache.__Configuration(channels, entry)
+    
+    def Remove(self, acqServer, template=None):
+        """Forget the stored configuration of an AcqKnowledge instance and template."""
+        
+        digest = ""
+        if template is not None:
+            digest = acqServer.GetTemplateDigest(template)
+        if self.__entries.pop(AcqNdtConfigurationCache.__Key(acqServer, digest), None) is not None:
+            self.__Save()
+    
+    @staticmethod
+    def __Key(acqServer, digest):
+        """Returns the key of a configuration: control connection and template digest."""
+        return "%s:%i/%s" % (acqServer.GetControlAddress() + (digest,))
+    
+    @staticmethod
+    def __ValidationCalls(acqServer, channels, multiple):
+        """Returns the batch of calls of Restore() and the number of calls per channel.
+        
+        The data type of every channel is checked, or set again if
+        AcqKnowledge cannot report it.
+        """
+        
+        calls = acqServer.GraphFingerprintCalls([(c.Type, c.Index) for c in channels])
+        calls += [("getDataConnectionMethod", ()), ("getDataConnectionHostname", ()), ("getSingleConnectionModePort", ())]
+        
+        dataTypeStruct = {"type":"float","endian":"big"}
+        for acqChannel in channels:
+            simple = acqChannel.GetSimpleChannelStruct()
+            channelCalls = [("getDataDeliveryEnabled", (simple,)), ("getChannelLabel", (simple,))]
+            if "getDataType" in acqServer.DispatchedMethodList():
+                channelCalls.append(("getDataType", (simple,)))
+            else:
+                channelCalls.append(("changeDataType", (simple, dataTypeStruct)))
+            if multiple:
+                channelCalls.append(("getDataConnectionPort", (simple,)))
+            calls += channelCalls
+        return (calls, 3 + int(multiple))
+    
+    @staticmethod
+    def __Configuration(channels, entry):
+        """Returns the configuration dictionary of a stored entry."""
+        
+        return {"channels": channels,
+                "labels": list(entry["labels"]),
+                "dataConnectionMethod": entry["dataConnectionMethod"],
+                "dataConnectionHostname": entry["dataConnectionHostname"],
+                "singleConnectionModePort": entry["singleConnectionModePort"],
+                "dataConnectionPorts": entry["dataConnectionPorts"],
+                "samplingRate": entry["samplingRate"]}
+    
+    def __Save(self):
+        """Write the configurations to the JSON file, replacing it atomically.
+        
+        The cache is only an optimization, so failing to write it is ignored.
+        """
+        
+        stored = {"version": AcqNdtConfigurationCache.Version, "configurations": self.__entries}
+        temporary = "%s.%i.tmp" % (self.__filename, os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.__filename)), exist_ok=True)
+            with open(temporary, "w") as fd:
+                json.dump(stored, fd, indent=1)
+            os.replace(temporary, self.__filename)
+        except OSError:
+            pass
 
             
 class AcqNdtChannelRecorder:
@@ -534,7 +1203,7 @@ class AcqNdtChannelRecorder:
         self.__binFile.flush()
         self.__binFile.close()
 
-    def Write(self, index, frame, channelsInSlice):
+    def Write(self, index, frame, channelsInSlice, OSCClient=None):
         """Callback function to handle data as delivered from an AcqNdtDataServer.  Writes data to the file on disk.
         
         index:	hardware sample index of the frame passed to the callback.
@@ -547,6 +1216,7 @@ class AcqNdtChannelRecorder:
                 channels were acquired in this frame of data.  The amplitude
                 of the sample of the channel is at the corresponding location
                 in the frame tuple.
+        OSCClient:	OSC client passed by AcqNdtDataServer to its callbacks, not used.
         """
         
         # if our file has already been closed by a call to Close(), no
@@ -560,10 +1230,9 @@ class AcqNdtChannelRecorder:
         
         frameIndex = 0
         for ch in channelsInSlice:
-            if self.__channel.Type != ch.Type and self.__channel.Index != ch.Index:
-                frameIndex += 1
-            else:
+            if self.__channel.Type == ch.Type and self.__channel.Index == ch.Index:
                 break
+            frameIndex += 1
 
         if frameIndex == len(frame):
             # our channel was not present in the frame.  This is expected if
@@ -572,399 +1241,3731 @@ class AcqNdtChannelRecorder:
             
             return
 
-        # put call for data storing into Try/Except bracket to hide any possible run-time exception
-        try:
-            self.__binFile.write(struct.pack("d",frame[frameIndex]))
-        except:
-            pass
+        self.__binFile.write(struct.pack("d",frame[frameIndex]))
 
-            
-class AcqNdtDataServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
-    """Receives binary data from AcqKnowledge during acquisitions using the network data transfer protocol and invokes callbacks to allow clients to process the data.
+
+class AcqNdtSessionRecorder:
+    """Records all of the channels received by an AcqNdtDataServer into a single self-describing file.
     
-    Prior to starting the acquisition, the AcqNdtDataServer objects must be
-    created, callbacks registered using RegisterCallback(), and Start() invoked.
+    Blocks are buffered in memory and written to disk in large writes.  The
+    file starts with a header describing the channels (type, index,
+    SamplingDivider, label), the hardware sampling rate and the frame
+    layout, followed by the received values exactly as delivered by
+    AcqKnowledge: big endian float32, one row per period of the frame
+    schedule.  The data starts at an offset aligned to HeaderAlignment bytes
+    so the file may be memory-mapped by AcqNdtSessionReader.
     
-    If the delivery method used by the AcqNdtServer is 'single', then only
-    one AcqNdtDataServer object should be used.  If the delivery method used
-    by the AcqNdtServer is 'multiple', then there should be one AcqNdtDataServer
-    object created for each channel of data being received.
+    Register the Write member function as a block callback:
     
-    After the acquisition is finished, Stop() should be invoked for each
-    AcqNdtDataServer to clean up processing and release network resources
-    used only during the acquisition.
+        dataServer.RegisterBlockCallback("Record", recorder.Write)
+    
+    Write errors are never hidden: they are raised from Write() or Close().
+    Blocks must be contiguous; a block that does not start where the
+    previous one ended raises an ACQException.
     """
     
-    def __init__(self, port, channels,OSCHostname,OSCport):
+    ## identifies session files, followed by the header length and JSON header
+    Magic = b"ACQNDTS1"
+    
+    ## alignment of the start of the data in the file
+    HeaderAlignment = 4096
+    
+    def __init__(self, filename, schedule, sampleRate=None, labels=None, flushBytes=1 << 20):
         """Default constructor.
         
-        The arguments supplied to the constructor should vary depending on
-        the transfer mode of the AcqNdtServer object.
+        filename:	path to the file on disk where the session should be kept.
+                    Previous file contents will be overwritten.
+        schedule:	AcqNdtFrameSchedule of the data server being recorded, as
+                    returned by AcqNdtDataServer.GetFrameSchedule().
+        sampleRate:	hardware acquisition sampling rate in Hz, for example
+                    AcqNdtServer.getSamplingRate(), or None if unknown.
+        labels:		optional list of channel labels in the order of the
+                    schedule channels, for example from AcqNdtServer.GetChannelLabel().
+        flushBytes:	amount of buffered data after which it is written to disk.
+        """
         
+        if labels is not None and len(labels) != len(schedule.GetChannels()):
+            raise ACQException("One label is required for each channel")
         
-        If AcqNdtServer.getDataConnectionMethod()=='single'
+        self.__schedule = schedule
+        self.__labels = labels
+        self.__sampleRate = sampleRate
+        self.__flushBytes = int(flushBytes)
         
-        port:	set this paramter to AcqNdtServer.getSingleConnectionModePort()
-        channels:	set this paramter to a list of all of the AcqNdtChannel objects
-                    that are set for delivery.  This list may be determined by the
-                    following list comprehension:
-                    
-                    [x for x in AcqNdtServer.GetAllChannels() if x.EnabledForDelivery]
+        self.__buffer = bytearray()
+        self.__nextIndex = None
+        self.__rows = 0
+        self.__lock = threading.Lock()
+        self.__binFile = open(filename, "wb")
+    
+    def __del__(self):
+        """Default destructor.
         
+        Closes any open filehandles which will no longer be referenced after
+        this object no longer exists.
+        """
         
-        If AcqNdtServer.getDataConnection()=='multiple', construct one object
-        for a specific AcqNdtChannel c using:
+        try:
+            self.Close()
+        except:
+            pass
+    
+    def GetRecordedRows(self):
+        """Returns the number of block rows (periods of the frame schedule) recorded so far.
+        """
+        return self.__rows
+    
+    @staticmethod
+    def EncodeHeader(schedule, startIndex, sampleRate=None, labels=None):
+        """Returns the header of a session file, including the padding up to the start of the data.
+        
+        schedule:	AcqNdtFrameSchedule of the recorded data.
+        startIndex:	hardware sample index of the first recorded row.
+        sampleRate:	hardware acquisition sampling rate in Hz, or None if unknown.
+        labels:		optional list of channel labels in the order of the schedule channels.
+        """
         
-        port:	set this paramter to AcqNdtServer.GetDataConneciton(c)
-        channels:	set this parameter to a single element list with the channel object, e.g.
+        channels = schedule.GetChannels()
+        if labels is None:
+            labels = [None]*len(channels)
+        
+        header = {"version": 1,
+                  "sampleRate": sampleRate,
+                  "startIndex": startIndex,
+                  "period": schedule.GetPeriod(),
+                  "periodValues": schedule.GetPeriodValues(),
+                  "dtype": ">f4",
+                  "channels": [{"type": ch.Type,
+                                "index": ch.Index,
+                                "samplingDivider": ch.SamplingDivider,
+                                "scale": ch.Scale,
+                                "offset": ch.Offset,
+                                "label": label} for (ch, label) in zip(channels, labels)]}
+        
+        encoded = json.dumps(header).encode("utf-8")
+        fixedSize = len(AcqNdtSessionRecorder.Magic) + 8
+        dataOffset = -(-(fixedSize + len(encoded)) // AcqNdtSessionRecorder.HeaderAlignment)*AcqNdtSessionRecorder.HeaderAlignment
+        
+        return AcqNdtSessionRecorder.Magic + struct.pack("<LL", len(encoded), dataOffset) + encoded \
+               + b"\0"*(dataOffset - fixedSize - len(encoded))
+    
+    def Write(self, startIndex, block):
+        """Block callback buffering the received block and writing it to disk when enough data is buffered.
         
-                    [c]
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array as passed to AcqNdtDataServer block callbacks
         """
-
-        self.__OSCport = OSCport
-        self.__OSCHostname = OSCHostname
-        self.OSCClient = udp_client.SimpleUDPClient(self.__OSCHostname, self.__OSCport)
-
-        self.__enabledChannels = channels
-        
-        self.__callBacks = {}
-        self.__closedCallBacks = {}
-        self.__collect = True
         
-        self.__collectorThread = threading.Thread(target=self.handle_request)
+        with self.__lock:
+            if self.__binFile.closed:
+                raise ACQException("Session recorder is already closed")
+            
+            if self.__nextIndex is None:
+                self.__WriteHeader(startIndex)
+            elif startIndex != self.__nextIndex:
+                raise ACQException("Block at hardware index %i does not follow the recorded data ending at %i" % (startIndex, self.__nextIndex))
+            
+            self.__buffer += numpy.ascontiguousarray(block, dtype='>f4').tobytes()
+            self.__rows += len(block)
+            self.__nextIndex = startIndex + len(block)*self.__schedule.GetPeriod()
+            
+            if len(self.__buffer) >= self.__flushBytes:
+                self.__Flush()
+    
+    def Flush(self):
+        """Write all buffered data to disk.
+        """
+        with self.__lock:
+            if not self.__binFile.closed:
+                if self.__nextIndex is None:
+                    self.__WriteHeader(0)
+                self.__Flush()
+    
+    def Close(self):
+        """Write any remaining data to the file and close open filehandles.
+        """
+        with self.__lock:
+            if self.__binFile.closed:
+                return
+            try:
+                if self.__nextIndex is None:
+                    self.__WriteHeader(0)
+                self.__Flush()
+            finally:
+                self.__binFile.close()
+    
+    def __WriteHeader(self, startIndex):
+        """Write the file header.  Must be called with the lock held."""
+        
+        self.__binFile.write(self.EncodeHeader(self.__schedule, startIndex, self.__sampleRate, self.__labels))
+        self.__nextIndex = startIndex
+    
+    def __Flush(self):
+        """Write the buffered data.  Must be called with the lock held."""
+        
+        if len(self.__buffer):
+            self.__binFile.write(self.__buffer)
+            self.__buffer = bytearray()
+        self.__binFile.flush()
+
+
+class AcqNdtSessionReader:
+    """Reads session files written by AcqNdtSessionRecorder without loading them into memory.
+    
+    The data of the file is opened with numpy.memmap, so opening a file only
+    reads its header and takes the same time regardless of the file size.
+    Channel data is returned as numpy arrays which, where the layout allows
+    it, are views into the memory-mapped file; only the requested range is
+    read from disk when the values are accessed.
+    
+    Values are returned as big endian float32, as delivered by AcqKnowledge.
+    Use astype() to convert them for further processing.
+    
+    Channels may be referred to by their position in GetChannels(), by their
+    label, by a (type, index) tuple or by an AcqNdtChannel object.
+    """
+    
+    def __init__(self, filename):
+        """Default constructor.
+        
+        filename:	path to a session file written by AcqNdtSessionRecorder.
+        """
+        
+        with open(filename, "rb") as fd:
+            fixed = fd.read(len(AcqNdtSessionRecorder.Magic) + 8)
+            if len(fixed) != len(AcqNdtSessionRecorder.Magic) + 8 or not fixed.startswith(AcqNdtSessionRecorder.Magic):
+                raise ACQException("'" + str(filename) + "' is not an NDT session file")
+            (headerLength, dataOffset) = struct.unpack("<LL", fixed[len(AcqNdtSessionRecorder.Magic):])
+            self.__header = json.loads(fd.read(headerLength).decode("utf-8"))
+        
+        self.__channels = AcqNdtSessionReader.ChannelsFromHeader(self.__header)
+        self.__schedule = AcqNdtFrameSchedule(self.__channels)
+        self.__period = self.__schedule.GetPeriod()
+        periodValues = self.__schedule.GetPeriodValues()
+        
+        rows = (os.path.getsize(filename) - dataOffset)//self.__schedule.GetPeriodSize()
+        if rows > 0:
+            self.__data = numpy.memmap(filename, dtype=self.__header["dtype"], mode="r",
+                                       offset=dataOffset, shape=(rows, periodValues))
+        else:
+            self.__data = numpy.zeros((0, periodValues), dtype=self.__header["dtype"])
+    
+    @staticmethod
+    def ChannelsFromHeader(header):
+        """Returns the list of AcqNdtChannel objects described by a session file header.
+        
+        header:	dictionary decoded from the JSON header, see AcqNdtSessionRecorder.EncodeHeader().
+        """
+        
+        channels = []
+        for info in header["channels"]:
+            ch = AcqNdtChannel()
+            ch.Type = info["type"]
+            ch.Index = info["index"]
+            ch.DataSize = 4
+            ch.SamplingDivider = info["samplingDivider"]
+            ch.Scale = info["scale"]
+            ch.Offset = info["offset"]
+            ch.EnabledForDelivery = True
+            channels.append(ch)
+        return channels
+    
+    def GetHeader(self):
+        """Returns the header of the file as a dictionary.
+        """
+        return dict(self.__header)
+    
+    def GetChannels(self):
+        """Returns the list of AcqNdtChannel objects recorded in the file.
+        """
+        return list(self.__channels)
+    
+    def GetLabels(self):
+        """Returns the list of channel labels in the order of GetChannels().
+        """
+        return [info["label"] for info in self.__header["channels"]]
+    
+    def GetSampleRate(self):
+        """Returns the hardware acquisition sampling rate in Hz, or None if it was not recorded.
+        """
+        return self.__header["sampleRate"]
+    
+    def GetFrameSchedule(self):
+        """Returns the AcqNdtFrameSchedule of the recorded frames.
+        """
+        return self.__schedule
+    
+    def GetStartIndex(self):
+        """Returns the hardware sample index of the first recorded frame.
+        """
+        return self.__header["startIndex"]
+    
+    def GetEndIndex(self):
+        """Returns the hardware sample index following the last recorded period.
+        """
+        return self.__header["startIndex"] + len(self.__data)*self.__period
+    
+    def GetDuration(self):
+        """Returns the recorded duration in seconds.
+        """
+        return (self.GetEndIndex() - self.GetStartIndex())/float(self.__RequireSampleRate())
+    
+    def GetChannelData(self, channel, startIndex=None, endIndex=None):
+        """Returns the samples of a channel acquired within a range of hardware sample indexes.
+        
+        channel:	channel position, label, (type, index) tuple or AcqNdtChannel.
+        startIndex:	first hardware sample index of the range, or None for the
+                    start of the recording.
+        endIndex:	hardware sample index ending the range (not included), or
+                    None for the end of the recording.
+        
+        Returns a numpy array with the samples of the channel at its own
+        sampling rate.  Use GetChannelIndexes() with the same range to obtain
+        their hardware sample indexes.
+        """
+        
+        position = self.__Position(channel)
+        (first, end) = self.__SampleRange(position, startIndex, endIndex)
+        
+        perRow = self.__period//self.__channels[position].SamplingDivider
+        columns = self.__schedule.GetChannelColumns(position)
+        firstRow = first//perRow
+        endRow = -(-end//perRow)
+        
+        if perRow == 1:
+            return self.__data[firstRow:endRow, columns[0]]
+        
+        rows = self.__data[firstRow:endRow]
+        return rows[:, columns].ravel()[first - firstRow*perRow:end - firstRow*perRow]
+    
+    def GetChannelIndexes(self, channel, startIndex=None, endIndex=None):
+        """Returns the hardware sample indexes of the samples returned by GetChannelData() for the same arguments.
+        """
+        
+        position = self.__Position(channel)
+        (first, end) = self.__SampleRange(position, startIndex, endIndex)
+        divider = self.__channels[position].SamplingDivider
+        return self.GetStartIndex() + numpy.arange(first, end)*divider
+    
+    def GetChannelDataByTime(self, channel, startTime=None, endTime=None):
+        """Returns the samples of a channel acquired within a time range.
+        
+        channel:	channel position, label, (type, index) tuple or AcqNdtChannel.
+        startTime:	start of the range in seconds from the first recorded frame,
+                    or None for the start of the recording.
+        endTime:	end of the range in seconds (not included), or None for the
+                    end of the recording.
+        """
+        return self.GetChannelData(channel, self.TimeToIndex(startTime), self.TimeToIndex(endTime))
+    
+    def TimeToIndex(self, seconds):
+        """Converts a time in seconds from the first recorded frame to a hardware sample index.
+        
+        None is returned unchanged.
+        """
+        if seconds is None:
+            return None
+        return self.GetStartIndex() + int(math.ceil(seconds*self.__RequireSampleRate()))
+    
+    def __RequireSampleRate(self):
+        """Returns the sample rate or raises if the file does not have one."""
+        if not self.__header["sampleRate"]:
+            raise ACQException("The session file does not record its sample rate")
+        return self.__header["sampleRate"]
+    
+    def __Position(self, channel):
+        """Resolve a channel reference into its position in the channel list."""
+        
+        if isinstance(channel, int):
+            if 0 <= channel < len(self.__channels):
+                return channel
+        elif isinstance(channel, str):
+            labels = self.GetLabels()
+            if channel in labels:
+                return labels.index(channel)
+        else:
+            if isinstance(channel, AcqNdtChannel):
+                channel = (channel.Type, channel.Index)
+            for (position, ch) in enumerate(self.__channels):
+                if (ch.Type, ch.Index) == tuple(channel):
+                    return position
+        
+        raise ACQException("Channel " + str(channel) + " is not in the session file")
+    
+    def __SampleRange(self, position, startIndex, endIndex):
+        """Convert a hardware index range into a range of channel samples."""
+        
+        divider = self.__channels[position].SamplingDivider
+        count = len(self.__data)*(self.__period//divider)
+        
+        first = 0
+        end = count
+        if startIndex is not None:
+            first = min(count, max(0, -(-(startIndex - self.GetStartIndex())//divider)))
+        if endIndex is not None:
+            end = min(count, max(first, -(-(endIndex - self.GetStartIndex())//divider)))
+        
+        return (first, end)
+
+
+class AcqNdtFrameSchedule:
+    """Precomputed layout of the frames delivered over a data connection.
+    
+    In 'single' connection mode AcqKnowledge only includes a channel in the
+    frame of a hardware sample index when the index is a multiple of the
+    channel SamplingDivider.  The resulting pattern repeats every
+    LCM(SamplingDivider) hardware samples, the period of the schedule, so
+    the channels, binary format and byte offset of every frame within one
+    period are computed once when the object is constructed.
+    
+    AcqNdtDataServer builds one of these from its channels.  It may be
+    retrieved with AcqNdtDataServer.GetFrameSchedule().
+    """
+    
+    def __init__(self, channels):
+        """Default constructor.
+        
+        channels:	list of AcqNdtChannel objects in the order in which their
+                    values are delivered within each frame.
+        """
+        
+        self.__channels = tuple(channels)
+        
+        period = 1
+        for ch in self.__channels:
+            period = period*ch.SamplingDivider // math.gcd(period, ch.SamplingDivider)
+        self.__period = period
+        
+        # for each hardware sample position within the period, keep the
+        # tuple of channels in the frame, a precompiled struct to decode
+        # the frame and the byte offset of the frame within the period.
+        
+        self.__slices = []
+        self.__frames = []
+        columns = [[] for ch in self.__channels]
+        offset = 0
+        for phase in range(period):
+            positions = [i for (i, ch) in enumerate(self.__channels) if (phase % ch.SamplingDivider) == 0]
+            channelsInSlice = tuple([self.__channels[i] for i in positions])
+            frameStruct = struct.Struct(">" + "f"*len(channelsInSlice))
+            
+            for (column, i) in enumerate(positions):
+                columns[i].append(offset//4 + column)
+            
+            self.__slices.append((channelsInSlice, frameStruct, offset))
+            if len(channelsInSlice) != 0:
+                self.__frames.append((phase, channelsInSlice, offset//4, offset//4 + len(channelsInSlice)))
+            offset += frameStruct.size
+        
+        self.__periodSize = offset
+        self.__columns = [numpy.array(c, dtype=numpy.intp) for c in columns]
+        self.__uniform = len(self.__frames) == 1 and len(self.__frames[0][1]) == len(self.__channels)
+    
+    def GetChannels(self):
+        """Returns the tuple of AcqNdtChannel objects described by the schedule.
+        """
+        return self.__channels
+    
+    def GetPeriod(self):
+        """Returns the number of hardware samples after which the frame layout repeats.
+        """
+        return self.__period
+    
+    def GetPeriodSize(self):
+        """Returns the number of bytes delivered for one period of hardware samples.
+        """
+        return self.__periodSize
+    
+    def GetPeriodValues(self):
+        """Returns the number of amplitude values delivered for one period of hardware samples.
+        """
+        return self.__periodSize//4
+    
+    def IsUniform(self):
+        """Returns True if every channel has a value in every delivered frame.
+        
+        This is the case when all of the channels share the same
+        SamplingDivider.  Blocks of a uniform schedule have one column
+        per channel.
+        """
+        return self.__uniform
+    
+    def GetSlice(self, index):
+        """Returns the precomputed layout of the frame at a hardware sample index.
+        
+        index:	hardware sample index of the frame
+        
+        Returns a tuple (channelsInSlice, frameStruct, offset) where
+        channelsInSlice is the tuple of AcqNdtChannel objects in the frame,
+        frameStruct a struct.Struct decoding the frame and offset the byte
+        offset of the frame within its period.
+        """
+        return self.__slices[index % self.__period]
+    
+    def GetFrames(self):
+        """Returns the layout of the frames that carry data within one period.
+        
+        Returns a list of (phase, channelsInSlice, firstValue, endValue) tuples,
+        one for each non empty frame of the period, where phase is the
+        hardware sample offset of the frame within the period and
+        firstValue:endValue the range of its values within a period row.
+        """
+        return list(self.__frames)
+    
+    def GetChannelColumns(self, position):
+        """Returns the columns of a period row holding the samples of a channel.
+        
+        position:	position of the channel in GetChannels()
+        
+        Returns a numpy array of column numbers, one for each sample the
+        channel has within one period, in acquisition order.
+        """
+        return self.__columns[position]
+    
+    def Deinterleave(self, block):
+        """Split a block of received data into one array per channel.
+        
+        block:	either a bytes-like object holding whole periods of big endian
+                float32 data or a numpy array of shape (periods, GetPeriodValues())
+                as passed to block callbacks.  The first value must be the
+                start of a period.
+        
+        Returns a list of one dimensional numpy arrays in the channel order
+        of the schedule.  Each array holds the samples of its channel at the
+        channel sampling rate, i.e. sample k of a channel was acquired
+        at hardware sample startIndex + k * SamplingDivider.
+        """
+        
+        if not isinstance(block, numpy.ndarray):
+            block = numpy.frombuffer(block, dtype='>f4')
+        
+        block = block.reshape(-1, self.GetPeriodValues())
+        
+        channelData = []
+        for columns in self.__columns:
+            if len(columns) == 1:
+                channelData.append(block[:, columns[0]])
+            else:
+                channelData.append(block[:, columns].ravel())
+        
+        return channelData
+
+
+class AcqNdtReceiveBuffer:
+    """Reusable buffer accumulating bytes received from a data connection.
+    
+    TCP may return any number of bytes from a read, including only part of
+    a frame.  Bytes are read with recv_into() directly into one preallocated
+    bytearray and handed out only as whole units (periods of the frame
+    schedule), as views into the buffer without copying them.  Consumed
+    space is reclaimed by moving the remaining incomplete unit, which is
+    always smaller than one unit, back to the start of the buffer.
+    
+    Views returned by GetView() and GetArray() are only valid until the
+    next call to Receive().
+    """
+    
+    def __init__(self, units, unitSize):
+        """Default constructor.
+        
+        units:		number of whole units the buffer should be able to hold
+        unitSize:	size of one unit in bytes
+        """
+        
+        self.__unitSize = unitSize
+        # keep room for at least two units so compacting never overlaps
+        self.__buf = bytearray(max(units, 2)*unitSize)
+        self.__view = memoryview(self.__buf)
+        self.__read = 0
+        self.__write = 0
+    
+    def Receive(self, sock):
+        """Read available bytes from a socket into the free space of the buffer.
+        
+        sock:	connected socket to read from
+        
+        Returns the number of bytes read.  Zero means the peer closed the
+        connection.
+        """
+        
+        received = sock.recv_into(self.GetFreeView())
+        self.Commit(received)
+        return received
+    
+    def GetFreeView(self):
+        """Returns a writable memoryview of the free space at the end of the buffer.
+        
+        Used to receive data directly into the buffer, for example by
+        asyncio.BufferedProtocol.get_buffer().  Bytes written into the view
+        must be committed with Commit().
+        """
+        
+        if self.__write == len(self.__buf):
+            pending = self.__write - self.__read
+            self.__view[:pending] = self.__view[self.__read:self.__write]
+            self.__read = 0
+            self.__write = pending
+        
+        return self.__view[self.__write:]
+    
+    def Commit(self, received):
+        """Account for bytes written into the view returned by GetFreeView().
+        
+        received:	number of bytes written
+        """
+        self.__write += received
+    
+    def GetAvailableUnits(self):
+        """Returns the number of whole units received and not consumed yet.
+        """
+        return (self.__write - self.__read)//self.__unitSize
+    
+    def GetView(self, units):
+        """Returns a memoryview of the next whole units without copying them.
+        
+        units:	number of units, at most GetAvailableUnits()
+        """
+        return self.__view[self.__read:self.__read + units*self.__unitSize]
+    
+    def GetArray(self, units, dtype='>f4'):
+        """Returns a numpy view of the next whole units without copying them.
+        
+        units:	number of units, at most GetAvailableUnits()
+        dtype:	numpy data type of the values in the buffer
+        """
+        dtype = numpy.dtype(dtype)
+        return numpy.frombuffer(self.__buf, dtype=dtype, count=units*self.__unitSize//dtype.itemsize, offset=self.__read)
+    
+    def Consume(self, units):
+        """Mark whole units as processed so their space may be reused.
+        
+        units:	number of units, at most GetAvailableUnits()
+        """
+        self.__read += units*self.__unitSize
+        if self.__read == self.__write:
+            self.__read = 0
+            self.__write = 0
+
+
+class AcqNdtIovec(ctypes.Structure):
+    """struct iovec of the C library, used by AcqNdtDatagramBuffer."""
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class AcqNdtMsghdr(ctypes.Structure):
+    """struct msghdr of the C library, used by AcqNdtDatagramBuffer."""
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.c_void_p), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class AcqNdtMmsghdr(ctypes.Structure):
+    """struct mmsghdr of the C library, used by AcqNdtDatagramBuffer."""
+    _fields_ = [("msg_hdr", AcqNdtMsghdr), ("msg_len", ctypes.c_uint)]
+
+
+class AcqNdtDatagramBuffer:
+    """Reusable buffers receiving many datagrams with a single system call.
+    
+    Where the C library provides recvmmsg() (Linux), all datagrams waiting
+    on a socket, up to the number of buffers, are received with one call.
+    Otherwise they are received one by one with recv_into().  In both
+    cases datagrams are written directly into preallocated memory and
+    handed out as views, which are only valid until the next call to
+    Receive().
+    """
+    
+    ## recvmmsg() flag returning immediately when no datagram is waiting
+    MSG_DONTWAIT = 0x40
+    
+    def __init__(self, datagrams=64, datagramSize=65536):
+        """Default constructor.
+        
+        datagrams:	maximum number of datagrams received at once.
+        datagramSize:	size of the buffer of each datagram in bytes.  Longer
+                    datagrams are truncated.
+        """
+        
+        self.__datagrams = int(datagrams)
+        self.__datagramSize = int(datagramSize)
+        self.__buf = bytearray(self.__datagrams*self.__datagramSize)
+        self.__view = memoryview(self.__buf)
+        self.__lengths = [0]*self.__datagrams
+        self.__count = 0
+        
+        self.__messages = None
+        if recvmmsg is not None:
+            base = ctypes.addressof((ctypes.c_char*len(self.__buf)).from_buffer(self.__buf))
+            self.__iovecs = (AcqNdtIovec*self.__datagrams)()
+            self.__messages = (AcqNdtMmsghdr*self.__datagrams)()
+            for i in range(self.__datagrams):
+                self.__iovecs[i].iov_base = base + i*self.__datagramSize
+                self.__iovecs[i].iov_len = self.__datagramSize
+                self.__messages[i].msg_hdr.msg_iov = ctypes.addressof(self.__iovecs[i])
+                self.__messages[i].msg_hdr.msg_iovlen = 1
+    
+    def UsesRecvmmsg(self):
+        """Returns whether datagrams are received with recvmmsg().
+        """
+        return self.__messages is not None
+    
+    def Receive(self, sock):
+        """Receive the datagrams waiting on a non blocking socket without waiting for more.
+        
+        sock:	bound socket with blocking disabled, e.g. after select()
+        
+        Returns the number of datagrams received, zero if none was waiting.
+        """
+        
+        self.__count = 0
+        if self.__messages is not None:
+            received = recvmmsg(sock.fileno(), self.__messages, self.__datagrams, self.MSG_DONTWAIT, None)
+            if received < 0:
+                error = ctypes.get_errno()
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return 0
+                raise OSError(error, os.strerror(error))
+            for i in range(received):
+                self.__lengths[i] = min(self.__messages[i].msg_len, self.__datagramSize)
+            self.__count = received
+            return received
+        
+        while self.__count < self.__datagrams:
+            offset = self.__count*self.__datagramSize
+            try:
+                length = sock.recv_into(self.__view[offset:offset + self.__datagramSize])
+            except (BlockingIOError, InterruptedError):
+                break
+            self.__lengths[self.__count] = length
+            self.__count += 1
+        return self.__count
+    
+    def GetDatagram(self, i):
+        """Returns a memoryview of datagram i of the last Receive() without copying it.
+        """
+        offset = i*self.__datagramSize
+        return self.__view[offset:offset + self.__lengths[i]]
+
+
+class AcqNdtDatagramAssembler:
+    """Assembles the frames of numbered datagrams into block rows, accounting for lost, duplicated and reordered data.
+    
+    Every datagram carries a sequence number and the hardware sample index
+    of its first frame (see AcqNdtDataUDPServer).  Datagrams are assembled
+    in sequence order.  A datagram arriving before the previous ones is
+    held until they arrive, for at most reorderDatagrams held datagrams;
+    the missing ones are then given up as lost.
+    
+    A gap in the hardware sample indexes is either filled or skipped:
+    
+        None:		the incomplete period before the gap is discarded and
+                    the block indexes jump past the gap.
+        "nan":		the missing values are set to NaN.
+        "hold":		the missing values repeat the last value of their column.
+        "linear":	the missing values are interpolated between the last value
+                    of their column before the gap and the first one after it.
+    
+    Gaps longer than maxFillFrames frames are always skipped.  Complete
+    rows are passed to deliver(startIndex, block, receiveTime) as views
+    which are only valid until it returns.
+    """
+    
+    ## supported gap filling modes
+    GapFillModes = (None, "nan", "hold", "linear")
+    
+    def __init__(self, schedule, deliver, blockFrames=1024, gapFill=None, reorderDatagrams=0, maxFillFrames=65536):
+        """Default constructor.
+        
+        schedule:	AcqNdtFrameSchedule of the received frames.
+        deliver:	function invoked with complete rows, with the signature
+                    "f(startIndex, block, receiveTime)".
+        blockFrames:	maximum number of rows delivered at once.
+        gapFill:	gap filling mode, see above.
+        reorderDatagrams:	maximum number of datagrams held while waiting for
+                    earlier ones.
+        maxFillFrames:	longest gap in frames which is filled.
+        """
+        
+        if gapFill not in self.GapFillModes:
+            raise ACQException("Unknown gap filling mode '%s'" % (gapFill))
+        
+        self.__deliver = deliver
+        self.__gapFill = gapFill
+        self.__reorderDatagrams = int(reorderDatagrams)
+        self.__maxFillFrames = maxFillFrames
+        
+        self.__period = schedule.GetPeriod()
+        self.__periodValues = schedule.GetPeriodValues()
+        
+        # value offset and number of preceding data frames of every phase
+        # of the period, and phase of the frame starting at every offset
+        self.__firstValue = [schedule.GetSlice(phase)[2]//4 for phase in range(self.__period)]
+        self.__framesBefore = [0]
+        for phase in range(self.__period):
+            self.__framesBefore.append(self.__framesBefore[-1] + (1 if len(schedule.GetSlice(phase)[0]) else 0))
+        self.__phaseAt = {}
+        for (phase, channelsInSlice, first, end) in schedule.GetFrames():
+            self.__phaseAt[first] = phase
+        
+        self.__blockValues = int(blockFrames)*self.__periodValues
+        self.__rows = numpy.empty(self.__blockValues + self.__periodValues, dtype='>f4')
+        self.__filled = 0
+        self.__rowStart = None
+        
+        self.__nextSequence = None
+        self.__nextIndex = None
+        self.__held = {}
+        self.__missing = set()
+        
+        # last value of every column and its absolute value position
+        self.__last = numpy.full(self.__periodValues, numpy.nan)
+        self.__lastPosition = numpy.zeros(self.__periodValues, dtype=numpy.int64)
+        
+        self.ResetStatistics()
+    
+    def GetStatistics(self):
+        """Returns a dictionary of counters of the assembled data.
+        
+        frames:		frames assembled from received datagrams.
+        lostDatagrams:	datagrams given up as lost.
+        lateDatagrams:	datagrams dropped because they arrived after being
+                    given up as lost.
+        lostFrames:	frames missing from the hardware sample indexes.
+        filledFrames:	lost frames replaced according to the gap filling mode.
+        duplicatedFrames:	frames received more than once and dropped.
+        reorderedFrames:	frames received after later ones and still assembled
+                    in order.
+        lateFrames:	frames of the late datagrams.
+        """
+        return dict(self.__statistics)
+    
+    def ResetStatistics(self):
+        """Set all counters returned by GetStatistics() to zero.
+        """
+        self.__statistics = {"frames": 0, "lostDatagrams": 0, "lateDatagrams": 0, "lostFrames": 0, "filledFrames": 0,
+                             "duplicatedFrames": 0, "reorderedFrames": 0, "lateFrames": 0}
+    
+    def Put(self, sequence, index, values, receiveTime):
+        """Assemble the frames of one datagram.
+        
+        sequence:	32 bit sequence number of the datagram.
+        index:		32 bit hardware sample index of its first frame.
+        values:		numpy array of the big endian float32 values of its frames,
+                    copied if the datagram has to be held.
+        receiveTime:	time.monotonic() value at which it was received.
+        
+        Returns False if the datagram does not hold whole frames.
+        """
+        
+        # the counters are 32 bit, extend them relative to the expected values
+        if self.__nextSequence is not None:
+            sequence = self.__Unwrap(sequence, self.__nextSequence)
+            index = self.__Unwrap(index, self.__nextIndex)
+        
+        if (self.__firstValue[index % self.__period] + len(values)) % self.__periodValues not in self.__phaseAt:
+            return False
+        
+        if self.__nextSequence is None:
+            self.__Append(sequence, index, values, receiveTime)
+        elif sequence < self.__nextSequence:
+            frames = self.__CountFrames(index, self.__EndIndex(index, len(values)))
+            if sequence in self.__missing:
+                self.__missing.discard(sequence)
+                self.__statistics["lateDatagrams"] += 1
+                self.__statistics["lateFrames"] += frames
+            else:
+                self.__statistics["duplicatedFrames"] += frames
+        elif sequence in self.__held:
+            self.__statistics["duplicatedFrames"] += self.__CountFrames(index, self.__EndIndex(index, len(values)))
+        elif sequence > self.__nextSequence:
+            self.__held[sequence] = (index, values.copy())
+            if len(self.__held) > self.__reorderDatagrams:
+                self.__GiveUp(receiveTime)
+        else:
+            if len(self.__held):
+                self.__statistics["reorderedFrames"] += self.__CountFrames(index, self.__EndIndex(index, len(values)))
+            self.__Append(sequence, index, values, receiveTime)
+            self.__Release(receiveTime)
+        
+        return True
+    
+    def Flush(self, receiveTime):
+        """Deliver all complete rows.
+        """
+        
+        complete = self.__filled//self.__periodValues
+        if complete == 0:
+            return
+        
+        values = complete*self.__periodValues
+        self.__deliver(self.__rowStart, self.__rows[:values].reshape(complete, self.__periodValues), receiveTime)
+        
+        remaining = self.__filled - values
+        self.__rows[:remaining] = self.__rows[values:self.__filled]
+        self.__filled = remaining
+        self.__rowStart += complete*self.__period
+    
+    def End(self, receiveTime):
+        """Give up all missing datagrams and deliver all complete rows.  Called at the end of the data.
+        """
+        while len(self.__held):
+            self.__GiveUp(receiveTime)
+        self.Flush(receiveTime)
+    
+    def __Unwrap(self, counter, expected):
+        """Returns the 64 bit value of a 32 bit counter closest to its expected value."""
+        return expected + ((counter - expected + (1 << 31)) % (1 << 32)) - (1 << 31)
+    
+    def __Position(self, index):
+        """Returns the absolute value position of the frame at a hardware sample index."""
+        return (index//self.__period)*self.__periodValues + self.__firstValue[index % self.__period]
+    
+    def __CountFrames(self, startIndex, endIndex):
+        """Returns the number of data frames between two hardware sample indexes."""
+        frames = self.__framesBefore[-1]
+        return ((endIndex//self.__period)*frames + self.__framesBefore[endIndex % self.__period]) \
+               - ((startIndex//self.__period)*frames + self.__framesBefore[startIndex % self.__period])
+    
+    def __EndIndex(self, index, values):
+        """Returns the hardware sample index of the frame following values values starting at index."""
+        phase = index % self.__period
+        end = self.__firstValue[phase] + values
+        return index - phase + (end//self.__periodValues)*self.__period + self.__phaseAt[end % self.__periodValues]
+    
+    def __GiveUp(self, receiveTime):
+        """Give up the datagrams missing before the first held one as lost, and assemble the held ones."""
+        
+        sequence = min(self.__held)
+        self.__statistics["lostDatagrams"] += sequence - self.__nextSequence
+        self.__missing.update(range(max(self.__nextSequence, sequence - 4096), sequence))
+        if len(self.__missing) > 4096:
+            self.__missing = set([s for s in self.__missing if s >= sequence - 4096])
+        
+        (index, values) = self.__held.pop(sequence)
+        self.__Append(sequence, index, values, receiveTime)
+        self.__Release(receiveTime)
+    
+    def __Release(self, receiveTime):
+        """Assemble the held datagrams following the assembled ones."""
+        while self.__nextSequence in self.__held:
+            (index, values) = self.__held.pop(self.__nextSequence)
+            self.__Append(self.__nextSequence, index, values, receiveTime)
+    
+    def __Append(self, sequence, index, values, receiveTime):
+        """Assemble the frames of the next datagram in sequence order, filling or skipping a gap before it."""
+        
+        self.__nextSequence = sequence + 1
+        endIndex = self.__EndIndex(index, len(values))
+        
+        if self.__nextIndex is not None and index < self.__nextIndex:
+            # overlaps frames already assembled
+            self.__statistics["duplicatedFrames"] += self.__CountFrames(index, endIndex)
+            return
+        
+        if index != self.__nextIndex:
+            gap = 0
+            if self.__nextIndex is not None:
+                gap = self.__CountFrames(self.__nextIndex, index)
+                self.__statistics["lostFrames"] += gap
+            
+            if self.__nextIndex is not None and self.__gapFill is not None and gap <= self.__maxFillFrames:
+                self.__Fill(index, values, receiveTime)
+                self.__statistics["filledFrames"] += gap
+            else:
+                # deliver the rows before the gap, drop the incomplete one
+                # and restart at the next period
+                if self.__rowStart is not None:
+                    self.Flush(receiveTime)
+                phase = index % self.__period
+                values = values[(self.__periodValues - self.__firstValue[phase]) % self.__periodValues:]
+                self.__rowStart = index - phase + (self.__period if phase else 0)
+                self.__filled = 0
+        
+        self.__statistics["frames"] += self.__CountFrames(index, endIndex)
+        self.__nextIndex = endIndex
+        self.__AppendValues(values, receiveTime)
+    
+    def __Fill(self, index, values, receiveTime):
+        """Append the values replacing the frames between the assembled ones and those starting at index."""
+        
+        start = self.__Position(self.__nextIndex)
+        end = self.__Position(index)
+        positions = numpy.arange(start, end)
+        columns = positions % self.__periodValues
+        
+        if self.__gapFill == "nan":
+            fill = numpy.full(len(positions), numpy.nan)
+        elif self.__gapFill == "hold":
+            fill = self.__last[columns]
+        else:
+            # first value of every column after the gap, where available
+            offsets = (numpy.arange(self.__periodValues) - end) % self.__periodValues
+            available = offsets < len(values)
+            after = self.__last.copy()
+            after[available] = values[offsets[available]]
+            afterPosition = end + offsets
+            
+            before = self.__last[columns]
+            span = (afterPosition[columns] - self.__lastPosition[columns]).astype(float)
+            weight = numpy.where(available[columns], (positions - self.__lastPosition[columns])/span, 0.0)
+            fill = before + (after[columns] - before)*weight
+        
+        self.__AppendValues(fill.astype('>f4'), receiveTime)
+    
+    def __AppendValues(self, values, receiveTime):
+        """Copy values to the end of the rows, delivering them whenever a block is complete."""
+        
+        if len(values) == 0:
+            return
+        
+        # remember the last value of every column for gap filling
+        end = self.__Position(self.__rowStart) + self.__filled + len(values)
+        tail = min(len(values), self.__periodValues)
+        tailPositions = numpy.arange(end - tail, end)
+        self.__last[tailPositions % self.__periodValues] = values[-tail:]
+        self.__lastPosition[tailPositions % self.__periodValues] = tailPositions
+        
+        offset = 0
+        while offset < len(values):
+            count = min(len(values) - offset, len(self.__rows) - self.__filled)
+            self.__rows[self.__filled:self.__filled + count] = values[offset:offset + count]
+            self.__filled += count
+            offset += count
+            if self.__filled >= self.__blockValues:
+                self.Flush(receiveTime)
+
+
+class AcqNdtSampleClock:
+    """Running linear fit of hardware sample indexes against the host clock.
+    
+    Every block received by a data server is an observation of the hardware
+    sample index reached at the time.monotonic() value the block was
+    received.  The observations are fitted with a line using exponentially
+    weighted least squares, so the fit follows slow drift between the clock
+    of the MP device and the host clock while averaging out network and
+    scheduling jitter.
+    
+    The fit gives the effective sampling rate, its drift from the nominal
+    rate, the jitter of the receive times around the fit, and maps any
+    hardware sample index to host monotonic time or wall-clock time.
+    
+    Usually obtained through AcqNdtDataServer.GetClock().
+    """
+    
+    def __init__(self, nominalRate=None, timeConstant=30.0):
+        """Default constructor.
+        
+        nominalRate:	hardware acquisition sampling rate in Hz configured in
+                        AcqKnowledge, or None if unknown.  Used until enough
+                        observations are available and to report drift.
+        timeConstant:	time in seconds after which the weight of an
+                        observation has decayed to 1/e.
+        """
+        
+        self.__nominalRate = nominalRate
+        self.__timeConstant = float(timeConstant)
+        self.__lock = threading.Lock()
+        self.Reset()
+    
+    def Reset(self):
+        """Forget all observations, e.g. when a new acquisition starts.
+        """
+        
+        with self.__lock:
+            # offset between wall-clock time and monotonic time
+            self.__wallOffset = time.time() - time.monotonic()
+            
+            self.__count = 0
+            self.__lastTime = None
+            self.__weight = 0.0
+            self.__meanIndex = 0.0
+            self.__meanTime = 0.0
+            self.__varIndex = 0.0
+            self.__varTime = 0.0
+            self.__covariance = 0.0
+    
+    def Update(self, index, receiveTime):
+        """Add an observation.
+        
+        index:			hardware sample index following the last received sample.
+        receiveTime:	time.monotonic() value at which the sample was received.
+        """
+        
+        with self.__lock:
+            if self.__lastTime is None:
+                decay = 1.0
+            else:
+                decay = math.exp(-max(0.0, receiveTime - self.__lastTime)/self.__timeConstant)
+            self.__lastTime = receiveTime
+            self.__count += 1
+            
+            # weighted Welford update of the means and co-moments
+            self.__weight = self.__weight*decay + 1.0
+            dIndex = index - self.__meanIndex
+            dTime = receiveTime - self.__meanTime
+            self.__meanIndex += dIndex/self.__weight
+            self.__meanTime += dTime/self.__weight
+            self.__varIndex = self.__varIndex*decay + dIndex*(index - self.__meanIndex)
+            self.__varTime = self.__varTime*decay + dTime*(receiveTime - self.__meanTime)
+            self.__covariance = self.__covariance*decay + dIndex*(receiveTime - self.__meanTime)
+    
+    def GetObservationCount(self):
+        """Returns the number of observations since the last Reset().
+        """
+        return self.__count
+    
+    def GetNominalSampleRate(self):
+        """Returns the nominal sampling rate given to the constructor, or None.
+        """
+        return self.__nominalRate
+    
+    def GetSampleRate(self):
+        """Returns the effective sampling rate in Hz measured with the host clock.
+        
+        Returns the nominal rate, or None, while fewer than two distinct
+        sample indexes were observed.
+        """
+        with self.__lock:
+            return self.__Rate()
+    
+    def GetDrift(self):
+        """Returns the relative deviation of the effective from the nominal sampling rate in parts per million, or None.
+        """
+        with self.__lock:
+            rate = self.__Rate()
+            if rate is None or not self.__nominalRate or self.__varIndex <= 0:
+                return None
+            return (rate/self.__nominalRate - 1.0)*1e6
+    
+    def GetJitter(self):
+        """Returns the standard deviation in seconds of the receive times around the fit, or None.
+        """
+        with self.__lock:
+            if self.__varIndex <= 0 or self.__weight <= 1.0:
+                return None
+            residual = self.__varTime - self.__covariance*self.__covariance/self.__varIndex
+            return math.sqrt(max(0.0, residual)/self.__weight)
+    
+    def IndexToTime(self, index):
+        """Map a hardware sample index to a time.monotonic() value.
+        
+        Returns None before the first observation, or if the rate is still unknown.
+        """
+        with self.__lock:
+            rate = self.__Rate()
+            if self.__count == 0 or rate is None:
+                return None
+            return self.__meanTime + (index - self.__meanIndex)/rate
+    
+    def IndexToWallClock(self, index):
+        """Map a hardware sample index to a wall-clock time.time() value.
+        
+        Returns None before the first observation, or if the rate is still unknown.
+        """
+        monotonic = self.IndexToTime(index)
+        if monotonic is None:
+            return None
+        return monotonic + self.__wallOffset
+    
+    def TimeToIndex(self, monotonic):
+        """Map a time.monotonic() value to a fractional hardware sample index, or None.
+        """
+        with self.__lock:
+            rate = self.__Rate()
+            if self.__count == 0 or rate is None:
+                return None
+            return self.__meanIndex + (monotonic - self.__meanTime)*rate
+    
+    def __Rate(self):
+        """Current rate estimate.  Must be called with the lock held."""
+        if self.__varIndex > 0 and self.__covariance > 0:
+            return self.__varIndex/self.__covariance
+        return self.__nominalRate
+
+
+class AcqNdtStage:
+    """Base class of the streaming processing stages of an AcqNdtDataServer.
+    
+    Stages are added with AcqNdtDataServer.AddStage() and run one after the
+    other on every received block, before the callbacks and outputs see
+    it.  A stage works on whole blocks of shape (rows, channels) with numpy
+    operations and keeps whatever state it needs across blocks, so the
+    result does not depend on how the data was split into blocks.
+    
+    Subclasses override Configure(), Reset() and Process().
+    """
+    
+    def Configure(self, channels):
+        """Prepare the stage for its input.
+        
+        channels:	list of AcqNdtChannel objects describing the columns of the
+                    input blocks.  All of them share the same SamplingDivider.
+        
+        Returns the list of AcqNdtChannel objects describing the columns of
+        the output blocks.
+        """
+        self.Reset()
+        return channels
+    
+    def Reset(self):
+        """Forget the state kept across blocks, e.g. when a new acquisition starts.
+        """
+        pass
+    
+    def Process(self, startIndex, block):
+        """Process one block.
+        
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (rows, channels)
+        
+        Returns the hardware sample index of the first output row and the
+        output block, which may have fewer rows or none at all.
+        """
+        return (startIndex, block)
+    
+    @staticmethod
+    def DeriveChannels(channels, decimation=1, scale=None, offset=None):
+        """Returns copies of AcqNdtChannel objects describing data derived from them.
+        
+        decimation:	factor multiplying the SamplingDivider of the channels.
+        scale:		new Scale of the channels, unchanged if None.
+        offset:		new Offset of the channels, unchanged if None.
+        """
+        
+        derived = []
+        for channel in channels:
+            derived.append(AcqNdtChannel(channel.Type, channel.Index, channel.DataSize,
+                                         channel.SamplingDivider*decimation,
+                                         channel.Scale if scale is None else scale,
+                                         channel.Offset if offset is None else offset,
+                                         channel.EnabledForDelivery))
+        return derived
+
+
+class AcqNdtScaleStage(AcqNdtStage):
+    """Converts the values of every channel with its Scale and Offset:
+    
+        v * Scale + Offset
+    
+    The output channels have a Scale of 1.0 and an Offset of 0.0.
+    """
+    
+    def Configure(self, channels):
+        self.__scale = numpy.array([c.Scale if c.Scale is not None else 1.0 for c in channels])
+        self.__offset = numpy.array([c.Offset if c.Offset is not None else 0.0 for c in channels])
+        return AcqNdtStage.DeriveChannels(channels, scale=1.0, offset=0.0)
+    
+    def Process(self, startIndex, block):
+        return (startIndex, block*self.__scale + self.__offset)
+
+
+class AcqNdtFilterStage(AcqNdtStage):
+    """Applies an IIR or FIR filter to every channel, keeping the filter state across blocks.
+    
+    The filter is given by its transfer function coefficients as for
+    scipy.signal.lfilter().  When scipy is installed it is used to run the
+    filter, otherwise an equivalent numpy implementation is used.
+    """
+    
+    def __init__(self, b, a=(1.0,)):
+        """Default constructor.
+        
+        b:	numerator coefficients of the filter.
+        a:	denominator coefficients of the filter, (1.0,) for an FIR filter.
+        """
+        
+        b = numpy.atleast_1d(numpy.asarray(b, dtype=float))
+        a = numpy.atleast_1d(numpy.asarray(a, dtype=float))
+        if a[0] == 0:
+            raise ACQException("The first denominator coefficient of a filter must not be zero")
+        
+        order = max(len(a), len(b))
+        self.__b = numpy.zeros(order)
+        self.__a = numpy.zeros(order)
+        self.__b[:len(b)] = b/a[0]
+        self.__a[:len(a)] = a/a[0]
+        self.__isFIR = not numpy.any(self.__a[1:])
+        self.__state = None
+        self.__channelCount = 0
+    
+    def GetCoefficients(self):
+        """Returns the normalized (b, a) coefficients of the filter.
+        """
+        return (self.__b.copy(), self.__a.copy())
+    
+    def Configure(self, channels):
+        self.__channelCount = len(channels)
+        self.Reset()
+        return channels
+    
+    def Reset(self):
+        self.__state = numpy.zeros((len(self.__b) - 1, self.__channelCount))
+    
+    def Process(self, startIndex, block):
+        if len(self.__b) == 1:
+            return (startIndex, block*self.__b[0])
+        
+        x = numpy.asarray(block, dtype=float)
+        if scipysignal is not None:
+            (y, self.__state) = scipysignal.lfilter(self.__b, self.__a, x, axis=0, zi=self.__state)
+        elif self.__isFIR:
+            y = self.__FIR(x)
+        else:
+            y = self.__IIR(x)
+        return (startIndex, y)
+    
+    def __FIR(self, x):
+        """FIR filter computed one tap at a time over the whole block."""
+        
+        taps = len(self.__b)
+        # the state holds the previous taps - 1 input rows, most recent first
+        history = numpy.concatenate((self.__state[::-1], x))
+        y = numpy.zeros(x.shape)
+        for k in range(taps):
+            y += self.__b[k]*history[taps - 1 - k:taps - 1 - k + len(x)]
+        self.__state = history[len(history) - taps + 1:][::-1].copy()
+        return y
+    
+    def __IIR(self, x):
+        """IIR filter in transposed direct form II, vectorized over the channels."""
+        
+        b = self.__b
+        a = self.__a
+        z = self.__state
+        y = numpy.empty(x.shape)
+        for n in range(len(x)):
+            y[n] = b[0]*x[n] + z[0]
+            z[:-1] = z[1:] + numpy.outer(b[1:-1], x[n]) - numpy.outer(a[1:-1], y[n])
+            z[-1] = b[-1]*x[n] - a[-1]*y[n]
+        return y
+
+
+class AcqNdtDecimateStage(AcqNdtStage):
+    """Reduces the rate of the channels by an integer factor.
+    
+    With antiAlias, the channels are first low-pass filtered with a
+    windowed sinc FIR filter so that frequencies above the new Nyquist
+    rate do not alias into the output.  Without it, the latest value of
+    every group of factor rows is kept.
+    
+    The SamplingDivider of the output channels is multiplied by factor,
+    so the hardware sample index of output row k is
+    startIndex + k * GetOutputSchedule().GetPeriod() as usual.
+    
+    The anti-aliasing filter delays the channels by (taps - 1) / 2 input
+    rows.  The returned indexes are corrected for this delay, so an output
+    row keeps the hardware index of the input it represents: the first
+    (taps - 1) / 2 filtered rows after a Reset() are dropped as warm-up and
+    the last ones are output once the following rows have arrived.
+    """
+    
+    def __init__(self, factor, antiAlias=True, taps=None):
+        """Default constructor.
+        
+        factor:		decimation factor, a positive integer.
+        antiAlias:	low-pass filter the channels before decimating.
+        taps:		length of the anti-aliasing filter, 8 * factor + 1 by default.
+        """
+        
+        if int(factor) < 1:
+            raise ACQException("The decimation factor must be a positive integer")
+        
+        self.__factor = int(factor)
+        self.__filter = None
+        self.__delay = 0
+        if antiAlias and self.__factor > 1:
+            taps = int(taps or 8*self.__factor + 1)
+            self.__filter = AcqNdtFilterStage(self.LowPass(0.4/self.__factor, taps))
+            self.__delay = (taps - 1)//2
+        self.__step = 1
+        self.__phase = 0
+        self.__warmUp = self.__delay
+    
+    @staticmethod
+    def LowPass(cutoff, taps):
+        """Returns the coefficients of a Hamming windowed sinc low-pass FIR filter.
+        
+        cutoff:	cutoff frequency in cycles per sample (0.5 is the Nyquist rate).
+        taps:	number of coefficients.
+        """
+        
+        n = numpy.arange(taps) - (taps - 1)/2.0
+        h = 2*cutoff*numpy.sinc(2*cutoff*n)*numpy.hamming(taps)
+        return h/numpy.sum(h)
+    
+    def GetFactor(self):
+        """Returns the decimation factor.
+        """
+        return self.__factor
+    
+    def GetDelay(self):
+        """Returns the delay of the anti-aliasing filter in input rows, compensated in the returned indexes.
+        """
+        return self.__delay
+    
+    def Configure(self, channels):
+        if self.__filter is not None:
+            self.__filter.Configure(channels)
+        self.__step = channels[0].SamplingDivider
+        self.__phase = 0
+        self.__warmUp = self.__delay
+        return AcqNdtStage.DeriveChannels(channels, decimation=self.__factor)
+    
+    def Reset(self):
+        if self.__filter is not None:
+            self.__filter.Reset()
+        self.__phase = 0
+        self.__warmUp = self.__delay
+    
+    def Process(self, startIndex, block):
+        if self.__filter is not None:
+            (startIndex, block) = self.__filter.Process(startIndex, block)
+            
+            # filtered row n represents input row n - delay, the rows before the first input are dropped
+            skipped = min(self.__warmUp, len(block))
+            block = block[skipped:]
+            self.__warmUp -= skipped
+            startIndex += (skipped - self.__delay)*self.__step
+        
+        # without filtering keep the latest row of each group instead of the first
+        phase = self.__phase if self.__filter is not None else (self.__phase + self.__factor - 1) % self.__factor
+        output = block[phase::self.__factor]
+        startIndex += phase*self.__step
+        
+        self.__phase = (self.__phase - len(block)) % self.__factor
+        return (startIndex, output)
+
+
+class AcqNdtMovingRMSStage(AcqNdtStage):
+    """Replaces every channel by its root mean square over a sliding window of rows.
+    
+    The window continues across blocks.  The first window - 1 rows after a
+    Reset() are computed as if preceded by zeros.
+    """
+    
+    def __init__(self, window):
+        """Default constructor.
+        
+        window:	number of rows in the sliding window.
+        """
+        
+        if int(window) < 1:
+            raise ACQException("The RMS window must be a positive number of rows")
+        
+        self.__window = int(window)
+        self.__channelCount = 0
+        self.__tail = None
+    
+    def Configure(self, channels):
+        self.__channelCount = len(channels)
+        self.Reset()
+        return channels
+    
+    def Reset(self):
+        self.__tail = numpy.zeros((self.__window - 1, self.__channelCount))
+    
+    def Process(self, startIndex, block):
+        squares = numpy.concatenate((self.__tail, numpy.square(block, dtype=float)))
+        sums = numpy.concatenate((numpy.zeros((1, squares.shape[1])), numpy.cumsum(squares, axis=0)))
+        mean = (sums[self.__window:] - sums[:-self.__window])/self.__window
+        
+        self.__tail = squares[len(squares) - self.__window + 1:]
+        return (startIndex, numpy.sqrt(numpy.maximum(mean, 0.0)))
+
+
+class AcqNdtRateController:
+    """Reduces the rate of the frames passed to one output to a target rate.
+    
+    Unlike processing stages added to the data server, which change the
+    data seen by every callback, a rate controller sits in front of a
+    single output, so each OSC address or client can receive the data at
+    the rate it can use: a 2 kHz acquisition may be recorded at full rate
+    while a visualisation receives 60 frames per second.
+    
+    The frames are decimated by the smallest integer factor that brings
+    the rate to or below the target, either anti-aliased ("filter" mode)
+    or by keeping the latest frame of every group ("latest" mode).
+    
+    Wrap the callback of the output when registering it:
+    
+        controller = AcqNdtRateController(dataServer.GetOutputSchedule(), sampleRate, 60)
+        dataServer.RegisterBlockCallback("Visualisation", controller.WrapBlockCallback(sender.Write))
+        dataServer.RegisterBlockCallback("SendOSCData", controller.WrapFrameCallback(SendOSCData, dataServer.OSCClient))
+    """
+    
+    ## supported decimation modes
+    Modes = ("filter", "latest")
+    
+    def __init__(self, schedule, sampleRate, targetRate, mode="filter"):
+        """Default constructor.
+        
+        schedule:	AcqNdtFrameSchedule of the blocks, see AcqNdtDataServer.GetOutputSchedule().
+                    All of its channels must share the same SamplingDivider.
+        sampleRate:	hardware acquisition sampling rate in Hz.
+        targetRate:	maximum number of frames per second passed to the output.
+        mode:		one of AcqNdtRateController.Modes.
+        """
+        
+        if mode not in self.Modes:
+            raise ACQException("Unknown rate control mode '" + str(mode) + "'")
+        if not schedule.IsUniform():
+            raise ACQException("Rate control requires all channels to share the same SamplingDivider")
+        if targetRate <= 0:
+            raise ACQException("The target rate must be positive")
+        
+        inputRate = float(sampleRate)/schedule.GetPeriod()
+        self.__factor = max(1, int(math.ceil(inputRate/targetRate - 1e-9)))
+        self.__outputRate = inputRate/self.__factor
+        
+        self.__stage = AcqNdtDecimateStage(self.__factor, antiAlias=(mode == "filter"))
+        self.__outputSchedule = AcqNdtFrameSchedule(self.__stage.Configure(schedule.GetChannels()))
+        self.__lock = threading.Lock()
+    
+    def GetFactor(self):
+        """Returns the decimation factor.
+        """
+        return self.__factor
+    
+    def GetOutputRate(self):
+        """Returns the number of frames per second passed to the output.
+        """
+        return self.__outputRate
+    
+    def GetOutputSchedule(self):
+        """Returns the AcqNdtFrameSchedule describing the blocks passed to the output.
+        """
+        return self.__outputSchedule
+    
+    def Reset(self):
+        """Forget the filter state, e.g. when a new acquisition starts.
+        """
+        with self.__lock:
+            self.__stage.Reset()
+    
+    def Process(self, startIndex, block):
+        """Decimate a block.  Returns the hardware sample index of the first output frame and the output block.
+        """
+        with self.__lock:
+            return self.__stage.Process(startIndex, block)
+    
+    def WrapBlockCallback(self, callback):
+        """Returns a block callback passing the decimated blocks on to a block callback "f(startIndex, block)".
+        """
+        
+        def RateControlledBlockCallback(startIndex, block):
+            (startIndex, block) = self.Process(startIndex, block)
+            if len(block):
+                callback(startIndex, block)
+        
+        return RateControlledBlockCallback
+    
+    def WrapFrameCallback(self, callback, OSCClient=None):
+        """Returns a block callback passing the decimated frames on to a per frame callback.
+        
+        callback:	function with the signature of the callbacks of
+                    AcqNdtDataServer.RegisterCallback(),
+                    "f(index, frame, channelsInSlice, OSCClient)".
+        OSCClient:	value passed as the last parameter of the callback,
+                    usually AcqNdtDataServer.OSCClient.
+        """
+        
+        step = self.__outputSchedule.GetPeriod()
+        channelsInSlice = tuple(self.__outputSchedule.GetChannels())
+        
+        def RateControlledFrameCallback(startIndex, block):
+            (startIndex, block) = self.Process(startIndex, block)
+            for row in block.tolist():
+                callback(startIndex, tuple(row), channelsInSlice, OSCClient)
+                startIndex += step
+        
+        return RateControlledFrameCallback
+
+
+class AcqNdtOSCSender:
+    """Sends blocks of frames received by an AcqNdtDataServer over OSC as bundles of typed messages.
+    
+    Every frame becomes one OSC message with an int32 hardware sample index
+    argument followed by one float32 argument per channel.  Frames are
+    collected and sent as one OSC bundle per batch, which is flushed when
+    it holds batchFrames frames or when its oldest frame has waited for
+    maxLatency seconds, whichever happens first.
+    
+    The address and type tags of the messages are encoded only once.
+    Frames are copied into a preallocated numpy record array laid out
+    exactly as the bundle elements, so a whole bundle is encoded with
+    a single tobytes() call.
+    
+    Register the Write member function as a block callback:
+    
+        dataServer.RegisterBlockCallback("SendOSCBundles", sender.Write)
+    
+    When a clock is given, the time tag of every bundle is the wall-clock
+    time at which its first frame was acquired, so receivers can align the
+    frames with other media.  Otherwise bundles are tagged 'immediately'.
+    """
+    
+    ## largest payload that fits in a single UDP datagram
+    MaxDatagramSize = 65507
+    
+    ## seconds between the NTP epoch (1900) used by OSC time tags and the Unix epoch
+    NTPEpochOffset = 2208988800
+    
+    def __init__(self, hostname, port, schedule, address="/BioHarness", batchFrames=32, maxLatency=None, clock=None):
+        """Default constructor.
+        
+        hostname:	host name or IP address of the OSC receiver.
+        port:		UDP port of the OSC receiver.
+        schedule:	AcqNdtFrameSchedule of the data server whose blocks are sent,
+                    as returned by AcqNdtDataServer.GetFrameSchedule().  All of
+                    its channels must share the same SamplingDivider.
+        address:	OSC address pattern of the messages.
+        batchFrames:	maximum number of frames per bundle.  Reduced if needed
+                    so that a bundle fits in a single UDP datagram.
+        maxLatency:	maximum time in seconds a frame may wait before its bundle
+                    is sent, or None to only send full bundles.  The latency
+                    is checked whenever a block is written.
+        clock:		optional AcqNdtSampleClock of the data server, as returned
+                    by AcqNdtDataServer.GetClock(), used to time tag the bundles.
+        """
+        
+        if not schedule.IsUniform():
+            raise ACQException("OSC bundles require all channels to share the same SamplingDivider")
+        
+        self.__hostPort = (hostname, port)
+        self.__step = schedule.GetPeriod()
+        self.__maxLatency = maxLatency
+        self.__clock = clock
+        
+        channelCount = schedule.GetPeriodValues()
+        encodedAddress = self.__Pad(address.encode("ascii"))
+        encodedTags = self.__Pad(("," + "i" + "f"*channelCount).encode("ascii"))
+        
+        self.__recordType = numpy.dtype([("size", ">i4"),
+                                         ("address", "S%i" % len(encodedAddress)),
+                                         ("tags", "S%i" % len(encodedTags)),
+                                         ("index", ">i4"),
+                                         ("values", ">f4", (channelCount,))])
+        
+        messageSize = self.__recordType.itemsize - 4
+        maxFrames = (self.MaxDatagramSize - 16)//self.__recordType.itemsize
+        self.__batchFrames = max(1, min(int(batchFrames), maxFrames))
+        
+        self.__records = numpy.zeros(self.__batchFrames, dtype=self.__recordType)
+        self.__records["size"] = messageSize
+        self.__records["address"] = encodedAddress
+        self.__records["tags"] = encodedTags
+        
+        # '#bundle' followed by the 'immediately' time tag
+        self.__bundlePrefix = self.__Pad(b"#bundle")
+        self.__bundleHeader = self.__bundlePrefix + struct.pack(">Q", 1)
+        
+        self.__pending = 0
+        self.__pendingSince = None
+        self.__lock = threading.Lock()
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    
+    def __Pad(self, data):
+        """Null terminate and pad an OSC string to a multiple of 4 bytes."""
+        return data + b"\0"*(4 - len(data) % 4)
+    
+    def GetBatchFrames(self):
+        """Returns the maximum number of frames sent per bundle.
+        """
+        return self.__batchFrames
+    
+    def Write(self, startIndex, block):
+        """Block callback that queues frames for sending and sends every bundle that is ready.
+        
+        startIndex:	hardware sample index of the first frame in the block
+        block:		numpy array of shape (frames, channels)
+        """
+        
+        with self.__lock:
+            frameCount = len(block)
+            written = 0
+            while written < frameCount:
+                if self.__pending == 0:
+                    self.__pendingSince = time.monotonic()
+                
+                count = min(frameCount - written, self.__batchFrames - self.__pending)
+                records = self.__records[self.__pending:self.__pending + count]
+                records["index"] = numpy.arange(startIndex + written*self.__step,
+                                                startIndex + (written + count)*self.__step,
+                                                self.__step)
+                records["values"] = block[written:written + count]
+                self.__pending += count
+                written += count
+                
+                if self.__pending == self.__batchFrames:
+                    self.__Send()
+            
+            if self.__pending and self.__maxLatency is not None:
+                if time.monotonic() - self.__pendingSince >= self.__maxLatency:
+                    self.__Send()
+    
+    def Flush(self):
+        """Send any queued frames immediately.
+        """
+        with self.__lock:
+            if self.__pending:
+                self.__Send()
+    
+    def Close(self):
+        """Send any queued frames and release the socket.
+        """
+        self.Flush()
+        self.__sock.close()
+    
+    def __Send(self):
+        """Send the queued frames as one bundle.  Must be called with the lock held."""
+        
+        header = self.__bundleHeader
+        if self.__clock is not None:
+            wallClock = self.__clock.IndexToWallClock(int(self.__records["index"][0]))
+            if wallClock is not None:
+                header = self.__bundlePrefix + struct.pack(">Q", int((wallClock + self.NTPEpochOffset)*4294967296.0))
+        
+        bundle = header + self.__records[:self.__pending].tobytes()
+        self.__pending = 0
+        self.__sock.sendto(bundle, self.__hostPort)
+
+
+class AcqNdtDispatcher:
+    """Decouples receiving data from AcqKnowledge from running the callbacks that process it.
+    
+    The receiving thread puts decoded blocks into a bounded queue and returns
+    immediately to reading the socket.  One or more consumer threads take the
+    blocks from the queue and pass them to a delivery function.  A slow
+    consumer therefore no longer stalls the data connection.
+    
+    When the queue is full, the overflow policy decides what happens:
+    
+        "block"			the receiving thread waits until there is room
+        "drop-oldest"	the oldest queued block is discarded
+        "drop-newest"	the incoming block is discarded
+    
+    Counters of the queue depth and of dropped frames show backpressure
+    while the acquisition is running.  An exception raised by the delivery
+    function is counted and kept (see GetFailedBlocks() and GetLastError())
+    and does not end the consumer thread.  Blocks put before Start(), after
+    Stop() or when no consumer thread is alive are dropped.
+    
+    Usually created through AcqNdtDataServer.EnableDispatcher().
+    """
+    
+    ## supported overflow policies
+    Policies = ("block", "drop-oldest", "drop-newest")
+    
+    def __init__(self, deliver, maxBlocks=64, policy="block", workers=1):
+        """Default constructor.
+        
+        deliver:	function with signature "f(startIndex, block, receiveTime)"
+                    invoked on the consumer threads for every queued block.
+        maxBlocks:	maximum number of blocks held in the queue.
+        policy:		overflow policy, one of AcqNdtDispatcher.Policies.
+        workers:	number of consumer threads.  With more than one worker
+                    blocks may be delivered out of order.
+        """
+        
+        if policy not in self.Policies:
+            raise ACQException("Unknown overflow policy '" + str(policy) + "'")
+        if int(maxBlocks) < 1 or int(workers) < 1:
+            raise ACQException("maxBlocks and workers must be positive")
+        
+        self.__deliver = deliver
+        self.__maxBlocks = int(maxBlocks)
+        self.__policy = policy
+        
+        self.__queue = collections.deque()
+        self.__condition = threading.Condition()
+        self.__running = False
+        self.__busy = 0
+        
+        self.__maxDepth = 0
+        self.__queuedFrames = 0
+        self.__deliveredFrames = 0
+        self.__droppedFrames = 0
+        self.__droppedBlocks = 0
+        self.__failedBlocks = 0
+        self.__lastError = None
+        
+        self.__workers = [threading.Thread(target=self.__Work) for i in range(int(workers))]
+        for worker in self.__workers:
+            worker.daemon = True
+    
+    def Start(self):
+        """Start the consumer threads.
+        """
+        self.__running = True
+        for worker in self.__workers:
+            worker.start()
+    
+    def Stop(self, drain=True):
+        """Stop the consumer threads.
+        
+        drain:	if True, blocks still in the queue are delivered before the
+                threads end, otherwise they are discarded.
+        """
+        with self.__condition:
+            if not drain:
+                self.__queue.clear()
+            self.__running = False
+            self.__condition.notify_all()
+        
+        for worker in self.__workers:
+            if worker.is_alive():
+                worker.join()
+    
+    def Put(self, startIndex, block, receiveTime=None):
+        """Queue a block for delivery on a consumer thread.
+        
+        The block is copied since the receive buffer it points into will be
+        reused.  Returns False if the block was dropped.
+        
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of decoded frames
+        receiveTime:	time.monotonic() value at which the block was received
+        """
+        
+        with self.__condition:
+            if self.__policy == "block":
+                # wait for room, but never for consumer threads that are gone
+                while self.__IsConsuming() and len(self.__queue) >= self.__maxBlocks:
+                    self.__condition.wait(0.25)
+            
+            if not self.__IsConsuming() or (len(self.__queue) >= self.__maxBlocks and self.__policy != "drop-oldest"):
+                self.__droppedBlocks += 1
+                self.__droppedFrames += len(block)
+                return False
+            
+            if len(self.__queue) >= self.__maxBlocks:
+                (oldIndex, oldBlock, oldTime) = self.__queue.popleft()
+                self.__droppedBlocks += 1
+                self.__droppedFrames += len(oldBlock)
+            
+            self.__queue.append((startIndex, block.copy(), receiveTime))
+            self.__queuedFrames += len(block)
+            self.__maxDepth = max(self.__maxDepth, len(self.__queue))
+            self.__condition.notify_all()
+        
+        return True
+    
+    def WaitUntilEmpty(self, timeout=None):
+        """Block until every queued block has been delivered.
+        
+        timeout:	maximum time to wait in seconds, or None to wait forever.
+        
+        Returns True if the queue was emptied, False on timeout.
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: len(self.__queue) == 0 and self.__busy == 0, timeout)
+    
+    def GetQueueDepth(self):
+        """Returns the number of blocks currently waiting in the queue.
+        """
+        return len(self.__queue)
+    
+    def GetMaxQueueDepth(self):
+        """Returns the highest number of blocks that have waited in the queue at once.
+        """
+        return self.__maxDepth
+    
+    def GetQueuedFrames(self):
+        """Returns the number of frames accepted into the queue.
+        """
+        return self.__queuedFrames
+    
+    def GetDeliveredFrames(self):
+        """Returns the number of frames passed to the delivery function.
+        """
+        return self.__deliveredFrames
+    
+    def GetDroppedFrames(self):
+        """Returns the number of frames discarded because the queue was full.
+        """
+        return self.__droppedFrames
+    
+    def GetDroppedBlocks(self):
+        """Returns the number of blocks discarded because the queue was full.
+        """
+        return self.__droppedBlocks
+    
+    def GetFailedBlocks(self):
+        """Returns the number of blocks whose delivery function raised an exception.
+        """
+        return self.__failedBlocks
+    
+    def GetLastError(self):
+        """Returns the last exception raised by the delivery function, or None.
+        """
+        return self.__lastError
+    
+    def __IsConsuming(self):
+        """Returns True if queued blocks will be delivered: the dispatcher is running and a consumer thread is alive."""
+        return self.__running and any([worker.is_alive() for worker in self.__workers])
+    
+    def __Work(self):
+        """Consumer thread body."""
+        
+        while True:
+            with self.__condition:
+                while self.__running and len(self.__queue) == 0:
+                    self.__condition.wait()
+                if len(self.__queue) == 0:
+                    return
+                (startIndex, block, receiveTime) = self.__queue.popleft()
+                self.__busy += 1
+                self.__condition.notify_all()
+            
+            error = None
+            try:
+                self.__deliver(startIndex, block, receiveTime)
+            except Exception as e:
+                # a failing callback must not stop the consumer, or the
+                # receiving thread would wait for room in the queue forever
+                error = e
+            
+            with self.__condition:
+                self.__busy -= 1
+                if error is None:
+                    self.__deliveredFrames += len(block)
+                else:
+                    self.__failedBlocks += 1
+                    self.__lastError = error
+                self.__condition.notify_all()
+
+
+class AcqNdtStreamAggregator:
+    """Merges the data of several AcqKnowledge instances into one time ordered output.
+    
+    Each data stream, usually the AcqNdtDataServer receiving the data of
+    one acquisition computer, is added under a unique stream ID.  Blocks of
+    every stream are given a start time in seconds on a common time base
+    and handed to the registered callbacks in time order, so that the
+    output of all acquisition computers is aligned as if it came from a
+    single one.
+    
+    The time of a block is the time its stream started acquiring, relative
+    to the stream that started first, plus the hardware sample index of the
+    block divided by the sampling rate of the stream.  The start of a
+    stream should be marked with MarkStart() right after its acquisition
+    was started; otherwise it is estimated from the arrival of its first
+    block.
+    
+    A block is only passed on once every other stream received data up to
+    its time, ended, or did not receive anything for maxDelay seconds.
+    """
+    
+    def __init__(self, maxDelay=0.1):
+        """Default constructor.
+        
+        maxDelay:	maximum time in seconds to wait for a stream which is
+                    behind the others before passing on the blocks of the
+                    other streams.
+        """
+        
+        self.__maxDelay = maxDelay
+        self.__lock = threading.Lock()
+        self.__callbacks = {}
+        
+        self.__streamIds = []
+        self.__sampleRates = {}
+        self.__periods = {}
+        self.__starts = {}
+        self.__pending = {}
+        self.__streamTimes = {}
+        self.__lastArrivals = {}
+        self.__ended = set()
+    
+    def AddStream(self, streamId, dataServer, sampleRate):
+        """Add the data of a data server to the aggregated output.
+        
+        streamId:	unique identifier of the stream, passed to the callbacks.
+        dataServer:	AcqNdtDataServer receiving the data of the stream.
+        sampleRate:	hardware acquisition sampling rate of the stream in Hz.
+        
+        A block callback and a close callback named "Aggregate" are
+        registered with the data server.
+        """
+        
+        with self.__lock:
+            if streamId in self.__sampleRates:
+                raise ACQException("Stream ID '" + str(streamId) + "' is already in use")
+            
+            self.__streamIds.append(streamId)
+            self.__sampleRates[streamId] = float(sampleRate)
+            self.__periods[streamId] = dataServer.GetFrameSchedule().GetPeriod()
+            self.__pending[streamId] = collections.deque()
+            self.__lastArrivals[streamId] = time.monotonic()
+        
+        dataServer.RegisterBlockCallback("Aggregate", functools.partial(self.Put, streamId))
+        dataServer.RegisterCloseCallback("Aggregate", functools.partial(self.EndStream, streamId))
+    
+    def GetStreamIds(self):
+        """Returns the list of stream IDs in the order they were added.
+        """
+        return list(self.__streamIds)
+    
+    def MarkStart(self, streamId, startTime=None):
+        """Record when the acquisition of a stream started.
+        
+        streamId:	stream ID given to AddStream().
+        startTime:	time.monotonic() value of the start, the current time by default.
+        """
+        
+        if startTime is None:
+            startTime = time.monotonic()
+        
+        with self.__lock:
+            self.__starts[streamId] = startTime
+            self.__lastArrivals[streamId] = startTime
+            self.__ended.discard(streamId)
+    
+    def GetStreamOffset(self, streamId):
+        """Returns the start of a stream in seconds relative to the stream that started first, or None if not known yet.
+        """
+        
+        with self.__lock:
+            if streamId not in self.__starts:
+                return None
+            return self.__starts[streamId] - min(self.__starts.values())
+    
+    def RegisterCallback(self, name, callback):
+        """Register a new callback function to be invoked with the aggregated blocks.
+        
+        name:		set to a unique identifier that may reference the callback in RemoveCallback
+        callback:	set to the function callback.  Callbacks are invoked with
+                    four parameters and should have a signature
+                    "f(streamId, startTime, startIndex, block)":
+                    
+                    streamId		ID of the stream the block was received from.
+                    startTime		time of the first row of the block in seconds
+                                    on the common time base.
+                    startIndex		hardware sample index of the first row, as
+                                    for AcqNdtDataServer.RegisterBlockCallback().
+                    block			numpy array of the block, owned by the callback.
+        
+        Callbacks are invoked one at a time from the thread of the data
+        server which received the data, and should return quickly.
+        """
+        
+        if name in self.__callbacks:
+            raise ACQException("Callback name '" + name + "' is already in use")
+        
+        self.__callbacks[name] = callback
+    
+    def RemoveCallback(self, name):
+        """Remove a previously registered callback.
+        
+        name:	unique ID of the callback to be removed.
+        """
+        
+        if name in self.__callbacks:
+            del self.__callbacks[name]
+    
+    def GetCallbacks(self):
+        """Returns a dictionary of all registered callbacks, key is unique ID name, value is function reference.
+        """
+        return dict(self.__callbacks)	# read only
+    
+    def Put(self, streamId, startIndex, block):
+        """Add a block of a stream and pass on all blocks which are due.
+        
+        Used as the block callback of the data servers.
+        """
+        
+        now = time.monotonic()
+        with self.__lock:
+            rate = self.__sampleRates[streamId]
+            rows = len(block)
+            endIndex = startIndex + rows*self.__periods[streamId]
+            
+            # without a marked start, assume the block was received right after it was acquired
+            if streamId not in self.__starts:
+                self.__starts[streamId] = now - endIndex/rate
+            
+            self.__pending[streamId].append((startIndex, block.copy()))
+            self.__streamTimes[streamId] = endIndex/rate
+            self.__lastArrivals[streamId] = now
+            
+            self.__Emit(now, False)
+    
+    def EndStream(self, streamId):
+        """Signal that a stream will not receive any more data.
+        
+        Used as the close callback of the data servers.
+        """
+        with self.__lock:
+            self.__ended.add(streamId)
+            self.__Emit(time.monotonic(), False)
+    
+    def Flush(self):
+        """Pass on all blocks still waiting for other streams, in time order.
+        """
+        with self.__lock:
+            self.__Emit(time.monotonic(), True)
+    
+    def __BlockTime(self, streamId, reference, startIndex):
+        """Time of a hardware sample index of a stream on the common time base."""
+        return self.__starts[streamId] - reference + startIndex/self.__sampleRates[streamId]
+    
+    def __Emit(self, now, flush):
+        """Invoke the callbacks for all due blocks.  Must be called with the lock held."""
+        
+        callbacks = list(self.__callbacks.values())
+        reference = min(self.__starts.values()) if len(self.__starts) else 0.0
+        
+        while True:
+            heads = [(self.__BlockTime(s, reference, self.__pending[s][0][0]), s) for s in self.__streamIds if len(self.__pending[s])]
+            if len(heads) == 0:
+                return
+            (startTime, streamId) = min(heads)
+            
+            if not flush:
+                for other in self.__streamIds:
+                    if other == streamId or other in self.__ended or len(self.__pending[other]):
+                        continue
+                    if other in self.__starts and self.__starts[other] - reference + self.__streamTimes.get(other, 0.0) >= startTime:
+                        continue
+                    if now - self.__lastArrivals[other] < self.__maxDelay:
+                        return
+            
+            (startIndex, block) = self.__pending[streamId].popleft()
+            for func in callbacks:
+                func(streamId, startTime, startIndex, block)
+
+
+class AcqNdtDataReceiver(metaclass=abc.ABCMeta):
+    """Callback, processing and delivery machinery shared by the data servers.
+    
+    AcqNdtDataServer (TCP) and AcqNdtDataUDPServer (UDP) only differ in how
+    they read the data of AcqKnowledge from the network.  Both decode whole
+    blocks of frames and pass them to DeliverBlock(), which updates the
+    clock and runs the processing stages, the dispatcher and the callbacks
+    registered with the member functions of this class.  Code using a data
+    server, such as AcqNdtStreamAggregator or
+    AcqNdtServer.WaitForAcquisitionEnd(), works with either transport.
+    
+    Subclasses are socketserver servers implementing the abstract
+    Collect(), run on the collector thread by Start().  Should not be
+    instantiated directly.
+    """
+    
+    ## maximum time in seconds EndOfData() waits for the dispatcher to
+    ## deliver the queued blocks
+    DrainTimeout = 5.0
+    
+    def __init__(self, channels, OSCHostname=None, OSCport=None, blockFrames=None, sampleRate=None):
+        """Default constructor.
+        
+        channels:	list of AcqNdtChannel objects whose data is received, see
+                    AcqNdtDataServer.
+        OSCHostname:	hostname of the OSC client passed to per frame callbacks,
+                    or None for no client.
+        OSCport:	port of the OSC client passed to per frame callbacks.
+        blockFrames:	optional maximum number of block rows decoded at once,
+                    1024 by default.
+        sampleRate:	optional hardware acquisition sampling rate in Hz, used as
+                    the nominal rate of the clock returned by GetClock().
+        """
+
+        self.__OSCport = OSCport
+        self.__OSCHostname = OSCHostname
+        self.OSCClient = None
+        if OSCHostname is not None:
+            self.OSCClient = udp_client.SimpleUDPClient(self.__OSCHostname, self.__OSCport)
+
+        self.__enabledChannels = channels
+        self.__frameSchedule = AcqNdtFrameSchedule(channels)
+        
+        if blockFrames is None:
+            blockFrames = 1024
+        if int(blockFrames) < 1:
+            raise ACQException("blockFrames must be a positive number of frames")
+        self.__blockFrames = int(blockFrames)
+        
+        self.__callBacks = {}
+        self.__blockCallBacks = {}
+        self.__timestampedCallBacks = set()
+        self.__closedCallBacks = {}
+        self.__dispatcher = None
+        self.__clock = AcqNdtSampleClock(sampleRate)
+        self.__stages = []
+        self.__outputSchedule = self.__frameSchedule
+        self.__endEvent = threading.Event()
+        self.__collect = True
+        
+        self.__collectorThread = threading.Thread(target=self.Collect)
         self.__collectorThread.setDaemon(True)
+    
+    def __del__(self):
+        """Default destrutor.
+        
+        Make sure that if our socket has not been closed, we perform appropriate
+        cleanup to close the socket.
+        """
+        
+        try:
+            self.server_close()
+        except:
+            pass
+    
+    def RegisterCallback(self, name, callback):
+        """Register a new callback function to be invoked to process data as it is delivered from AcqKnowledge.
+        
+        name:		set to a unique identifier that may reference the callback in RemoveCallback
+        callback:	set to the function callback.  Callbacks are invoked with
+                    three parameters and should have a signature
+                    "f(hardwareIndex, frame, chanInfo)".  These parameters
+                    are interpreted as follows:
+                    
+                    hardwareIndex 	the sample position of data that was acquired
+                                    as measured at the acquisition sampling rate.
+                                    For channels that are downsampled, this
+                                    should be divided by the SamplingDivider to
+                                    convert to a channel-relative sample.
+                    
+                    frame			a tuple of amplitude values for channels as
+                                    sampled at this hardware index
+                    
+                    channelInfo		a tuple of AcqNdtChannel objects with the
+                                    information corresponding to amplitude at
+                                    the same position within the frame tuple.
+                                    These may be used to determine channel type,
+                                    index, dividers, etc.  They will always
+                                    be elements of the channels array passed
+                                    into the constructor.
+        """
+        
+        if name in self.__callBacks:
+            raise ACQException("Callback name '" + name + "' is already in use")
+        
+        self.__callBacks[name] = callback
+    
+    def RemoveCallback(self, name):
+        """Remove a previously registered callback.
+        
+        name:	unique ID of the callback to be registered.
+        """
+        
+        if name in self.__callBacks:
+            del self.__callBacks[name]
+        
+    def GetCallbacks(self):
+        """Returns a dictionary of all registered callbacks, key is unique ID name, value is function reference.
+        """
+        
+        return dict(self.__callBacks) # read only
+    
+    def RegisterBlockCallback(self, name, callback, timestamps=False):
+        """Register a new callback function to be invoked with whole blocks of decoded frames.
+        
+        name:		set to a unique identifier that may reference the callback in RemoveBlockCallback
+        timestamps:	if True, the callback is invoked with a third parameter
+                    and should have a signature
+                    "f(startIndex, block, receiveTime)", where receiveTime is
+                    the time.monotonic() value at which the block was
+                    received.  Use GetClock() to map sample indexes to
+                    host or wall-clock time.
+        callback:	set to the function callback.  Callbacks are invoked with
+                    two parameters and should have a signature
+                    "f(startIndex, block)".  These parameters are interpreted
+                    as follows:
+                    
+                    startIndex		the hardware sample position of the first
+                                    frame of the block.  Row k of the block
+                                    starts at hardware sample
+                                    startIndex + k * GetFrameSchedule().GetPeriod().
+                    
+                    block			a numpy array of shape (rows, values) with
+                                    the big endian float32 amplitudes.  If
+                                    all channels share the same SamplingDivider
+                                    each row is one frame and the column order
+                                    matches the channels passed into the
+                                    constructor.  Otherwise each row is one
+                                    period of the frame schedule; use
+                                    GetFrameSchedule().Deinterleave(block) to
+                                    split it into per channel arrays.
+                                    The array is a view into the receive
+                                    buffer and is only valid until the
+                                    callback returns; use block.copy() to
+                                    keep the data.
+        """
+        
+        if name in self.__blockCallBacks:
+            raise ACQException("Block callback name '" + name + "' is already in use")
+        
+        self.__blockCallBacks[name] = callback
+        if timestamps:
+            self.__timestampedCallBacks.add(name)
+    
+    def RemoveBlockCallback(self, name):
+        """Remove a previously registered block callback.
+        
+        name:	unique ID of the block callback to be removed.
+        """
+        
+        if name in self.__blockCallBacks:
+            del self.__blockCallBacks[name]
+        self.__timestampedCallBacks.discard(name)
+    
+    def GetBlockCallbacks(self):
+        """Returns a dictionary of all registered block callbacks, key is unique ID name, value is function reference.
+        """
+        
+        return dict(self.__blockCallBacks) # read only
+            
+    def RegisterCloseCallback(self, name, callback):
+        """Register a new callback function to be invoked when the socket is closed..
+        
+        name:		set to a unique identifier that may reference the callback in RemoveCallback
+        callback:	set to the function callback.  Callbacks are invoked with
+                    no parameters and should have a signature
+                    "f()".
+        """
+        
+        if name in self.__closedCallBacks:
+            raise ACQException("Close callback name '" + name + "' is already in use")
+        
+        self.__closedCallBacks[name] = callback
+    
+    def GetCloseCallbacks(self):
+        """Returns a dictionary of all registered close callbacks, key is unique ID name, value is function reference.
+        """
+        
+        return dict(self.__closedCallBacks)	# read only
+    
+    def IsCollecting(self):
+        """Returns whether this object is actively waiting to process incoming network data.
+        """
+        return self.__collect
+    
+    def SetCollecting(self, state):
+        """Change whether the object should continue processing incoming network data.
+        
+        Should only be used by the data handling implementation.
+        
+        state:	New collecting state, True or False
+        """
+        self.__collect = state
+        
+    def GetEnabledChannels(self):
+        """Return a list of AcqNdtChannel objects whose incoming data is processed by this object.
+        """
+        return self.__enabledChannels
+    
+    def GetFrameSchedule(self):
+        """Return the AcqNdtFrameSchedule describing the layout of the incoming frames.
+        """
+        return self.__frameSchedule
+    
+    def GetBlockFrames(self):
+        """Returns the maximum number of block rows decoded at once.
+        """
+        return self.__blockFrames
+    
+    def EnableDispatcher(self, maxBlocks=64, policy="block", workers=1):
+        """Run the callbacks on consumer threads instead of the thread reading the socket.
+        
+        Decoded blocks are put in a bounded queue drained by an AcqNdtDispatcher,
+        so slow callbacks no longer delay reading data from AcqKnowledge.
+        Must be called before Start().
+        
+        maxBlocks:	maximum number of blocks waiting in the queue.
+        policy:		what to do when the queue is full: "block", "drop-oldest"
+                    or "drop-newest".
+        workers:	number of consumer threads.  With more than one worker
+                    callbacks may see blocks out of order.
+        
+        Returns the AcqNdtDispatcher, whose counters report the queue depth
+        and dropped frames.
+        """
+        
+        if self.__dispatcher is not None:
+            raise ACQException("A dispatcher is already enabled")
+        
+        self.__dispatcher = AcqNdtDispatcher(self.InvokeCallbacks, maxBlocks, policy, workers)
+        return self.__dispatcher
+    
+    def GetDispatcher(self):
+        """Returns the AcqNdtDispatcher enabled with EnableDispatcher(), or None.
+        """
+        return self.__dispatcher
+    
+    def GetClock(self):
+        """Returns the AcqNdtSampleClock fitting the received sample indexes against the host clock.
+        
+        The clock is reset whenever AcqKnowledge opens a new data connection.
+        """
+        return self.__clock
+    
+    def AddStage(self, stage):
+        """Append a processing stage run on every block before the callbacks.
+        
+        stage:	AcqNdtStage object, e.g. AcqNdtScaleStage, AcqNdtFilterStage,
+                AcqNdtDecimateStage or AcqNdtMovingRMSStage.
+        
+        Stages run in the order they were added, on the consumer threads
+        if a dispatcher is enabled; they keep state across blocks, so the
+        dispatcher should then use a single worker.  Callbacks receive the
+        output of the last stage as native float64 arrays, described by
+        GetOutputSchedule().  Stages require all channels to share the same
+        SamplingDivider and must be added before Start().
+        """
+        
+        if not self.__frameSchedule.IsUniform():
+            raise ACQException("Processing stages require all channels to share the same SamplingDivider")
+        
+        channels = stage.Configure(self.__outputSchedule.GetChannels())
+        self.__stages.append(stage)
+        self.__outputSchedule = AcqNdtFrameSchedule(channels)
+    
+    def GetStages(self):
+        """Returns the list of processing stages added with AddStage().
+        """
+        return list(self.__stages)
+    
+    def ResetStages(self):
+        """Reset the state of all processing stages.  Done whenever AcqKnowledge opens a new data connection.
+        """
+        for stage in self.__stages:
+            stage.Reset()
+    
+    def GetOutputSchedule(self):
+        """Return the AcqNdtFrameSchedule describing the blocks passed to the callbacks.
+        
+        This is the schedule of the received frames, GetFrameSchedule(),
+        unless processing stages changed the rate or the scaling of the
+        channels.  Pass it to outputs such as AcqNdtOSCSender or
+        AcqNdtSessionRecorder.
+        """
+        return self.__outputSchedule
+    
+    def HasEnded(self):
+        """Returns True once AcqKnowledge closed the data connection and all received data was processed.
+        """
+        return self.__endEvent.is_set()
+    
+    def WaitForEnd(self, timeout=None):
+        """Block until AcqKnowledge closed the data connection and all received data was processed.
+        
+        timeout:	maximum time to wait in seconds, or None to wait forever.
+        
+        Returns True if the data connection ended, False on timeout.
+        """
+        return self.__endEvent.wait(timeout)
+    
+    def EndOfData(self):
+        """Finish processing after AcqKnowledge closed the data connection.
+        
+        Should only be used by the data handling implementation.
+        
+        Waits until blocks queued in the dispatcher, if any, are delivered,
+        at most DrainTimeout seconds, invokes the close callbacks, stops
+        collecting and signals the end of the data to WaitForEnd().
+        """
+        
+        if self.__dispatcher is not None:
+            self.__dispatcher.WaitUntilEmpty(self.DrainTimeout)
+        
+        closeCallbacks = self.GetCloseCallbacks()
+        for (name, func) in closeCallbacks.items():
+            func()
+        
+        self.SetCollecting(False)
+        self.__endEvent.set()
+    
+    def DeliverBlock(self, startIndex, block, receiveTime=None):
+        """Pass a block of decoded frames on to the registered callbacks.
+        
+        Should only be used by the data handling implementation.
+        
+        The clock is updated with the block.  If a dispatcher is enabled the
+        block is queued for its consumer threads, otherwise the callbacks
+        are invoked directly.
+        
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (rows, GetFrameSchedule().GetPeriodValues())
+        receiveTime:	time.monotonic() value at which the block was received,
+                    the current time by default.
+        """
+        
+        if receiveTime is None:
+            receiveTime = time.monotonic()
+        self.__clock.Update(startIndex + len(block)*self.__frameSchedule.GetPeriod(), receiveTime)
+        
+        if self.__dispatcher is not None:
+            self.__dispatcher.Put(startIndex, block, receiveTime)
+        else:
+            self.InvokeCallbacks(startIndex, block, receiveTime)
+    
+    def InvokeCallbacks(self, startIndex, block, receiveTime=None):
+        """Invoke the registered callbacks for a block of decoded frames.
+        
+        Should only be used by the data handling implementation.
+        
+        The block is first passed through the processing stages, if any.
+        Block callbacks receive the whole block.  Per frame callbacks
+        registered with RegisterCallback() are invoked once for each row
+        of the block so existing callbacks keep working.
+        
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (rows, GetFrameSchedule().GetPeriodValues())
+        receiveTime:	time.monotonic() value at which the block was received
+        """
+        
+        for stage in self.__stages:
+            (startIndex, block) = stage.Process(startIndex, block)
+            if len(block) == 0:
+                return
+        
+        for (name, func) in self.GetBlockCallbacks().items():
+            if name in self.__timestampedCallBacks:
+                func(startIndex, block, receiveTime)
+            else:
+                func(startIndex, block)
+        
+        callbacks = self.GetCallbacks()
+        if len(callbacks) == 0:
+            return
+        
+        period = self.__outputSchedule.GetPeriod()
+        frames = self.__outputSchedule.GetFrames()
+        for row in block.tolist():
+            for (phase, channelsInSliceTuple, first, end) in frames:
+                frame = tuple(row[first:end])
+                for (name, func) in callbacks.items():
+                    func(startIndex + phase, frame, channelsInSliceTuple, self.OSCClient)
+            startIndex += period
+
+    def GetOSCPort(self):
+        """ Returns the port where the OSC client sends the acquired data. """
+        return self.__OSCport
+    
+    def Start(self):
+        """Begin waiting to receive data from AcqKnowledge and processing incoming data.
+        
+        This should be called prior to starting the data acquisition within AcqKnowledge.
+        """
+        self.__collect = True
+        self.__endEvent.clear()
+        if self.__dispatcher is not None:
+            self.__dispatcher.Start()
+        self.__collectorThread.start()
+        
+    def Stop(self):
+        """Stop processing incoming data.
+        
+        This should be called after data acquisition within AcqKnowledge has halted.
+        Blocks still queued in the dispatcher, if any, are delivered first.
+        """
+        self.__collect = False
+        self.__collectorThread.join()
+        
+        if self.__dispatcher is not None:
+            self.__dispatcher.Stop()
+        
+        # after our collection thread has stopped, also close our server socket.
+        # this avoids leaving it bound after the object is finished being
+        # used.
+        
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except:
+            pass
+        
+        try:
+            self.server_close()
+        except:
+            pass
+    
+    @abc.abstractmethod
+    def Collect(self):
+        """Receive and process the data of AcqKnowledge until the end of the acquisition.
+        
+        Implemented by the subclasses and run on the collector thread.
+        """
+
+
+class AcqNdtDataServer(AcqNdtDataReceiver, socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Receives binary data from AcqKnowledge during acquisitions using the network data transfer protocol and invokes callbacks to allow clients to process the data.
+    
+    Prior to starting the acquisition, the AcqNdtDataServer objects must be
+    created, callbacks registered using RegisterCallback(), and Start() invoked.
+    
+    If the delivery method used by the AcqNdtServer is 'single', then only
+    one AcqNdtDataServer object should be used.  If the delivery method used
+    by the AcqNdtServer is 'multiple', then there should be one AcqNdtDataServer
+    object created for each channel of data being received.
+    
+    After the acquisition is finished, Stop() should be invoked for each
+    AcqNdtDataServer to clean up processing and release network resources
+    used only during the acquisition.
+    """
+    
+    def __init__(self, port, channels,OSCHostname,OSCport, blockFrames=None, sampleRate=None):
+        """Default constructor.
+        
+        The arguments supplied to the constructor should vary depending on
+        the transfer mode of the AcqNdtServer object.
+        
+        
+        If AcqNdtServer.getDataConnectionMethod()=='single'
+        
+        port:	set this paramter to AcqNdtServer.getSingleConnectionModePort()
+        channels:	set this paramter to a list of all of the AcqNdtChannel objects
+                    that are set for delivery.  This list may be determined by the
+                    following list comprehension:
+                    
+                    [x for x in AcqNdtServer.GetAllChannels() if x.EnabledForDelivery]
+        
+        
+        If AcqNdtServer.getDataConnection()=='multiple', construct one object
+        for a specific AcqNdtChannel c using:
+        
+        port:	set this paramter to AcqNdtServer.GetDataConneciton(c)
+        channels:	set this parameter to a single element list with the channel object, e.g.
+        
+                    [c]
+        
+        blockFrames:	optional maximum number of frames decoded at once, 1024
+                    by default.  Incoming data is read in large chunks and
+                    decoded as whole blocks of frames which are passed to the
+                    callbacks registered with RegisterBlockCallback().
+                    Callbacks registered with RegisterCallback() are still
+                    invoked once per frame.  When channels use different
+                    SamplingDividers, one block row holds one period of the
+                    frame schedule and blockFrames counts periods.
+        sampleRate:	optional hardware acquisition sampling rate in Hz, as
+                    returned by AcqNdtServer.getSamplingRate().  Used as the
+                    nominal rate of the clock returned by GetClock().
+        """
+        
+        AcqNdtDataReceiver.__init__(self, channels, OSCHostname, OSCport, blockFrames, sampleRate)
+        
+        socketserver.TCPServer.__init__(self, ("",port), self.AcqNdtDataHandler)
+        # configure the socket for re-use 
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    
+    def Collect(self):
+        """Wait for the data connection of AcqKnowledge and process it.
+        
+        Should only be used by the data handling implementation.
+        """
+        self.handle_request()
+    
+    class AcqNdtDataHandler(socketserver.BaseRequestHandler):
+        """Internal implementation class used to handle the incoming data connections.
+        
+        Should not be used outside of the biopacndt module.
+        """
+        
+        def handle(self):
+            """Handle incoming data connection request.
+            
+            When the appropriate incoming data connection is made, it begins continuously
+            reading in the binary data delivered over the connection (big endian
+            32 bit floating point) and invokes registered data handling callbacks
+            to allow client code to process the data appropraitely.
+            
+            Bytes are accumulated in an AcqNdtReceiveBuffer until whole periods of
+            the frame schedule are available, so reads returning only part of a
+            frame are handled transparently.  Only a zero length read, meaning
+            AcqKnowledge closed the connection, ends the collection.
+            """
+            
+            enabledChannels = self.server.GetEnabledChannels()
+            
+            # check if the channels were porperly set
+            if len(enabledChannels) == 0:
+                self.server.SetCollecting(False)
+                return
+            
+            schedule = self.server.GetFrameSchedule()
+            period = schedule.GetPeriod()
+            periodValues = schedule.GetPeriodValues()
+            receiveBuffer = AcqNdtReceiveBuffer(self.server.GetBlockFrames(), schedule.GetPeriodSize())
+            
+            # sample indexes restart at 0 with every data connection
+            self.server.GetClock().Reset()
+            self.server.ResetStages()
+            
+            index = 0
+            while self.server.IsCollecting():
+                try:
+                    received = receiveBuffer.Receive(self.request)
+                except ConnectionResetError:
+                    received = 0
+                receiveTime = time.monotonic()
+                
+                if received == 0:
+                    # AcqKnowledge disconnected: deliver what is left and
+                    # invoke the close handlers
+                    self.server.EndOfData()
+                    break
+                
+                rows = receiveBuffer.GetAvailableUnits()
+                if rows == 0:
+                    continue
+                
+                # decode all complete periods at once, as a view into the
+                # receive buffer
+                block = receiveBuffer.GetArray(rows).reshape(rows, periodValues)
+                self.server.DeliverBlock(index, block, receiveTime)
+                
+                receiveBuffer.Consume(rows)
+                index += rows*period
+
+class AcqNdtRelayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Republishes the data received by an AcqNdtDataServer to any number of local TCP clients.
+    
+    AcqKnowledge delivers its data over a single connection to a single
+    data server.  A relay server lets other consumers, such as Max, a
+    recorder and an analysis process, read the same stream: data is
+    received once and every block is sent to all connected clients.
+    Clients may connect and disconnect at any time during the acquisition
+    without any effect on AcqKnowledge or on the other clients.
+    
+    Clients receive the rows of the blocks exactly as delivered by
+    AcqKnowledge, big endian float32, starting with the next block after
+    they connected.  With header, every client first receives a session
+    file header (see AcqNdtSessionRecorder.EncodeHeader()) describing the
+    channels and the hardware sample index of its first row, so the stream
+    received by a client is a valid session file.
+    
+    Every client has its own send queue.  A client which does not keep up
+    and lets more than maxQueuedBytes accumulate is disconnected instead
+    of slowing down the others.
+    
+    Register the Write member function as a block callback:
+    
+        relay = AcqNdtRelayServer(port, dataServer.GetOutputSchedule())
+        dataServer.RegisterBlockCallback("Relay", relay.Write)
+        relay.Start()
+    """
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, port, schedule, host="127.0.0.1", header=False, sampleRate=None, labels=None, maxQueuedBytes=8 << 20):
+        """Default constructor.
+        
+        port:		TCP port the clients connect to.
+        schedule:	AcqNdtFrameSchedule of the blocks written to the relay,
+                    see AcqNdtDataServer.GetOutputSchedule().
+        host:		interface to listen on, only the local host by default.
+        header:		send a session file header to every client before the data.
+        sampleRate:	hardware acquisition sampling rate in Hz for the header, or None.
+        labels:		optional list of channel labels for the header.
+        maxQueuedBytes:	amount of data waiting to be sent to a client after
+                    which the client is disconnected.
+        """
+        
+        self.__schedule = schedule
+        self.__header = header
+        self.__sampleRate = sampleRate
+        self.__labels = labels
+        self.__maxQueuedBytes = int(maxQueuedBytes)
+        
+        self.__clients = []
+        self.__clientsLock = threading.Lock()
+        self.__droppedClients = 0
+        self.__running = False
+        
+        self.__serverThread = threading.Thread(target=self.serve_forever)
+        self.__serverThread.daemon = True
+        
+        socketserver.TCPServer.__init__(self, (host, port), self.AcqNdtRelayHandler)
+    
+    def Start(self):
+        """Begin accepting clients.
+        """
+        self.__running = True
+        self.__serverThread.start()
+    
+    def Stop(self):
+        """Disconnect all clients and stop accepting new ones.
+        """
+        if self.__running:
+            self.__running = False
+            self.shutdown()
+        
+        with self.__clientsLock:
+            clients = list(self.__clients)
+        for client in clients:
+            client.Close()
+        
+        self.server_close()
+    
+    def IsRunning(self):
+        """Returns whether the relay accepts clients.
+        """
+        return self.__running
+    
+    def GetClientCount(self):
+        """Returns the number of connected clients.
+        """
+        with self.__clientsLock:
+            return len(self.__clients)
+    
+    def GetDroppedClients(self):
+        """Returns the number of clients disconnected because they did not keep up.
+        """
+        return self.__droppedClients
+    
+    def Write(self, startIndex, block):
+        """Block callback queueing a block for every connected client.
+        
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (rows, GetPeriodValues()) of the schedule
+        """
         
-        socketserver.TCPServer.__init__(self, ("",port), self.AcqNdtDataHandler)
-        # configure the socket for re-use 
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        with self.__clientsLock:
+            clients = list(self.__clients)
+        if len(clients) == 0:
+            return
+        
+        data = numpy.ascontiguousarray(block, dtype='>f4').tobytes()
+        for client in clients:
+            if not client.Put(startIndex, data, self.__maxQueuedBytes):
+                # Write may run on several dispatcher workers: count and
+                # close every client once
+                with self.__clientsLock:
+                    dropped = client in self.__clients
+                    if dropped:
+                        self.__clients.remove(client)
+                        self.__droppedClients += 1
+                if dropped:
+                    client.Close()
+    
+    def AddClient(self, client):
+        """Should only be used by the relay handling implementation."""
+        with self.__clientsLock:
+            self.__clients.append(client)
+    
+    def RemoveClient(self, client):
+        """Should only be used by the relay handling implementation."""
+        with self.__clientsLock:
+            if client in self.__clients:
+                self.__clients.remove(client)
+    
+    def EncodeHeader(self, startIndex):
+        """Returns the header sent to a client whose first row is at startIndex, or an empty string.
+        
+        Should only be used by the relay handling implementation.
+        """
+        if not self.__header:
+            return b""
+        return AcqNdtSessionRecorder.EncodeHeader(self.__schedule, startIndex, self.__sampleRate, self.__labels)
+    
+    class AcqNdtRelayHandler(socketserver.BaseRequestHandler):
+        """Internal implementation class sending the queued data to one relay client.
+        
+        Should not be used outside of the biopacndt module.
+        """
+        
+        def setup(self):
+            self.__queue = collections.deque()
+            self.__queuedBytes = 0
+            self.__condition = threading.Condition()
+            self.__closed = False
+            self.__started = False
+        
+        def Put(self, startIndex, data, maxQueuedBytes):
+            """Queue data for the client.  Returns False if the client did not keep up."""
+            
+            with self.__condition:
+                if self.__closed:
+                    return True
+                if self.__queuedBytes + len(data) > maxQueuedBytes:
+                    return False
+                if not self.__started:
+                    # the first data of a client starts with the header
+                    self.__started = True
+                    header = self.server.EncodeHeader(startIndex)
+                    if len(header):
+                        self.__queue.append(header)
+                        self.__queuedBytes += len(header)
+                self.__queue.append(data)
+                self.__queuedBytes += len(data)
+                self.__condition.notify()
+            return True
+        
+        def Close(self):
+            """Disconnect the client."""
+            with self.__condition:
+                self.__closed = True
+                self.__condition.notify()
+            
+            # also interrupts a send to a client which stopped reading
+            try:
+                self.request.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        
+        def handle(self):
+            """Send the queued data until the client disconnects or the relay stops."""
+            
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.server.AddClient(self)
+            try:
+                while True:
+                    with self.__condition:
+                        while len(self.__queue) == 0 and not self.__closed:
+                            self.__condition.wait()
+                        if self.__closed:
+                            break
+                        data = b"".join(self.__queue)
+                        self.__queue.clear()
+                        self.__queuedBytes = 0
+                    self.request.sendall(data)
+            except OSError:
+                pass
+            finally:
+                self.server.RemoveClient(self)
+                self.Close()
+
+
+class AcqNdtSharedRing:
+    """Publishes the data received by an AcqNdtDataServer in a shared memory ring buffer.
+    
+    Sending frames to other processes on the same computer through OSC or
+    a socket costs a system call and an encoding step for every message.
+    A shared ring is written once by the data server and read directly by
+    any number of AcqNdtSharedRingReader objects in other processes, which
+    attach to it by name.
+    
+    The ring holds the last capacity rows of the blocks (periods of the
+    frame schedule) as native float32, decoded from the big endian values
+    delivered by AcqKnowledge, together with the hardware sample index of
+    every row.  There is a single writer and no lock, the counters work like
+    a sequence lock: the writer publishes the count of rows it is about to
+    write, writes them and publishes the row count afterwards.  Readers
+    compare the rows they copied against the first count once done, which
+    detects rows overwritten while they were copying them, even by a write
+    still in progress.
+    
+    Segment layout:
+    
+        Magic, header length, data offset (uint32 each)
+        row count, closed flag, writing row count (int64 each)
+        JSON header (see AcqNdtSessionRecorder.EncodeHeader()) with the capacity
+        int64 hardware index of every row, at the data offset
+        float32 values, capacity rows of GetPeriodValues() values
+    
+    Register the Write member function as a block callback:
+    
+        ring = AcqNdtSharedRing("bioharness", dataServer.GetOutputSchedule())
+        dataServer.RegisterBlockCallback("SharedRing", ring.Write)
+    """
+    
+    ## identifies shared rings, followed by the header length, data offset and JSON header
+    Magic = b"ACQNDTR2"
+    
+    ## offset of the row count, closed flag and writing row count
+    CountersOffset = 16
+    
+    ## offset of the JSON header
+    HeaderOffset = 40
+    
+    ## names of the rings created by this process
+    Created = set()
+    
+    def __init__(self, name, schedule, capacity=65536, sampleRate=None, labels=None):
+        """Default constructor.
+        
+        name:		name of the shared memory segment readers attach to, or None
+                    for a unique name, see GetName().
+        schedule:	AcqNdtFrameSchedule of the blocks written to the ring,
+                    see AcqNdtDataServer.GetOutputSchedule().
+        capacity:	number of rows kept in the ring.
+        sampleRate:	hardware acquisition sampling rate in Hz, or None if unknown.
+        labels:		optional list of channel labels in the order of the schedule channels.
+        """
+        
+        if capacity < 1:
+            raise ACQException("The capacity of a shared ring must be at least one row")
+        if labels is not None and len(labels) != len(schedule.GetChannels()):
+            raise ACQException("One label is required for each channel")
+        
+        self.__schedule = schedule
+        self.__period = schedule.GetPeriod()
+        self.__capacity = int(capacity)
+        self.__count = 0
+        self.__lock = threading.Lock()
+        
+        # the session file header describes the channels, the capacity is added
+        encoded = AcqNdtSessionRecorder.EncodeHeader(schedule, 0, sampleRate, labels)
+        (headerLength,) = struct.unpack("<L", encoded[len(AcqNdtSessionRecorder.Magic):len(AcqNdtSessionRecorder.Magic) + 4])
+        header = json.loads(encoded[len(AcqNdtSessionRecorder.Magic) + 8:len(AcqNdtSessionRecorder.Magic) + 8 + headerLength].decode("utf-8"))
+        del header["startIndex"]
+        header["dtype"] = "=f4"
+        header["capacity"] = self.__capacity
+        encoded = json.dumps(header).encode("utf-8")
+        
+        periodValues = schedule.GetPeriodValues()
+        dataOffset = -(-(self.HeaderOffset + len(encoded)) // AcqNdtSessionRecorder.HeaderAlignment)*AcqNdtSessionRecorder.HeaderAlignment
+        size = dataOffset + self.__capacity*(8 + 4*periodValues)
+        
+        self.__memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        AcqNdtSharedRing.Created.add(self.__memory.name)
+        try:
+            buf = self.__memory.buf
+            buf[:self.CountersOffset] = self.Magic + struct.pack("<LL", len(encoded), dataOffset)
+            buf[self.HeaderOffset:self.HeaderOffset + len(encoded)] = encoded
+            self.__counters = numpy.ndarray((3,), dtype=numpy.int64, buffer=buf, offset=self.CountersOffset)
+            self.__counters[:] = 0
+            self.__indexes = numpy.ndarray((self.__capacity,), dtype=numpy.int64, buffer=buf, offset=dataOffset)
+            self.__rows = numpy.ndarray((self.__capacity, periodValues), dtype=numpy.float32, buffer=buf,
+                                        offset=dataOffset + 8*self.__capacity)
+        except:
+            self.__memory.close()
+            self.__memory.unlink()
+            AcqNdtSharedRing.Created.discard(self.__memory.name)
+            raise
     
     def __del__(self):
-        """Default destrutor.
+        """Default destructor.
         
-        Make sure that if our socket has not been closed, we perform appropriate
-        cleanup to close the socket.
+        Removes the shared memory segment which will no longer be written
+        after this object no longer exists.
         """
         
         try:
-            self.server_close()
+            self.Close()
         except:
             pass
     
-    def RegisterCallback(self, name, callback):
-        """Register a new callback function to be invoked to process data as it is delivered from AcqKnowledge.
-        
-        name:		set to a unique identifier that may reference the callback in RemoveCallback
-        callback:	set to the function callback.  Callbacks are invoked with
-                    three parameters and should have a signature
-                    "f(hardwareIndex, frame, chanInfo)".  These parameters
-                    are interpreted as follows:
-                    
-                    hardwareIndex 	the sample position of data that was acquired
-                                    as measured at the acquisition sampling rate.
-                                    For channels that are downsampled, this
-                                    should be divided by the SamplingDivider to
-                                    convert to a channel-relative sample.
-                    
-                    frame			a tuple of amplitude values for channels as
-                                    sampled at this hardware index
-                    
-                    channelInfo		a tuple of AcqNdtChannel objects with the
-                                    information corresponding to amplitude at
-                                    the same position within the frame tuple.
-                                    These may be used to determine channel type,
-                                    index, dividers, etc.  They will always
-                                    be elements of the channels array passed
-                                    into the constructor.
+    def GetName(self):
+        """Returns the name readers use to attach to the ring.
         """
+        return self.__memory.name
+    
+    def GetCapacity(self):
+        """Returns the number of rows kept in the ring.
+        """
+        return self.__capacity
+    
+    def GetWrittenRows(self):
+        """Returns the number of rows written to the ring so far.
+        """
+        return self.__count
+    
+    def Write(self, startIndex, block):
+        """Block callback copying a block into the ring.
         
-        if name in self.__callBacks:
-            raise ACQException("Callback name '" + name + "' is already in use")
+        startIndex:	hardware sample index of the first row in the block
+        block:		numpy array of shape (rows, GetPeriodValues()) of the schedule
+        """
         
-        self.__callBacks[name] = callback
+        with self.__lock:
+            if self.__counters is None:
+                raise ACQException("Shared ring is already closed")
+            
+            rows = len(block)
+            first = 0
+            if rows > self.__capacity:
+                # only the last rows of a block larger than the ring are kept
+                first = rows - self.__capacity
+            
+            # announce the rows about to be overwritten before writing them
+            self.__counters[2] = self.__count + rows
+            
+            count = self.__count + first
+            position = count % self.__capacity
+            written = 0
+            while first + written < rows:
+                length = min(rows - first - written, self.__capacity - position)
+                begin = first + written
+                self.__rows[position:position + length] = block[begin:begin + length]
+                self.__indexes[position:position + length] = startIndex + numpy.arange(begin, begin + length)*self.__period
+                written += length
+                position = 0
+            
+            # publish the rows only once they are written
+            self.__count += rows
+            self.__counters[0] = self.__count
     
-    def RemoveCallback(self, name):
-        """Remove a previously registered callback.
+    def Close(self):
+        """Mark the ring as closed for its readers and remove the shared memory segment.
         
-        name:	unique ID of the callback to be registered.
+        Readers which are already attached keep their mapping of the segment.
         """
         
-        if name in self.__callBacks:
-            del self.__callBacks[name]
+        with self.__lock:
+            if self.__counters is None:
+                return
+            self.__counters[1] = 1
+            # release the views before closing the mapping
+            self.__counters = None
+            self.__indexes = None
+            self.__rows = None
+            self.__memory.close()
+            self.__memory.unlink()
+            AcqNdtSharedRing.Created.discard(self.__memory.name)
+
+
+class AcqNdtSharedRingReader:
+    """Reads the data published by an AcqNdtSharedRing, usually in another process.
+    
+    Reading starts with the rows written after the reader attached.  Every
+    Read() returns the rows written since the previous one, copied out of
+    the ring.  When the reader falls behind by more than the capacity of the
+    ring the oldest rows are overwritten by the writer; they are skipped and
+    counted, see GetLostRows().
+    
+    GetRows() and GetIndexes() give direct access to the memory of the ring
+    without any copy.  The writer may overwrite those rows at any time: rows
+    with a count below GetWritingRows() - GetCapacity(), checked after using
+    them, may have been overwritten.
+    """
+    
+    def __init__(self, name):
+        """Default constructor.
         
-    def GetCallbacks(self):
-        """Returns a dictionary of all registered callbacks, key is unique ID name, value is function reference.
+        name:		name of the shared memory segment, see AcqNdtSharedRing.GetName().
         """
         
-        return dict(self.__callBacks) # read only
-            
-    def RegisterCloseCallback(self, name, callback):
-        """Register a new callback function to be invoked when the socket is closed..
+        try:
+            self.__memory = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            raise ACQException("There is no shared ring named '" + str(name) + "'")
+        
+        # the segment belongs to the writer: it must not be removed when the
+        # process of a reader exits
+        if self.__memory.name not in AcqNdtSharedRing.Created:
+            resource_tracker.unregister(self.__memory._name, "shared_memory")
+        
+        buf = self.__memory.buf
+        fixed = bytes(buf[:AcqNdtSharedRing.CountersOffset])
+        if not fixed.startswith(AcqNdtSharedRing.Magic):
+            self.__memory.close()
+            raise ACQException("'" + str(name) + "' is not an NDT shared ring")
+        (headerLength, dataOffset) = struct.unpack("<LL", fixed[len(AcqNdtSharedRing.Magic):])
+        self.__header = json.loads(bytes(buf[AcqNdtSharedRing.HeaderOffset:AcqNdtSharedRing.HeaderOffset + headerLength]).decode("utf-8"))
+        
+        self.__channels = AcqNdtSessionReader.ChannelsFromHeader(self.__header)
+        self.__schedule = AcqNdtFrameSchedule(self.__channels)
+        
+        self.__capacity = self.__header["capacity"]
+        self.__counters = numpy.ndarray((3,), dtype=numpy.int64, buffer=buf, offset=AcqNdtSharedRing.CountersOffset)
+        self.__indexes = numpy.ndarray((self.__capacity,), dtype=numpy.int64, buffer=buf, offset=dataOffset)
+        self.__rows = numpy.ndarray((self.__capacity, self.__header["periodValues"]), dtype=numpy.float32, buffer=buf,
+                                    offset=dataOffset + 8*self.__capacity)
+        self.__rows.flags.writeable = False
+        self.__indexes.flags.writeable = False
+        
+        self.__next = int(self.__counters[0])
+        self.__lost = 0
+    
+    def __del__(self):
+        """Default destructor.
         
-        name:		set to a unique identifier that may reference the callback in RemoveCallback
-        callback:	set to the function callback.  Callbacks are invoked with
-                    no parameters and should have a signature
-                    "f()".
+        Releases the mapping of the shared memory segment.
         """
         
-        if name in self.__closedCallBacks:
-            raise ACQException("Close callback name '" + name + "' is already in use")
-        
-        self.__closedCallBacks[name] = callback
+        try:
+            self.Close()
+        except:
+            pass
     
-    def GetCloseCallbacks(self):
-        """Returns a dictionary of all registered close callbacks, key is unique ID name, value is function reference.
+    def GetHeader(self):
+        """Returns the header of the ring as a dictionary.
+        """
+        return dict(self.__header)
+    
+    def GetChannels(self):
+        """Returns the list of AcqNdtChannel objects in the ring.
+        """
+        return list(self.__channels)
+    
+    def GetLabels(self):
+        """Returns the list of channel labels in the order of GetChannels().
+        """
+        return [info["label"] for info in self.__header["channels"]]
+    
+    def GetSampleRate(self):
+        """Returns the hardware acquisition sampling rate in Hz, or None if it is unknown.
+        """
+        return self.__header["sampleRate"]
+    
+    def GetFrameSchedule(self):
+        """Returns the AcqNdtFrameSchedule of the rows in the ring.
+        """
+        return self.__schedule
+    
+    def GetCapacity(self):
+        """Returns the number of rows kept in the ring.
         """
+        return self.__capacity
+    
+    def GetWrittenRows(self):
+        """Returns the number of rows written to the ring so far.
         
-        return dict(self.__closedCallBacks)	# read only
+        The row with count n is stored at position n % GetCapacity().
+        """
+        return int(self.__counters[0])
     
-    def IsCollecting(self):
-        """Returns whether this object is actively waiting to process incoming network data.
+    def GetWritingRows(self):
+        """Returns the number of rows written to the ring once the write in progress, if any, completes.
+        
+        Rows with a count below GetWritingRows() - GetCapacity() may have
+        been overwritten.
         """
-        return self.__collect
+        return int(self.__counters[2])
     
-    def SetCollecting(self, state):
-        """Change whether the object should continue processing incoming network data.
+    def GetLostRows(self):
+        """Returns the number of rows overwritten before this reader read them.
+        """
+        return self.__lost
+    
+    def IsClosed(self):
+        """Returns whether the writer closed the ring.  No more rows will be written.
+        """
+        return self.__counters[1] != 0
+    
+    def GetRows(self):
+        """Returns a read-only view of all of the rows in the ring, without any copy.
+        """
+        return self.__rows
+    
+    def GetIndexes(self):
+        """Returns a read-only view of the hardware sample index of every row in the ring, without any copy.
+        """
+        return self.__indexes
+    
+    def Read(self, maxRows=None):
+        """Returns the rows written since the previous call.
         
-        Should only be used by the data handling implementation.
+        maxRows:	maximum number of rows to return, or None for all of them.
         
-        state:	New collecting state, True or False
+        Returns a tuple of a numpy array with the hardware sample index of
+        every row and a numpy array of shape (rows, GetPeriodValues()).
+        Both are empty when no new rows were written.
         """
-        self.__collect = state
         
-    def GetEnabledChannels(self):
-        """Return a list of AcqNdtChannel objects whose incoming data is processed by this object.
+        count = int(self.__counters[0])
+        first = max(self.__next, count - self.__capacity)
+        self.__lost += first - self.__next
+        end = count if maxRows is None else min(count, first + maxRows)
+        
+        positions = numpy.arange(first, end) % self.__capacity
+        indexes = self.__indexes[positions]
+        rows = self.__rows[positions]
+        
+        # the writer may have overwritten the oldest rows while they were
+        # copied, including rows of a write not published yet
+        overwritten = min(end, int(self.__counters[2]) - self.__capacity) - first
+        if overwritten > 0:
+            self.__lost += overwritten
+            indexes = indexes[overwritten:]
+            rows = rows[overwritten:]
+        
+        self.__next = end
+        return (indexes, rows)
+    
+    def Close(self):
+        """Release the mapping of the shared memory segment.
         """
-        return self.__enabledChannels
+        
+        if self.__rows is None:
+            return
+        self.__counters = None
+        self.__indexes = None
+        self.__rows = None
+        self.__memory.close()
 
-    def GetOSCPort(self):
-        """ Returns the port where the OSC client sends the acquired data. """
-        return self.__OSCport
+
+class AcqNdtDataUDPServer(AcqNdtDataReceiver, socketserver.UDPServer):
+    """UDP version of AcqNdtDataServer.
     
-    def Start(self):
-        """Begin waiting to receive data from AcqKnowledge and processing incoming data.
+    Receives binary data from AcqKnowledge during acquisitions using the network data transfer protocol and invokes callbacks to allow clients to process the data.
+    
+    Every datagram starts with a ">LL" header, a datagram sequence number
+    and the hardware sample index of its first frame, followed by whole
+    frames of big endian float32 values laid out as in the frame schedule.
+    A single collector thread receives all waiting datagrams at once (see
+    AcqNdtDatagramBuffer), copies their values into block rows and passes
+    the complete rows to the same callbacks as AcqNdtDataServer, so both
+    transports are used in the same way.
+    
+    The header counters, not the order of arrival, place the frames on
+    the timeline (see AcqNdtDatagramAssembler).  Datagrams arriving after
+    later ones are put back in order within a window of reorderDatagrams
+    datagrams.  Gaps left by lost datagrams are skipped, making the block
+    indexes jump, or filled with NaN, the last values or a linear
+    interpolation, so callbacks receive a continuous timeline.
+    GetStatistics() counts lost, duplicated and reordered frames.
+    
+    As UDP has no connection, the end of the acquisition is detected when
+    no datagram arrives for idleTimeout seconds.
+    
+    Prior to starting the acquisition, the AcqNdtDataUDPServer objects must be
+    created, callbacks registered using RegisterCallback() or
+    RegisterBlockCallback(), and Start() invoked.  See AcqNdtDataServer
+    for the 'single' and 'multiple' delivery methods.
+    """
+    
+    ## binary header of every datagram: sequence number and hardware sample index
+    Header = struct.Struct(">LL")
+    
+    def __init__(self, port, channels, OSCHostname=None, OSCport=None, blockFrames=None, sampleRate=None,
+                 batchDatagrams=64, idleTimeout=2.0, gapFill=None, reorderDatagrams=0, maxFillFrames=65536):
+        """Default constructor.
         
-        This should be called prior to starting the data acquisition within AcqKnowledge.
+        port, channels, blockFrames, sampleRate:	see AcqNdtDataServer.
+        OSCHostname:	optional hostname of the OSC client passed to per frame
+                    callbacks, as for AcqNdtDataServer.
+        OSCport:	port of the OSC client passed to per frame callbacks.
+        batchDatagrams:	maximum number of datagrams received with one system call.
+        idleTimeout:	time in seconds without datagrams after which the
+                    acquisition is considered finished.
+        gapFill:	how gaps left by lost datagrams appear in the blocks: None
+                    to skip them, "nan", "hold" or "linear" to fill them.
+        reorderDatagrams:	maximum number of datagrams held while waiting for
+                    earlier ones, 0 to give up missing datagrams at once.
+        maxFillFrames:	longest gap in frames which is filled, longer gaps are
+                    skipped.
         """
-        self.__collect = True
-        self.__collectorThread.start()
-        
-    def Stop(self):
-        """Stop processing incoming data.
         
-        This should be called after data acquisition within AcqKnowledge has halted.
-        """
-        self.__collect = False
-        self.__collectorThread.join()
+        AcqNdtDataReceiver.__init__(self, channels, OSCHostname, OSCport, blockFrames, sampleRate)
         
-        # after our collection thread has stopped, also close our server socket.
-        # this avoids leaving it bound after the object is finished being
-        # used.
+        self.__batchDatagrams = int(batchDatagrams)
+        self.__idleTimeout = idleTimeout
+        self.__gapFill = gapFill
+        self.__reorderDatagrams = reorderDatagrams
+        self.__maxFillFrames = maxFillFrames
+        self.__assembler = self.__NewAssembler()
+        self.__statistics = {}
+        self.ResetStatistics()
         
+        socketserver.UDPServer.__init__(self, ("",port), None)
+        # configure the socket for re-use 
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # leave room for bursts of datagrams while callbacks run
         try:
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        except OSError:
             pass
+    
+    def GetStatistics(self):
+        """Returns a dictionary of counters of the received data.
         
-        try:
-            self.server_close()
-        except:
-            pass
+        datagrams:	datagrams received.
+        bytes:		bytes received, including the headers.
+        malformedDatagrams:	datagrams dropped because they did not hold whole frames.
         
-    class AcqNdtDataHandler(socketserver.BaseRequestHandler):
-        """Internal implementation class used to handle the incoming data connections.
+        and the counters of the current or last acquisition described in
+        AcqNdtDatagramAssembler.GetStatistics(): frames, lostDatagrams,
+        lateDatagrams, lostFrames, filledFrames, duplicatedFrames,
+        reorderedFrames and lateFrames.
+        """
+        statistics = self.__assembler.GetStatistics()
+        statistics.update(self.__statistics)
+        return statistics
+    
+    def ResetStatistics(self):
+        """Set all counters returned by GetStatistics() to zero.
+        """
+        self.__statistics = {"datagrams": 0, "bytes": 0, "malformedDatagrams": 0}
+        self.__assembler.ResetStatistics()
+    
+    def __NewAssembler(self):
+        """Returns an AcqNdtDatagramAssembler delivering to this server."""
+        return AcqNdtDatagramAssembler(self.GetFrameSchedule(), self.DeliverBlock, self.GetBlockFrames(),
+                                       self.__gapFill, self.__reorderDatagrams, self.__maxFillFrames)
+    
+    def Collect(self):
+        """Receive datagrams and process them until the end of the acquisition.
         
-        Should not be used outside of the biopacndt module.
+        Should only be used by the data handling implementation.
         """
         
-        def handle(self):
-            """Handle incoming data connection request.
+        if len(self.GetEnabledChannels()) == 0:
+            self.SetCollecting(False)
+            return
+        
+        datagrams = AcqNdtDatagramBuffer(self.__batchDatagrams)
+        
+        self.socket.setblocking(False)
+        started = False
+        lastReceive = None
+        
+        while self.IsCollecting():
+            (readable, writable, failed) = select.select([self.socket], [], [], 0.25)
+            if not readable:
+                if started and time.monotonic() - lastReceive >= self.__idleTimeout:
+                    # no data for a while: the acquisition ended
+                    self.__assembler.End(time.monotonic())
+                    self.EndOfData()
+                    break
+                continue
             
-            When the appropriate incoming data connection is made, it begins continuously
-            reading in the binary data delivered over the connection (assumed 64 bit
-            floating point native endian) and invokes registered data handling callbacks
-            to allow client code to process the data appropraitely.
-            """
+            received = datagrams.Receive(self.socket)
+            receiveTime = time.monotonic()
+            if received == 0:
+                continue
+            lastReceive = receiveTime
             
+            if not started:
+                # sample indexes restart with every acquisition
+                started = True
+                self.GetClock().Reset()
+                self.ResetStages()
+                self.__assembler = self.__NewAssembler()
             
-            enabledChannels = self.server.GetEnabledChannels()
+            for i in range(received):
+                datagram = datagrams.GetDatagram(i)
+                self.__statistics["datagrams"] += 1
+                self.__statistics["bytes"] += len(datagram)
+                if len(datagram) < self.Header.size or (len(datagram) - self.Header.size) % 4:
+                    self.__statistics["malformedDatagrams"] += 1
+                    continue
+                
+                (sequence, index) = self.Header.unpack_from(datagram)
+                values = numpy.frombuffer(datagram, dtype='>f4', offset=self.Header.size)
+                if not self.__assembler.Put(sequence, index, values, receiveTime):
+                    self.__statistics["malformedDatagrams"] += 1
             
-            # check if the channels were porperly set
-            if len(enabledChannels) == 0:
-                self.server.SetCollecting(False)
+            # deliver all complete rows of the datagrams received at once
+            self.__assembler.Flush(receiveTime)
+
+
+class AcqNdtAsyncServer:
+    """ asyncio version of AcqNdtServer used to control a remote AcqKnowledge application.
     
-            # use python long to avoid wrap issues.  Long is fine here
-            # as it matches the 32 bit maximum limit on hardware samples
-            # within AcqKnowledge. [deprecated for python 3.x]
-            index = 0
-            while self.server.IsCollecting():
-                # determine how many bytes to read per frame
-                binaryFormat = ">"
-                channelsInSlice = []
-                if len(enabledChannels) == 1:
-                    channelsInSlice = enabledChannels
-                else:
-                    for ch in enabledChannels:
-                        if ((index % ch.SamplingDivider) == 0):
-                            channelsInSlice.append(ch)
+    All control connection calls are coroutines sent over a single
+    persistent HTTP/1.1 connection owned by the event loop, without any
+    threads.  Dispatched methods are invoked as in AcqNdtServer, but must be
+    awaited:
     
-                binaryFormat += "f"*len(channelsInSlice)
-                # print(len(channelsInSlice))
+        acqServer = AcqNdtAsyncServer(host, port)
+        await acqServer.Connect()
+        if await acqServer.getAcquisitionInProgress():
+            await acqServer.toggleAcquisition()
     
-                # number of bytes to read #move the comment somewhere else
-                recvLen = (len(binaryFormat) - 1)*4
-                
-                # ignore request for zero bytes
-                if 0 != recvLen:
-                    # read the bytes off the socket
-                    buf = self.request.recv(recvLen)
-                    # stop error
-                    if len(buf) != recvLen:
-                        # invoke the close handlers if AcqKnowledge disconnected
-                        if len(buf) == 0:
-                            closeCallbacks = self.server.GetCloseCallbacks()
-                            for (name, func) in closeCallbacks.items():
-                                func()
-                        
-                        self.server.SetCollecting(False)
-                    else:
-                        # convert the buffer into an array of doubles
-                        frame = struct.unpack(binaryFormat, buf)
-                        
-                        # convert the modifiable list of channel info into
-                        # a tuple to prevent modfiication by callbacks
-                        
-                        channelsInSliceTuple = tuple(channelsInSlice)
-                        
-                        # call the callback functions
-                        callbacks = self.server.GetCallbacks()
-                        for (name, func) in callbacks.items():
-                            func(index, frame, channelsInSliceTuple,self.server.OSCClient)
-                
-                index += 1
-
-class AcqNdtDataUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
-    """UDP version of AcqNdtDataServer.
+    Channel discovery is batched and cached as in AcqNdtServer.
+    """
     
-    Receives binary data from AcqKnowledge during acquisitions using the network data transfer protocol and invokes callbacks to allow clients to process the data.
+    def __init__(self, host, port):
+        """ Default constructor.
+        
+        No network connection is made until Connect() is awaited.
+        
+        host: The IP address or host name of a computer running AcqKnowledge.
+        port: The port number where the XML-RPC server is listening on.
+        """
+        
+        self.__rpcMethods = []
+        self.__Host = str(host)
+        self.__ControlPort = int(port)
+        self.__acqRPCNamespace = "acq."
+        self.__supportsMulticall = False
+        self.__channelCache = {}
+        self.__inBetweenMessageTime = 0.25
+        self.__maxPollingTime = 2.0
+        self.__dataConnectionTimeout = 2
+        
+        self.__reader = None
+        self.__writer = None
+        self.__lock = None
     
-    Prior to starting the acquisition, the AcqNdtDataServer objects must be
-    created, callbacks registered using RegisterCallback(), and Start() invoked.
+    async def Connect(self):
+        """Connect to AcqKnowledge, retrieve the list of dispatched methods and configure the data transfer settings.
+        """
+        
+        self.__lock = asyncio.Lock()
+        fullList = await self.CallMethod("system.listMethods")
+        self.__rpcMethods = [m.replace(self.__acqRPCNamespace,"",1) for m in fullList if m.startswith(self.__acqRPCNamespace)]
+        self.__supportsMulticall = "system.multicall" in fullList
+        
+        #always use tcp with our tcp timeout
+        await self.CallBatch([("changeTransportType", ('tcp',)),
+                              ("setDataConnectionTimeoutSec", (self.__dataConnectionTimeout,))])
     
-    If the delivery method used by the AcqNdtServer is 'single', then only
-    one AcqNdtDataServer object should be used.  If the delivery method used
-    by the AcqNdtServer is 'multiple', then there should be one AcqNdtDataServer
-    object created for each channel of data being received.
+    async def Close(self):
+        """Close the control connection.
+        """
+        if self.__writer is not None:
+            self.__writer.close()
+            try:
+                await self.__writer.wait_closed()
+            except OSError:
+                pass
+        self.__reader = None
+        self.__writer = None
+    
+    def DispatchedMethodList(self):
+        """Returns a list of all available control channel methods.
+        """
+        return self.__rpcMethods
+    
+    def __getattr__(self, item):
+        """Redirects undefined attributes to coroutine RPC calls.
+        """
+        if item not in self.__dict__.get('_AcqNdtAsyncServer__rpcMethods', []):
+            raise AttributeError(item)
+        return functools.partial(self.Call, item)
     
-    After the acquisition is finished, Stop() should be invoked for each
-    AcqNdtDataServer to clean up processing and release network resources
-    used only during the acquisition.
-    """
+    async def Call(self, name, *args):
+        """Invoke a dispatched method, given without the "acq." prefix, and return its result.
+        """
+        return await self.CallMethod(self.__acqRPCNamespace + name, *args)
     
-    def __init__(self, port, channels):
-        """Default constructor.
+    async def CallMethod(self, methodName, *args):
+        """Invoke an XML-RPC method by its full name and return its result.
         
-        The arguments supplied to the constructor should vary depending on
-        the transfer mode of the AcqNdtServer object.
+        A failed call raises its xmlrpc.client.Fault.
+        """
         
+        body = xc.dumps(args, methodName, allow_none=True).encode("utf-8")
+        async with self.__lock:
+            response = await self.__Request(body)
+        return xc.loads(response)[0][0]
+    
+    async def CallBatch(self, calls):
+        """Invoke several dispatched methods with as few network round trips as possible.
         
-        If AcqNdtServer.getDataConnectionMethod()=='single'
+        calls:	list of (methodName, arguments) tuples as for AcqNdtServer.CallBatch().
         
-        port:	set this paramter to AcqNdtServer.getSingleConnectionModePort()
-        channels:	set this paramter to a list of all of the AcqNdtChannel objects
-                    that are set for delivery.  This list may be determined by the
-                    following list comprehension:
-                    
-                    [x for x in AcqNdtServer.GetAllChannels() if x.EnabledForDelivery]
+        Uses a single system.multicall request when AcqKnowledge supports
+        it, otherwise the calls are sent one after the other over the
+        persistent connection.
+        """
         
+        if len(calls) == 0:
+            return []
         
-        If AcqNdtServer.getDataConnection()=='multiple', construct one object
-        for a specific AcqNdtChannel c using:
+        if not self.__supportsMulticall:
+            return [await self.Call(name, *args) for (name, args) in calls]
         
-        port:	set this paramter to AcqNdtServer.GetDataConneciton(c)
-        channels:	set this parameter to a single element list with the channel object, e.g.
+        results = await self.CallMethod("system.multicall",
+                                        [{"methodName": self.__acqRPCNamespace + name, "params": list(args)} for (name, args) in calls])
+        values = []
+        for result in results:
+            if isinstance(result, dict):
+                raise xc.Fault(result["faultCode"], result["faultString"])
+            values.append(result[0])
+        return values
+    
+    async def GetChannels(self, channelType):
+        """Get a list of channels of a specific type, as AcqNdtServer.GetChannels().
+        """
+        await self.__DiscoverChannels([channelType])
+        return list(self.__channelCache[channelType])
+    
+    async def GetAllChannels(self):
+        """Get a list of all of the data channels enabled for acquisition, as AcqNdtServer.GetAllChannels().
+        """
+        channelTypes = list(AcqNdtServer.ChannelTypes)
+        await self.__DiscoverChannels(channelTypes)
+        return sum([self.__channelCache[t] for t in channelTypes], [])
+    
+    def InvalidateChannelCache(self):
+        """Forget the cached channels so they are requested again from AcqKnowledge.
+        """
+        self.__channelCache = {}
+    
+    async def DeliverAllEnabledChannels(self):
+        """Sets all the channels that are enabled for acquisition to be delivered, as AcqNdtServer.DeliverAllEnabledChannels().
+        """
+        channels = await self.GetAllChannels()
+        await self.DeliverChannels([c for c in channels if not c.EnabledForDelivery], True)
+        return channels
+    
+    async def DeliverChannels(self, acqChannels, state):
+        """Change whether the data of several channels will be delivered, as AcqNdtServer.DeliverChannels().
+        """
+        await self.CallBatch([("changeDataDeliveryEnabled", (c.GetSimpleChannelStruct(), state)) for c in acqChannels])
+        for acqChannel in acqChannels:
+            acqChannel.UpdateDelivery(state)
+    
+    async def WaitForAcquisitionEnd(self, dataStreams=None, timeout=None):
+        """Wait until any data acquisition within AcqKnowledge has completed.
         
-                    [c]
+        dataStreams:	optional list of AcqNdtAsyncDataStream objects receiving
+                        the data of the acquisition.  The call then returns as
+                        soon as all of them have received and processed the
+                        end of their data connections.
+        timeout:		optional maximum time to wait in seconds.
+        
+        Returns True if the acquisition ended, False if the timeout expired.
         """
         
-        self.__enabledChannels = channels
+        if dataStreams is None:
+            dataStreams = []
+        
+        async def waitForStreams():
+            for stream in dataStreams:
+                await stream.WaitForEnd()
+        
+        async def waitForEnd():
+            interval = self.__inBetweenMessageTime
+            while await self.getAcquisitionInProgress():
+                if len(dataStreams):
+                    try:
+                        await asyncio.wait_for(waitForStreams(), interval)
+                        return
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await asyncio.sleep(interval)
+                interval = min(interval*2, self.__maxPollingTime)
+            
+            # the final samples are still delivered after the acquisition halted
+            if len(dataStreams):
+                await asyncio.wait_for(waitForStreams(), self.__dataConnectionTimeout + 0.5)
+            else:
+                await asyncio.sleep(1.5)
         
-        self.__callBacks = {}
-        self.__closedCallBacks = {}
-        self.__collect = True
+        try:
+            await asyncio.wait_for(waitForEnd(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+    
+    async def __DiscoverChannels(self, channelTypes):
+        """Request and cache the channels of the given types not cached yet."""
         
-        self.__collectorThread = threading.Thread(target=self.serve_forever)
-        self.__collectorThread.setDaemon(True)
+        channelTypes = [t for t in channelTypes if t not in self.__channelCache]
+        if len(channelTypes) == 0:
+            return
         
-        socketserver.UDPServer.__init__(self, ("",port), self.AcqNdtDataHandler)
-        # configure the socket for re-use 
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        enabled = await self.CallBatch([("getEnabledChannels", (t,)) for t in channelTypes])
+        (discovered, calls) = AcqNdtServer.ChannelSettingCalls(channelTypes, enabled)
+        results = await self.CallBatch(calls)
+        self.__channelCache.update(AcqNdtServer.ChannelsFromSettings(channelTypes, discovered, results))
     
-    def __del__(self):
-        """Default destrutor.
+    async def __Request(self, body):
+        """Send one HTTP request over the persistent connection and return the response body.
         
-        Make sure that if our socket has not been closed, we perform appropriate
-        cleanup to close the socket.
+        Must be called with the lock held.  A connection closed by the server
+        between requests is reopened once.
         """
         
-        try:
-            self.server_close()
-        except:
-            pass
-    
-    def RegisterCallback(self, name, callback):
-        """Register a new callback function to be invoked to process data as it is delivered from AcqKnowledge.
+        request = ("POST /RPC2 HTTP/1.1\r\n"
+                   "Host: %s:%i\r\n"
+                   "User-Agent: biopacndt\r\n"
+                   "Content-Type: text/xml\r\n"
+                   "Content-Length: %i\r\n\r\n" % (self.__Host, self.__ControlPort, len(body))).encode("ascii") + body
         
-        name:		set to a unique identifier that may reference the callback in RemoveCallback
-        callback:	set to the function callback.  Callbacks are invoked with
-                    three parameters and should have a signature
-                    "f(hardwareIndex, frame, chanInfo)".  These parameters
-                    are interpreted as follows:
-                    
-                    hardwareIndex 	the sample position of data that was acquired
-                                    as measured at the acquisition sampling rate.
-                                    For channels that are downsampled, this
-                                    should be divided by the SamplingDivider to
-                                    convert to a channel-relative sample.
-                    
-                    frame			a tuple of amplitude values for channels as
-                                    sampled at this hardware index
-                    
-                    channelInfo		a tuple of AcqNdtChannel objects with the
-                                    information corresponding to amplitude at
-                                    the same position within the frame tuple.
-                                    These may be used to determine channel type,
-                                    index, dividers, etc.  They will always
-                                    be elements of the channels array passed
-                                    into the constructor.
+        for attempt in range(2):
+            if self.__writer is None:
+                (self.__reader, self.__writer) = await asyncio.open_connection(self.__Host, self.__ControlPort)
+            
+            try:
+                self.__writer.write(request)
+                await self.__writer.drain()
+                
+                statusLine = await self.__reader.readline()
+                if not statusLine:
+                    raise ConnectionResetError("control connection closed")
+                
+                headers = {}
+                while True:
+                    line = await self.__reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    (key, value) = line.decode("latin-1").split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                
+                if "content-length" in headers:
+                    response = await self.__reader.readexactly(int(headers["content-length"]))
+                else:
+                    response = await self.__reader.read()
+                    headers["connection"] = "close"
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.Close()
+                if attempt:
+                    raise
+                continue
+            
+            if headers.get("connection", "").lower() == "close" or statusLine.startswith(b"HTTP/1.0"):
+                await self.Close()
+            
+            status = statusLine.split(None, 2)
+            if len(status) < 2 or status[1] != b"200":
+                raise xc.ProtocolError("%s:%i/RPC2" % (self.__Host, self.__ControlPort), int(status[1]) if len(status) > 1 else 0,
+                                       statusLine.decode("latin-1").strip(), headers)
+            return response
+
+
+class AcqNdtAsyncDataStream:
+    """Callbacks and state of one data connection port served by an AcqNdtAsyncDataServer.
+    
+    Created with AcqNdtAsyncDataServer.AddStream().  A stream corresponds to
+    one AcqNdtDataServer of the threaded implementation: one stream for all
+    channels in 'single' connection mode, or one stream per channel in
+    'multiple' connection mode.
+    
+    Block callbacks may be plain functions, invoked on the event loop as
+    soon as data is decoded with a view into the receive buffer, or
+    coroutine functions, which are awaited in order on a consumer task with
+    a copy of the block.  When more than maxQueuedBlocks blocks wait for
+    coroutine callbacks, reading from the data connection is paused until
+    the consumer catches up.
+    """
+    
+    def __init__(self, port, channels, blockFrames=1024, maxQueuedBlocks=64, sampleRate=None):
+        """Default constructor.  Use AcqNdtAsyncDataServer.AddStream() instead.
         """
         
-        if name in self.__callBacks:
-            raise ACQException("Callback name '" + name + "' is already in use")
+        if len(channels) == 0:
+            raise ACQException("A data stream requires at least one channel")
         
-        self.__callBacks[name] = callback
+        self.__port = port
+        self.__enabledChannels = channels
+        self.__frameSchedule = AcqNdtFrameSchedule(channels)
+        self.__blockFrames = int(blockFrames)
+        self.__maxQueuedBlocks = int(maxQueuedBlocks)
+        
+        self.__blockCallBacks = {}
+        self.__asyncBlockCallBacks = {}
+        self.__timestampedCallBacks = set()
+        self.__closedCallBacks = {}
+        self.__clock = AcqNdtSampleClock(sampleRate)
+        
+        self.__queue = None
+        self.__consumer = None
+        self.__ended = None
+        self.__paused = set()
     
-    def RemoveCallback(self, name):
-        """Remove a previously registered callback.
+    def RegisterBlockCallback(self, name, callback, timestamps=False):
+        """Register a function or coroutine function invoked with blocks of decoded frames.
         
-        name:	unique ID of the callback to be registered.
+        name:		set to a unique identifier that may reference the callback in RemoveBlockCallback
+        callback:	"f(startIndex, block)", see AcqNdtDataServer.RegisterBlockCallback().
+                    Coroutine functions receive a copy of the block.
+        timestamps:	if True, the callback is "f(startIndex, block, receiveTime)".
         """
         
-        if name in self.__callBacks:
-            del self.__callBacks[name]
+        if name in self.__blockCallBacks or name in self.__asyncBlockCallBacks:
+            raise ACQException("Block callback name '" + name + "' is already in use")
         
-    def GetCallbacks(self):
-        """Returns a dictionary of all registered callbacks, key is unique ID name, value is function reference.
+        if asyncio.iscoroutinefunction(callback):
+            self.__asyncBlockCallBacks[name] = callback
+        else:
+            self.__blockCallBacks[name] = callback
+        if timestamps:
+            self.__timestampedCallBacks.add(name)
+    
+    def RemoveBlockCallback(self, name):
+        """Remove a previously registered block callback.
         """
-        
-        return dict(self.__callBacks) # read only
-            
+        self.__blockCallBacks.pop(name, None)
+        self.__asyncBlockCallBacks.pop(name, None)
+        self.__timestampedCallBacks.discard(name)
+    
+    def GetBlockCallbacks(self):
+        """Returns a dictionary of all registered block callbacks, key is unique ID name, value is function reference.
+        """
+        callbacks = dict(self.__blockCallBacks)
+        callbacks.update(self.__asyncBlockCallBacks)
+        return callbacks
+    
     def RegisterCloseCallback(self, name, callback):
-        """Register a new callback function to be invoked when the socket is closed..
-        
-        name:		set to a unique identifier that may reference the callback in RemoveCallback
-        callback:	set to the function callback.  Callbacks are invoked with
-                    no parameters and should have a signature
-                    "f()".
+        """Register a function or coroutine function "f()" invoked when the data connection is closed.
         """
         
         if name in self.__closedCallBacks:
@@ -973,118 +4974,274 @@ class AcqNdtDataUDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
         self.__closedCallBacks[name] = callback
     
     def GetCloseCallbacks(self):
-        """Returns a dictionary of all registered close callbacks, key is unique ID name, value is function reference.
+        """Returns a dictionary of all registered close callbacks.
         """
-        
-        return dict(self.__closedCallBacks)	# read only
+        return dict(self.__closedCallBacks)
     
-    def IsCollecting(self):
-        """Returns whether this object is actively waiting to process incoming network data.
+    def GetPort(self):
+        """Returns the TCP port of the data connection.
         """
-        return self.__collect
+        return self.__port
     
-    def SetCollecting(self, state):
-        """Change whether the object should continue processing incoming network data.
-        
-        Should only be used by the data handling implementation.
-        
-        state:	New collecting state, True or False
-        """
-        self.__collect = state
-        
     def GetEnabledChannels(self):
-        """Return a list of AcqNdtChannel objects whose incoming data is processed by this object.
+        """Return a list of AcqNdtChannel objects whose incoming data is processed by this stream.
         """
         return self.__enabledChannels
     
-    def Start(self):
-        """Begin waiting to receive data from AcqKnowledge and processing incoming data.
-        
-        This should be called prior to starting the data acquisition within AcqKnowledge.
+    def GetFrameSchedule(self):
+        """Return the AcqNdtFrameSchedule describing the layout of the incoming frames.
         """
-        self.__collect = True
-        self.__collectorThread.start()
+        return self.__frameSchedule
+    
+    def GetBlockFrames(self):
+        """Returns the maximum number of block rows decoded at once.
+        """
+        return self.__blockFrames
+    
+    def GetClock(self):
+        """Returns the AcqNdtSampleClock fitting the received sample indexes against the host clock.
+        """
+        return self.__clock
+    
+    def HasEnded(self):
+        """Returns True once the data connection was closed and all of its data was processed.
+        """
+        return self.__ended is not None and self.__ended.is_set()
+    
+    async def WaitForEnd(self):
+        """Wait until the data connection was closed and all of its data was processed.
+        """
+        await self.__ended.wait()
+    
+    def Attach(self):
+        """Create the queue and consumer task on the running event loop.
         
-    def Stop(self):
-        """Stop processing incoming data.
+        Should only be used by AcqNdtAsyncDataServer.
+        """
+        self.__queue = asyncio.Queue()
+        self.__ended = asyncio.Event()
+        self.__consumer = asyncio.ensure_future(self.__Consume())
+    
+    async def Detach(self):
+        """Cancel the consumer task.
         
-        This should be called after data acquisition within AcqKnowledge has halted.
+        Should only be used by AcqNdtAsyncDataServer.
         """
-        self.__collect = False
-        self.__collectorThread.join()
+        if self.__consumer is not None:
+            self.__consumer.cancel()
+            try:
+                await self.__consumer
+            except asyncio.CancelledError:
+                pass
+            self.__consumer = None
+    
+    def DeliverBlock(self, startIndex, block, protocol, receiveTime):
+        """Pass a block of decoded frames on to the registered callbacks.
         
-        # after our collection thread has stopped, also close our server socket.
-        # this avoids leaving it bound after the object is finished being
-        # used.
+        Should only be used by the data handling implementation.
+        """
         
-        try:
-            self.socket.shutdown(socket.SHUT_RDWR)
-        except:
-            pass
+        self.__ended.clear()
+        self.__clock.Update(startIndex + len(block)*self.__frameSchedule.GetPeriod(), receiveTime)
         
-        try:
-            self.server_close()
-        except:
-            pass
+        for (name, func) in list(self.__blockCallBacks.items()):
+            if name in self.__timestampedCallBacks:
+                func(startIndex, block, receiveTime)
+            else:
+                func(startIndex, block)
         
-    class AcqNdtDataHandler(socketserver.BaseRequestHandler):
-        """Internal implementation class used to handle the incoming data connections.
+        if len(self.__asyncBlockCallBacks):
+            self.__queue.put_nowait((startIndex, block.copy(), receiveTime))
+            if self.__queue.qsize() >= self.__maxQueuedBlocks and protocol not in self.__paused:
+                self.__paused.add(protocol)
+                protocol.PauseReading()
+    
+    def EndOfData(self, protocol):
+        """Signal that a data connection was closed.
         
-        Should not be used outside of the biopacndt module.
+        Should only be used by the data handling implementation.
         """
-        def handle(self):
-            """Handle incoming data connection request.
+        self.__paused.discard(protocol)
+        self.__queue.put_nowait(None)
+    
+    async def __Consume(self):
+        """Consumer task awaiting the coroutine callbacks and the close callbacks in order."""
+        
+        while True:
+            item = await self.__queue.get()
             
-            When the appropriate incoming data connection is made, it begins continuously
-            reading in the binary data delivered over the connection (assumed 64 bit
-            floating point native endian) and invokes registered data handling callbacks
-            to allow client code to process the data appropraitely.
-            """
+            if item is None:
+                for (name, func) in list(self.__closedCallBacks.items()):
+                    result = func()
+                    if asyncio.iscoroutine(result):
+                        await result
+                self.__ended.set()
+                continue
             
-            enabledChannels = self.server.GetEnabledChannels()
+            (startIndex, block, receiveTime) = item
+            for (name, func) in list(self.__asyncBlockCallBacks.items()):
+                if name in self.__timestampedCallBacks:
+                    await func(startIndex, block, receiveTime)
+                else:
+                    await func(startIndex, block)
             
-            # check if the channels were porperly set
-            if len(enabledChannels) == 0:
-                self.server.SetCollecting(False)
+            if len(self.__paused) and self.__queue.qsize() <= self.__maxQueuedBlocks//2:
+                for protocol in self.__paused:
+                    protocol.ResumeReading()
+                self.__paused.clear()
+
+
+class AcqNdtAsyncDataProtocol(asyncio.BufferedProtocol):
+    """asyncio protocol receiving one data connection from AcqKnowledge.
     
-            # use python long to avoid wrap issues.  Long is fine here
-            # as it matches the 32 bit maximum limit on hardware samples
-            # within AcqKnowledge. [deprecated for python 3.x]
-            index = 0
-            while self.server.IsCollecting():
-                # determine how many bytes to read per frame
-                binaryFormat = ">LL"
-                channelsInSlice = []
-                if len(enabledChannels) == 1:
-                    channelsInSlice = enabledChannels
-                else:
-                    for ch in enabledChannels:
-                        if ((index % ch.SamplingDivider) == 0):
-                            channelsInSlice.append(ch)
-    
-                binaryFormat += "f"*len(channelsInSlice)
-    
-                # number of bytes to read #move the comment somewhere else
-                recvLen = (len(binaryFormat) - 1)*4 
-
-                # ignore request for zero bytes
-                if 0 != recvLen:
-                    # read the bytes off the socket
-                    buf = self.request[0].strip()
-                    addr = self.request[1]
-                    # print(str(index) + '| length of buffer is ' + str(len(buf)) + ' bytes')
-                    data = struct.unpack(binaryFormat,buf[0:recvLen])
-                    channelsInSliceTuple = tuple(channelsInSlice)
-                        
-                    # call the callback functions
-                    callbacks = self.server.GetCallbacks()
-                    for (name, func) in callbacks.items():
-                        func(index, data, channelsInSliceTuple)
-                else:
-                    self.server.isCollecting(False)
+    Data is received by the event loop directly into an AcqNdtReceiveBuffer
+    and decoded into blocks of whole periods of the frame schedule, exactly
+    as in AcqNdtDataServer.
+    
+    Should not be used outside of the biopacndt module.
+    """
+    
+    def __init__(self, stream):
+        """Default constructor.
+        
+        stream:	AcqNdtAsyncDataStream receiving the decoded blocks.
+        """
+        
+        schedule = stream.GetFrameSchedule()
+        self.__stream = stream
+        self.__period = schedule.GetPeriod()
+        self.__periodValues = schedule.GetPeriodValues()
+        self.__receiveBuffer = AcqNdtReceiveBuffer(stream.GetBlockFrames(), schedule.GetPeriodSize())
+        self.__index = 0
+        self.__transport = None
+    
+    def connection_made(self, transport):
+        self.__transport = transport
+        
+        # sample indexes restart at 0 with every data connection
+        self.__stream.GetClock().Reset()
+    
+    def get_buffer(self, sizehint):
+        return self.__receiveBuffer.GetFreeView()
+    
+    def buffer_updated(self, nbytes):
+        receiveTime = time.monotonic()
+        self.__receiveBuffer.Commit(nbytes)
+        
+        rows = self.__receiveBuffer.GetAvailableUnits()
+        if rows == 0:
+            return
+        
+        block = self.__receiveBuffer.GetArray(rows).reshape(rows, self.__periodValues)
+        self.__stream.DeliverBlock(self.__index, block, self, receiveTime)
+        
+        self.__receiveBuffer.Consume(rows)
+        self.__index += rows*self.__period
+    
+    def eof_received(self):
+        # let the transport close itself
+        return False
+    
+    def connection_lost(self, exc):
+        self.__stream.EndOfData(self)
+    
+    def PauseReading(self):
+        """Stop reading from the connection until ResumeReading()."""
+        self.__transport.pause_reading()
+    
+    def ResumeReading(self):
+        """Resume reading from the connection."""
+        if not self.__transport.is_closing():
+            self.__transport.resume_reading()
+
+
+class AcqNdtAsyncDataServer:
+    """asyncio implementation receiving binary data from AcqKnowledge during acquisitions.
+    
+    One object serves any number of data connection ports from a single
+    event loop, without a thread per connection: one stream in 'single'
+    connection mode, one stream per channel in 'multiple' connection mode,
+    or the streams of several AcqKnowledge hosts at once.
+    
+        dataServer = AcqNdtAsyncDataServer()
+        stream = dataServer.AddStream(port, channels)
+        stream.RegisterBlockCallback("Process", process)
+        await dataServer.Start()
+        ...
+        await dataServer.Stop()
+    """
+    
+    def __init__(self):
+        """Default constructor.
+        """
+        self.__streams = []
+        self.__servers = []
+    
+    def AddStream(self, port, channels, blockFrames=None, maxQueuedBlocks=64, sampleRate=None):
+        """Add a data connection port to be served.  Must be called before Start().
+        
+        port:			data connection port, as for AcqNdtDataServer.
+        channels:		list of AcqNdtChannel objects delivered on the port.
+        blockFrames:	maximum number of block rows decoded at once, 1024 by default.
+        maxQueuedBlocks:	number of blocks waiting for coroutine callbacks
+                        after which reading from the connection is paused.
+        sampleRate:		optional hardware acquisition sampling rate in Hz, the
+                        nominal rate of the stream clock.
+        
+        Returns the AcqNdtAsyncDataStream of the port.
+        """
+        
+        if blockFrames is None:
+            blockFrames = 1024
+        stream = AcqNdtAsyncDataStream(port, channels, blockFrames, maxQueuedBlocks, sampleRate)
+        self.__streams.append(stream)
+        return stream
+    
+    def GetStreams(self):
+        """Returns the list of AcqNdtAsyncDataStream objects.
+        """
+        return list(self.__streams)
+    
+    async def Start(self, host=None):
+        """Begin listening on all stream ports.  Must be awaited before starting the acquisition.
+        
+        host:	optional interface to listen on, all interfaces by default.
+        """
+        
+        loop = asyncio.get_running_loop()
+        for stream in self.__streams:
+            stream.Attach()
+            server = await loop.create_server(functools.partial(AcqNdtAsyncDataProtocol, stream),
+                                              host, stream.GetPort(), reuse_address=True)
+            self.__servers.append(server)
+    
+    async def Stop(self):
+        """Stop listening and release all network resources.
+        """
+        for server in self.__servers:
+            server.close()
+            await server.wait_closed()
+        self.__servers = []
+        
+        for stream in self.__streams:
+            await stream.Detach()
+    
+    async def WaitForEnd(self, timeout=None):
+        """Wait until the data connections of all streams were closed and their data processed.
+        
+        Returns True if they ended, False if the timeout expired.
+        """
+        
+        async def waitForStreams():
+            for stream in self.__streams:
+                await stream.WaitForEnd()
+        
+        try:
+            await asyncio.wait_for(waitForStreams(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
 
-                
-                index += 1
 
 class ACQException(Exception):
     """Exceptions thrown for various error conditions in the classes contained
@@ -1119,6 +5276,27 @@ def AcqNdtQuickConnect():
     
     return AcqNdtServer(hostname, port)
 
+def AcqNdtConnectAll(servers=None):
+    """Connect to several AcqKnowledge servers at once.
+    
+    servers:	list of (hostname, port) tuples.  By default all servers
+                found with FindAcqNdtServers() are used.
+    
+    The connections are established in parallel, so the time spent does
+    not grow with the number of acquisition computers.
+    
+    Returns a list of AcqNdtServer objects in the order of servers.
+    """
+    
+    if servers is None:
+        servers = FindAcqNdtServers()
+    
+    if len(servers) < 1:
+        raise ACQException("No AcqKnowledge Servers Found")
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(servers)) as executor:
+        return list(executor.map(lambda server: AcqNdtServer(server[0], server[1]), servers))
+
 def FindAcqNdtServers():
     """Locates any comptuers on the network where AcqKnowledge is running with
     the networking feature enabled and with the "Respond to auto-discovery requests"
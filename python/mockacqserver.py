@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+mockacqserver.py
+
+Local stand-in for the XML-RPC control connection of AcqKnowledge.  It
+implements the acq.* methods used by biopacndt.py and
+singleconnection_multioption.py so that setting up a session can be tested
+and benchmarked without a licensed AcqKnowledge machine.
+
+Every HTTP request may be delayed by a configurable latency to emulate a
+remote link.  A 'system.multicall' request is a single HTTP request and
+therefore costs a single latency, like on a real network.
+
+When a recording is given with --replay, starting the acquisition with
+acq.toggleAcquisition() replays it to the configured data connection with
+replayserver.py, as AcqKnowledge would deliver the acquired data.
+
+Default Control Connection Host: 127.0.0.1
+Default Control Connection Port: 15010
+"""
+
+# import standard Python modules
+
+import sys
+import time
+import threading
+import argparse
+import hashlib
+import socketserver
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+# import our biopacndt support module and the replay tool
+
+import biopacndt
+import replayserver
+
+
+## channels of resources/BioHarnessTemplate6inputs.gtl, used when no recording is given
+BioHarnessChannels = [(0, "ECG Raw"), (1, "Breathing Data"), (6, "Posture"),
+                      (11, "Y Acceleration Peak"), (13, "X Acceleration Peak"), (15, "Z Acceleration Peak")]
+
+
+class MockAcqRequestHandler(SimpleXMLRPCRequestHandler):
+        """Request handler adding the configured latency to every HTTP request.
+        """
+
+        rpc_paths = ('/RPC2',)
+
+        # allow clients to keep their connection open between requests
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+                """Handle one XML-RPC request after waiting for the emulated latency.
+                """
+                self.server.Mock.CountRequest()
+                if self.server.Mock.Latency > 0:
+                        time.sleep(self.server.Mock.Latency)
+                SimpleXMLRPCRequestHandler.do_POST(self)
+
+        def log_message(self, format, *args):
+                """Only log requests when verbose output is enabled.
+                """
+                if self.server.Mock.Verbose:
+                        SimpleXMLRPCRequestHandler.log_message(self, format, *args)
+
+
+class MockAcqXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+        """Threaded XML-RPC server so several control connections may be served at once.
+        """
+
+        daemon_threads = True
+
+
+class MockAcqServer:
+        """Emulated AcqKnowledge control connection state and acq.* methods.
+        """
+
+        ## names of the methods registered in the "acq." namespace
+        Methods = ["changeTransportType", "getTransportType",
+                   "setDataConnectionTimeoutSec", "getDataConnectionTimeoutSec",
+                   "loadTemplate",
+                   "getEnabledChannels", "getDownsamplingDivider", "getChannelLabel",
+                   "changeDataType", "getDataType",
+                   "getDataDeliveryEnabled", "changeDataDeliveryEnabled",
+                   "getDataConnectionMethod", "changeDataConnectionMethod",
+                   "getSingleConnectionModePort", "changeSingleConnectionModePort",
+                   "getDataConnectionPort", "changeDataConnectionPort",
+                   "getDataConnectionHostname", "changeDataConnectionHostname",
+                   "getAcquisitionInProgress", "toggleAcquisition",
+                   "getMostRecentSampleValue", "getSamplingRate", "getMPUnitType"]
+
+        def __init__(self, source=None, latency=0.0, speed=1.0, verbose=False):
+                """Default constructor.
+
+                source:         optional replayserver.AcqReplaySource whose channels are
+                                reported and whose data is replayed during acquisitions.
+                latency:        delay in seconds added to every HTTP request.
+                speed:          replay speed factor, 0 for unthrottled.
+                verbose:        print every request and method call.
+                """
+
+                self.Latency = latency
+                self.Verbose = verbose
+                self.__source = source
+                self.__speed = speed
+                self.__lock = threading.Lock()
+
+                self.__requests = 0
+                self.__calls = {}
+
+                if source is not None:
+                        channels = [(ch.Type, ch.Index, ch.SamplingDivider, label) for (ch, label) in zip(source.Channels, source.Labels)]
+                        self.__samplingRate = source.SampleRate
+                else:
+                        channels = [("analog", index, 1, label) for (index, label) in BioHarnessChannels]
+                        self.__samplingRate = 250.0
+
+                # per channel settings keyed by (type, index)
+                self.__channels = {}
+                self.__channelOrder = []
+                for (position, (chType, index, divider, label)) in enumerate(channels):
+                        key = (chType, index)
+                        self.__channelOrder.append(key)
+                        self.__channels[key] = {"position": position,
+                                                "divider": divider,
+                                                "label": label,
+                                                "dataType": {"type": "double", "endian": "little"},
+                                                "delivery": False,
+                                                "port": 15021 + position}
+
+                self.__transportType = "tcp"
+                self.__timeout = 2
+                self.__template = None
+                self.__connectionMethod = "single"
+                self.__singlePort = 15020
+                self.__hostname = "127.0.0.1"
+
+                self.__acquiring = False
+                self.__replayThread = None
+                self.__stopReplay = threading.Event()
+
+        def Register(self, server):
+                """Register the acq.* methods and the system.* introspection methods with an XML-RPC server.
+                """
+                server.register_introspection_functions()
+                server.register_multicall_functions()
+                for name in self.Methods:
+                        server.register_function(self.__Counted(name, getattr(self, name)), "acq." + name)
+
+        def CountRequest(self):
+                """Count one HTTP request.  Called by the request handler.
+                """
+                with self.__lock:
+                        self.__requests += 1
+
+        def GetStatistics(self):
+                """Returns the number of HTTP requests and a dictionary of method call counts.
+                """
+                with self.__lock:
+                        return (self.__requests, dict(self.__calls))
+
+        def __Counted(self, name, func):
+                """Wrap a method to count its calls."""
+                def counted(*args):
+                        with self.__lock:
+                                self.__calls[name] = self.__calls.get(name, 0) + 1
+                        if self.Verbose:
+                                print("acq.%s%s" % (name, args))
+                        return func(*args)
+                return counted
+
+        def __Channel(self, channel):
+                """Look up the settings of a {"type":..., "index":...} channel structure."""
+                key = (channel["type"], channel["index"])
+                if key not in self.__channels:
+                        raise biopacndt.ACQException("Unknown channel %s %s" % key)
+                return self.__channels[key]
+
+        # transport settings
+
+        def changeTransportType(self, transportType):
+                self.__transportType = transportType
+                return 0
+
+        def getTransportType(self):
+                return self.__transportType
+
+        def setDataConnectionTimeoutSec(self, seconds):
+                self.__timeout = seconds
+                return 0
+
+        def getDataConnectionTimeoutSec(self):
+                return self.__timeout
+
+        def loadTemplate(self, data):
+                # templates are not interpreted, only remembered
+                self.__template = hashlib.sha1(data.data).hexdigest()
+                return 0
+
+        # channel settings
+
+        def getEnabledChannels(self, channelType):
+                return [index for (chType, index) in self.__channelOrder if chType == channelType]
+
+        def getDownsamplingDivider(self, channel):
+                return self.__Channel(channel)["divider"]
+
+        def getChannelLabel(self, channel):
+                return self.__Channel(channel)["label"]
+
+        def changeDataType(self, channel, dataType):
+                self.__Channel(channel)["dataType"] = dict(dataType)
+                return 0
+
+        def getDataType(self, channel):
+                return self.__Channel(channel)["dataType"]
+
+        def getDataDeliveryEnabled(self, channel):
+                return self.__Channel(channel)["delivery"]
+
+        def changeDataDeliveryEnabled(self, channel, state):
+                self.__Channel(channel)["delivery"] = bool(state)
+                return 0
+
+        # data connection settings
+
+        def getDataConnectionMethod(self):
+                return self.__connectionMethod
+
+        def changeDataConnectionMethod(self, method):
+                if method not in ("single", "multiple"):
+                        return -1
+                self.__connectionMethod = method
+                return 0
+
+        def getSingleConnectionModePort(self):
+                return self.__singlePort
+
+        def changeSingleConnectionModePort(self, port):
+                self.__singlePort = int(port)
+                return 0
+
+        def getDataConnectionPort(self, channel):
+                return self.__Channel(channel)["port"]
+
+        def changeDataConnectionPort(self, channel, port):
+                self.__Channel(channel)["port"] = int(port)
+                return 0
+
+        def getDataConnectionHostname(self):
+                return self.__hostname
+
+        def changeDataConnectionHostname(self, hostname):
+                self.__hostname = hostname
+                return 0
+
+        # acquisition
+
+        def getAcquisitionInProgress(self):
+                return self.__acquiring
+
+        def toggleAcquisition(self):
+                if self.__acquiring:
+                        self.__stopReplay.set()
+                        self.__acquiring = False
+                else:
+                        self.__acquiring = True
+                        if self.__source is not None:
+                                self.__stopReplay.clear()
+                                self.__replayThread = threading.Thread(target=self.__Replay)
+                                self.__replayThread.daemon = True
+                                self.__replayThread.start()
+                return 0
+
+        def getMostRecentSampleValue(self, channel):
+                self.__Channel(channel)
+                return 0.0
+
+        def getSamplingRate(self):
+                return self.__samplingRate
+
+        def getMPUnitType(self):
+                return "MP150"
+
+        def __Replay(self):
+                """Replay the recording for the channels enabled for delivery, then end the acquisition."""
+
+                positions = [self.__channels[key]["position"] for key in self.__channelOrder if self.__channels[key]["delivery"]]
+                if len(positions) == 0:
+                        return
+
+                source = replayserver.AcqReplaySource([self.__source.Channels[p] for p in positions],
+                                                      [self.__source.ChannelData[p] for p in positions],
+                                                      self.__source.SampleRate,
+                                                      [self.__source.Labels[p] for p in positions])
+                try:
+                        if self.__connectionMethod == "single":
+                                replayserver.ReplaySingle(source, self.__hostname, self.__singlePort, self.__speed,
+                                                          timeout=self.__timeout, stopEvent=self.__stopReplay)
+                        else:
+                                ports = [self.__channels[self.__channelOrder[p]]["port"] for p in positions]
+                                replayserver.ReplayMultiple(source, self.__hostname, ports, self.__speed,
+                                                            timeout=self.__timeout, stopEvent=self.__stopReplay)
+                except OSError as e:
+                        print("No se pudo enviar la grabación: %s" % (e))
+
+                self.__acquiring = False
+
+
+def main():
+        """Run a mock AcqKnowledge control connection.
+        """
+
+        help_message = """usage: python mockacqserver.py [-h | --help] [-ch | --controlHost <hostname>] [-cp | --controlPort <port>]
+[-lat | --latency <ms>] [-r | --replay <filename>] [-s | --speed <factor>] [-v | --verbose]
+
+Options and arguments:
+-h   | --help: display this message
+-ch  | --controlHost <hostname>: set hostname the control connection listens on.
+-cp  | --controlPort <port>: set port the control connection listens on.
+-lat | --latency <ms>: delay added to every control connection request.
+-r   | --replay <filename>: recording (.acq or session file) providing the channels and replayed during acquisitions.
+-s   | --speed <factor>: replay speed, 1 for real-time, 0 for unthrottled.
+-v   | --verbose: print every request.
+        """
+        parser = argparse.ArgumentParser(usage=help_message,add_help=False)
+        parser.add_argument("-h","--help",action='store_true',help=argparse.SUPPRESS)
+        parser.add_argument("-ch","--controlHost",default="127.0.0.1",help=argparse.SUPPRESS)
+        parser.add_argument("-cp","--controlPort",default=15010,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-lat","--latency",default=0.0,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-r","--replay",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-s","--speed",default=1.0,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-v","--verbose",action="store_true",help=argparse.SUPPRESS)
+
+        args = parser.parse_args()
+
+        if args.help:
+                print(help_message)
+                sys.exit()
+
+        source = None
+        if args.replay is not None:
+                source = replayserver.LoadRecording(args.replay)
+
+        mock = MockAcqServer(source, args.latency/1000.0, args.speed, args.verbose)
+        server = MockAcqXMLRPCServer((args.controlHost, args.controlPort), requestHandler=MockAcqRequestHandler,
+                                     logRequests=True, allow_none=True)
+        server.Mock = mock
+        mock.Register(server)
+
+        print("Servidor de control simulado disponible en hostname %s port %i" % (args.controlHost, args.controlPort))
+
+        try:
+                server.serve_forever()
+        except KeyboardInterrupt:
+                print("Proceso Interrumpido")
+        finally:
+                server.server_close()
+                (requests, calls) = mock.GetStatistics()
+                print("%i solicitudes HTTP, %i llamadas" % (requests, sum(calls.values())))
+                for name in sorted(calls):
+                        print("  acq.%s: %i" % (name, calls[name]))
+
+if __name__ == '__main__':
+        main()
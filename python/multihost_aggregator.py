@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+multihost_aggregator.py
+
+This program receives the data of several AcqKnowledge instances running on
+different acquisition computers in a single process.  Every computer is
+configured in parallel to deliver its data in 'single' connection mode to
+its own data connection port, and the received data is merged into one time
+aligned output sent via OSC through a single OSC port.
+
+The data of every computer is sent as typed OSC bundles (see
+biopacndt.AcqNdtOSCSender) with the address "/BioHarness/<stream ID>", where
+the stream ID is the position of the computer in the host list.
+
+Default Data Connection Port of the first computer: 15020
+Default OSC Connection Host: 127.0.0.1
+Default OSC Connection Port: 5005
+"""
+
+# import standard Python modules
+
+import sys
+import time
+import argparse
+import concurrent.futures
+
+# import our biopacndt support module
+
+import biopacndt
+
+
+def ParseHosts(hosts):
+        """Returns a list of (hostname, port) tuples from a "host:port,host:port" string.
+
+        The port defaults to 15010 when omitted.
+        """
+
+        servers = []
+        for host in hosts.split(","):
+                if ":" in host:
+                        (hostname, port) = host.rsplit(":", 1)
+                        servers.append((hostname, int(port)))
+                else:
+                        servers.append((host, 15010))
+        return servers
+
+
+def ConfigureHost(acqServer, dataHostname, dataPort):
+        """Configure one AcqKnowledge instance to deliver all of its enabled channels to a data connection port.
+
+        acqServer:      AcqNdtServer of the instance.
+        dataHostname:   hostname of this computer as seen by the acquisition computer.
+        dataPort:       data connection port assigned to the instance.
+
+        Returns the list of delivered AcqNdtChannel objects and the sampling rate.
+        """
+
+        # halt any previously running acquisition before reconfiguring
+
+        if acqServer.getAcquisitionInProgress():
+                acqServer.toggleAcquisition()
+
+        enabledChannels = acqServer.DeliverAllEnabledChannels()
+
+        if "getSamplingRate" not in acqServer.DispatchedMethodList():
+                raise biopacndt.ACQException("The sampling rate of the acquisition is required to align the data")
+
+        calls = [("changeDataConnectionMethod", ("single",)),
+                 ("changeDataConnectionHostname", (dataHostname,)),
+                 ("changeSingleConnectionModePort", (dataPort,)),
+                 ("getSamplingRate", ())]
+        results = acqServer.CallBatch(calls)
+        for ((name, args), result) in zip(calls[:-1], results[:-1]):
+                if result != 0:
+                        raise biopacndt.ACQException("%s%s failed" % (name, args))
+
+        return (enabledChannels, results[-1])
+
+
+def main():
+        """Configure several AcqKnowledge instances, receive all of their data and send it via OSC.
+        """
+
+        help_message = """usage: python multihost_aggregator.py [-h | --help] [-hosts | --hosts <host:port,...>] [-ah | --AcqHost <hostname>]
+[-ap | --AcqPort <port>] [-oh | --OSCHost <hostname>] [-op | --OSCport <port>] [-ob | --OSCBatch <frames>]
+[-ol | --OSCLatency <ms>] [-md | --maxDelay <ms>]
+
+Options and arguments:
+-h     | --help: display this message
+-hosts | --hosts <host:port,...>: comma separated control connections (XML-RPC) of the acquisition computers.
+                 All computers found with auto-discovery are used when omitted.
+-ah    | --AcqHost <hostname>: hostname of this computer used by the acquisition computers for their data connections.
+-ap    | --AcqPort <port>: data connection port of the first computer, the following computers use the next ports.
+-oh    | --OSCHost <hostname>: set OSC hostname.
+-op    | --OSCport <port>: set OSC port.
+-ob    | --OSCBatch <frames>: maximum number of frames in each OSC bundle.
+-ol    | --OSCLatency <ms>: maximum time a frame waits before its OSC bundle is sent.
+-md    | --maxDelay <ms>: maximum time to wait for a computer which is behind the others.
+        """
+        parser = argparse.ArgumentParser(usage=help_message,add_help=False)
+        parser.add_argument("-h","--help",action='store_true',help=argparse.SUPPRESS)
+        parser.add_argument("-hosts","--hosts",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-ah","--AcqHost",default="127.0.0.1",help=argparse.SUPPRESS)
+        parser.add_argument("-ap","--AcqPort",default=15020,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-oh","--OSCHost",default="127.0.0.1",help=argparse.SUPPRESS)
+        parser.add_argument("-op","--OSCPort",default=5005,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-ob","--OSCBatch",default=32,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-ol","--OSCLatency",default=None,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-md","--maxDelay",default=100.0,help=argparse.SUPPRESS,type=float)
+
+        args = parser.parse_args()
+
+        if args.help:
+                print(help_message)
+                sys.exit()
+
+        if args.hosts is not None:
+                servers = ParseHosts(args.hosts)
+        else:
+                print("Buscando servidores AcqKnowledge...")
+                servers = biopacndt.FindAcqNdtServers()
+
+        try:
+                print("Intentando conectar a %i servidores AcqKnowledge: %s" \
+                        % (len(servers), ", ".join(["%s:%s" % (hostname, port) for (hostname, port) in servers])))
+                acqServers = biopacndt.AcqNdtConnectAll(servers)
+        except biopacndt.ACQException:
+                print("No se encontraron servidores AcqKnowledge.")
+                sys.exit()
+        except ConnectionRefusedError:
+                print("No se puede conectar a uno de los servidores especificados.")
+                sys.exit()
+
+        maxLatency = None
+        if args.OSCLatency is not None:
+                maxLatency = args.OSCLatency/1000.0
+
+        aggregator = biopacndt.AcqNdtStreamAggregator(maxDelay=args.maxDelay/1000.0)
+        dataServers = []
+        oscSenders = []
+
+        try:
+                # configure all computers in parallel, each one delivering to its own port
+
+                ports = [args.AcqPort + streamId for streamId in range(len(acqServers))]
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(acqServers)) as executor:
+                        settings = list(executor.map(lambda acqServer, port: ConfigureHost(acqServer, args.AcqHost, port), acqServers, ports))
+
+                # one data server and one OSC bundle sender per computer, all of
+                # them fed in time order by the aggregator
+
+                for (streamId, ((enabledChannels, sampleRate), port)) in enumerate(zip(settings, ports)):
+                        dataServer = biopacndt.AcqNdtDataServer(port, enabledChannels, OSCHostname=args.OSCHost, OSCport=args.OSCPort)
+                        oscSender = biopacndt.AcqNdtOSCSender(args.OSCHost, args.OSCPort, dataServer.GetFrameSchedule(),
+                                                              address="/BioHarness/%i" % (streamId),
+                                                              batchFrames=args.OSCBatch, maxLatency=maxLatency)
+                        aggregator.AddStream(streamId, dataServer, sampleRate)
+                        dataServers.append(dataServer)
+                        oscSenders.append(oscSender)
+                        print("Servidor %s:%s -> puerto de datos %i, %i canales a %.1f Hz, dirección OSC /BioHarness/%i" \
+                                % (servers[streamId][0], servers[streamId][1], port, len(enabledChannels), sampleRate, streamId))
+
+                aggregator.RegisterCallback("SendOSCBundles",
+                                            lambda streamId, startTime, startIndex, block: oscSenders[streamId].Write(startIndex, block))
+
+                for dataServer in dataServers:
+                        dataServer.Start()
+
+                # start all acquisitions at once and mark their start for the alignment
+
+                def startAcquisition(streamId):
+                        acqServers[streamId].toggleAcquisition()
+                        aggregator.MarkStart(streamId)
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(acqServers)) as executor:
+                        list(executor.map(startAcquisition, range(len(acqServers))))
+
+                print("Adquisición iniciada, enviando datos via OSC al puerto %i" % (args.OSCPort))
+
+                while True:
+                        time.sleep(1)
+
+        except KeyboardInterrupt:
+                print("Proceso Interrumpido")
+        except biopacndt.ACQException as e:
+                print("No se pudo configurar un servidor AcqKnowledge: %s" % (e))
+
+        print("Desconectando servidores AcqKnowledge...")
+        try:
+                for acqServer in acqServers:
+                        if acqServer.getAcquisitionInProgress():
+                                acqServer.toggleAcquisition()
+                for dataServer in dataServers:
+                        dataServer.Stop()
+                aggregator.Flush()
+                for oscSender in oscSenders:
+                        oscSender.Close()
+                print("Servidores desconectados.")
+        except ConnectionRefusedError:
+                print("No se puede establecer una conexión ya que el equipo de destino denegó expresamente dicha conexión.")
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+replayserver.py
+
+Offline stand-in for the data connection of AcqKnowledge.  It reads a
+recording and connects to an AcqNdtDataServer exactly as AcqKnowledge does,
+sending big endian float32 frames in 'single' or 'multiple' connection mode
+at real-time, accelerated or unthrottled rates.
+
+It may be used to test the Python data servers and the Max patches without
+a licensed AcqKnowledge machine, and as a reproducible load generator to
+measure the throughput and latency of the receive path.
+
+Supported recordings:
+        * AcqKnowledge graph files (.acq), read with the bioread module.
+        * Session files written by biopacndt.AcqNdtSessionRecorder.
+
+Default Data Connection Host: 127.0.0.1
+Default Data Connection Port: 15020
+"""
+
+# import standard Python modules
+
+import sys
+import time
+import socket
+import threading
+import argparse
+
+import numpy
+
+# import our biopacndt support module
+
+import biopacndt
+
+
+class AcqReplaySource:
+        """Channels, data and sampling rate of a recording to be replayed.
+        """
+
+        def __init__(self, channels, channelData, sampleRate, labels):
+                """Default constructor.
+
+                channels:       list of AcqNdtChannel objects describing the recorded channels.
+                channelData:    list of numpy arrays, the samples of each channel at its own rate.
+                sampleRate:     hardware acquisition sampling rate in Hz.
+                labels:         list of channel labels.
+                """
+
+                self.Channels = channels
+                self.ChannelData = channelData
+                self.SampleRate = float(sampleRate)
+                self.Labels = labels
+                self.Schedule = biopacndt.AcqNdtFrameSchedule(channels)
+
+                # number of whole periods of the frame schedule available in every channel
+                period = self.Schedule.GetPeriod()
+                self.Periods = min([len(data)//(period//ch.SamplingDivider) for (ch, data) in zip(channels, channelData)])
+
+        def GetPeriodRows(self, firstRow, endRow):
+                """Returns the frames of a range of schedule periods as delivered in 'single' mode.
+
+                firstRow:       first period to return.
+                endRow:         period ending the range (not included).
+
+                Returns a numpy array of big endian float32 values of shape
+                (periods, Schedule.GetPeriodValues()).
+                """
+
+                period = self.Schedule.GetPeriod()
+                rows = numpy.empty((endRow - firstRow, self.Schedule.GetPeriodValues()), dtype='>f4')
+                for (position, ch) in enumerate(self.Channels):
+                        perRow = period//ch.SamplingDivider
+                        samples = self.ChannelData[position][firstRow*perRow:endRow*perRow]
+                        rows[:, self.Schedule.GetChannelColumns(position)] = numpy.reshape(samples, (-1, perRow))
+                return rows
+
+
+def LoadRecording(filename):
+        """Load a recording to be replayed.
+
+        filename:       path to an AcqKnowledge graph file (.acq) or to a session
+                        file written by biopacndt.AcqNdtSessionRecorder.
+
+        Returns an AcqReplaySource.
+        """
+
+        with open(filename, "rb") as fd:
+                isSession = fd.read(len(biopacndt.AcqNdtSessionRecorder.Magic)) == biopacndt.AcqNdtSessionRecorder.Magic
+
+        if isSession:
+                reader = biopacndt.AcqNdtSessionReader(filename)
+                channels = reader.GetChannels()
+                channelData = [reader.GetChannelData(position) for position in range(len(channels))]
+                sampleRate = reader.GetSampleRate()
+                if not sampleRate:
+                        raise biopacndt.ACQException("The session file does not record its sample rate")
+                return AcqReplaySource(channels, channelData, sampleRate, reader.GetLabels())
+
+        try:
+                import bioread
+        except ImportError:
+                raise biopacndt.ACQException("Reading .acq files requires the bioread module (pip install bioread)")
+
+        datafile = bioread.read_file(filename)
+        channels = []
+        for (index, acqChannel) in enumerate(datafile.channels):
+                ch = biopacndt.AcqNdtChannel()
+                ch.Type = "analog"
+                ch.Index = index
+                ch.DataSize = 4
+                ch.SamplingDivider = int(acqChannel.frequency_divider)
+                ch.Scale = 1.0
+                ch.Offset = 0.0
+                ch.EnabledForDelivery = True
+                channels.append(ch)
+
+        channelData = [acqChannel.data for acqChannel in datafile.channels]
+        labels = [acqChannel.name for acqChannel in datafile.channels]
+        return AcqReplaySource(channels, channelData, datafile.samples_per_second, labels)
+
+
+def ConnectDataServer(host, port, timeout):
+        """Connect to an AcqNdtDataServer, retrying until it listens or the timeout expires.
+        """
+
+        deadline = time.monotonic() + timeout
+        while True:
+                try:
+                        return socket.create_connection((host, port))
+                except ConnectionRefusedError:
+                        if time.monotonic() >= deadline:
+                                raise
+                        time.sleep(0.1)
+
+
+def ChunkRows(rowsPerSecond, speed, chunkSeconds):
+        """Returns the number of rows sent per write so that one write covers chunkSeconds of replay time.
+        """
+
+        if speed <= 0:
+                return 4096
+        return max(1, int(chunkSeconds*rowsPerSecond*speed))
+
+
+def StreamRows(sock, getRows, rowCount, rowsPerSecond, speed, chunkRows, loop, stats, stopEvent=None):
+        """Send rows of data over a data connection at a paced rate.
+
+        sock:           connected socket.
+        getRows:        function returning the rows of a range as a numpy array.
+        rowCount:       number of rows in the recording.
+        rowsPerSecond:  rows acquired per second of real time.
+        speed:          replay speed factor, 1.0 for real-time, 0 for unthrottled.
+        chunkRows:      number of rows sent per write.
+        loop:           replay the recording again when it ends.
+        stats:          dictionary receiving the number of rows and bytes sent.
+        stopEvent:      optional threading.Event ending the replay when set.
+        """
+
+        start = time.monotonic()
+        sent = 0
+        while True:
+                for first in range(0, rowCount, chunkRows):
+                        end = min(rowCount, first + chunkRows)
+
+                        # sleep until the real-time position of the chunk is reached
+                        if speed > 0:
+                                delay = start + sent/(rowsPerSecond*speed) - time.monotonic()
+                                if delay > 0:
+                                        if stopEvent is None:
+                                                time.sleep(delay)
+                                        elif stopEvent.wait(delay):
+                                                return
+
+                        if stopEvent is not None and stopEvent.is_set():
+                                return
+
+                        data = getRows(first, end).tobytes()
+                        sock.sendall(data)
+                        sent += end - first
+                        stats["rows"] += end - first
+                        stats["bytes"] += len(data)
+
+                if not loop:
+                        break
+
+
+def ReplaySingle(source, host, port, speed=1.0, chunkSeconds=0.01, loop=False, timeout=30.0, stopEvent=None):
+        """Replay a recording over one connection as in 'single' connection mode.
+
+        stopEvent:      optional threading.Event ending the replay when set.
+
+        Returns a dictionary with the number of frames and bytes sent and the elapsed time.
+        """
+
+        period = source.Schedule.GetPeriod()
+        periodsPerSecond = source.SampleRate/period
+        chunkRows = ChunkRows(periodsPerSecond, speed, chunkSeconds)
+
+        stats = {"rows": 0, "bytes": 0}
+        sock = ConnectDataServer(host, port, timeout)
+        start = time.monotonic()
+        try:
+                StreamRows(sock, source.GetPeriodRows, source.Periods, periodsPerSecond, speed, chunkRows, loop, stats, stopEvent)
+        finally:
+                sock.close()
+
+        return {"frames": stats["rows"]*period, "bytes": stats["bytes"], "elapsed": time.monotonic() - start}
+
+
+def ReplayMultiple(source, host, ports, speed=1.0, chunkSeconds=0.01, loop=False, timeout=30.0, stopEvent=None):
+        """Replay a recording over one connection per channel as in 'multiple' connection mode.
+
+        ports:          list of data connection ports, one for each channel of the recording.
+        stopEvent:      optional threading.Event ending the replay when set.
+
+        Returns a dictionary with the number of frames and bytes sent and the elapsed time.
+        """
+
+        if len(ports) != len(source.Channels):
+                raise biopacndt.ACQException("One port is required for each channel")
+
+        period = source.Schedule.GetPeriod()
+        stats = [{"rows": 0, "bytes": 0} for ch in source.Channels]
+        sockets = [ConnectDataServer(host, port, timeout) for port in ports]
+
+        threads = []
+        for (position, ch) in enumerate(source.Channels):
+                samples = source.ChannelData[position][:source.Periods*(period//ch.SamplingDivider)]
+                samplesPerSecond = source.SampleRate/ch.SamplingDivider
+                getRows = (lambda first, end, samples=samples: numpy.asarray(samples[first:end], dtype='>f4'))
+                threads.append(threading.Thread(target=StreamRows,
+                                                args=(sockets[position], getRows, len(samples), samplesPerSecond, speed,
+                                                      ChunkRows(samplesPerSecond, speed, chunkSeconds), loop, stats[position], stopEvent)))
+
+        start = time.monotonic()
+        for thread in threads:
+                thread.daemon = True
+                thread.start()
+        try:
+                for thread in threads:
+                        while thread.is_alive():
+                                thread.join(0.25)
+        finally:
+                for sock in sockets:
+                        sock.close()
+
+        return {"frames": max([s["rows"]*ch.SamplingDivider for (s, ch) in zip(stats, source.Channels)]),
+                "bytes": sum([s["bytes"] for s in stats]),
+                "elapsed": time.monotonic() - start}
+
+
+def main():
+        """Replay a recording to an AcqNdtDataServer as AcqKnowledge would.
+        """
+
+        help_message = """usage: python replayserver.py -f | --file <filename> [-h | --help] [-ah | --AcqHost <hostname>] [-ap | --AcqPort <port>]
+[-m | --mode single|multiple] [-s | --speed <factor>] [-l | --loop]
+
+Options and arguments:
+-h   | --help: display this message
+-f   | --file <filename>: recording to replay, an AcqKnowledge graph file (.acq) or a session file.
+-ah  | --AcqHost <hostname>: set hostname where the data server is listening.
+-ap  | --AcqPort <port>: set port of the data server ('single' mode) or of the first channel ('multiple' mode, one port per channel).
+-m   | --mode single|multiple: data connection method to emulate.
+-s   | --speed <factor>: replay speed, 1 for real-time, 10 for ten times faster, 0 for unthrottled.
+-l   | --loop: replay the recording again when it ends.
+        """
+        parser = argparse.ArgumentParser(usage=help_message,add_help=False)
+        parser.add_argument("-h","--help",action='store_true',help=argparse.SUPPRESS)
+        parser.add_argument("-f","--file",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-ah","--AcqHost",default="127.0.0.1",help=argparse.SUPPRESS)
+        parser.add_argument("-ap","--AcqPort",default=15020,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-m","--mode",default="single",choices=["single","multiple"],help=argparse.SUPPRESS)
+        parser.add_argument("-s","--speed",default=1.0,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-l","--loop",action="store_true",help=argparse.SUPPRESS)
+
+        args = parser.parse_args()
+
+        if args.help or args.file is None:
+                print(help_message)
+                sys.exit()
+
+        source = LoadRecording(args.file)
+        print("Grabación %s: %i canales, %.1f Hz, %.1f segundos" \
+                % (args.file, len(source.Channels), source.SampleRate, source.Periods*source.Schedule.GetPeriod()/source.SampleRate))
+        for (ch, label) in zip(source.Channels, source.Labels):
+                print("  %s %i: %s (divisor %i)" % (ch.Type, ch.Index, label, ch.SamplingDivider))
+
+        try:
+                if args.mode == "single":
+                        print("Enviando datos en modo 'single' a %s puerto %i" % (args.AcqHost, args.AcqPort))
+                        stats = ReplaySingle(source, args.AcqHost, args.AcqPort, args.speed, loop=args.loop)
+                else:
+                        ports = [args.AcqPort + position for position in range(len(source.Channels))]
+                        print("Enviando datos en modo 'multiple' a %s puertos %i-%i" % (args.AcqHost, ports[0], ports[-1]))
+                        stats = ReplayMultiple(source, args.AcqHost, ports, args.speed, loop=args.loop)
+        except KeyboardInterrupt:
+                print("Proceso Interrumpido")
+                sys.exit()
+        except ConnectionRefusedError:
+                print("No se puede conectar al servidor de datos especificado.")
+                sys.exit()
+
+        print("%i muestras y %i bytes enviados en %.3f segundos (%.0f muestras/s)" \
+                % (stats["frames"], stats["bytes"], stats["elapsed"], stats["frames"]/max(stats["elapsed"], 1e-9)))
+
+if __name__ == '__main__':
+        main()
@@ -24,6 +24,7 @@ import time
 # import our biopacndt support module
 
 import biopacndt
+import bioharness
 
 #import osc and parse modules
 import argparse
@@ -37,6 +38,10 @@ def main():
         help_message = """usage: python singleconnection_multioption.py [-h | --help] [-ch | --controlHost <hostname>] [-cp | --controlPort  <port>] \
 [-ah | --AcqHost <hostname>] [-ap | --AcqPort <port>] 
 [-osc | --oscActivated] [-oh | --OSCHost <hostname>] [-op | --OSCport <port>]       
+[-ob | --OSCBatch <frames>] [-ol | --OSCLatency <ms>] [-rec | --record <filename>] [-ts | --timestamps]
+[-sc | --scale] [-dec | --decimate <factor>] [-ft | --features] [-or | --OSCRate <Hz>] [-orm | --OSCRateMode filter|latest]
+[-od | --OSCDestinations <host:port,...>] [-rp | --relayPort <port>] [-rh | --relayHeader] [-shm | --sharedMemory <name>]
+[-tpl | --template <filename>] [-nc | --noCache]
 
 Options and arguments:
 -h   | --help: display this message
@@ -47,6 +52,30 @@ Options and arguments:
 -osc | --oscActivated: activates stream data via OSC.
 -oh  | --OSCHost <hostname>: set OSC hostname (no effect if -osc flag is not activated).
 -op  | --OSCport <port>: set OSC port (no effect if -osc flag is not activated).
+-ob  | --OSCBatch <frames>: send typed OSC bundles of up to <frames> frames instead of one string message per frame (no effect if -osc flag is not activated).
+-ol  | --OSCLatency <ms>: maximum time a frame waits before its OSC bundle is sent (implies bundles, no effect if -osc flag is not activated).
+-rec | --record <filename>: record all received channels into a session file (no effect if -osc flag is not activated).
+-ts  | --timestamps: attach the wall-clock acquisition time of the frames, as the OSC bundle time tag or as the second value
+                     of every string message (no effect if -osc flag is not activated).
+-sc  | --scale: convert the values with the Scale and Offset of each channel (no effect if -osc flag is not activated).
+-dec | --decimate <factor>: low-pass filter and keep one of every <factor> frames before sending and recording them
+                     (no effect if -osc flag is not activated).
+-or  | --OSCRate <Hz>: maximum number of frames per second sent via OSC, recorded frames are not affected
+                     (no effect if -osc flag is not activated).
+-orm | --OSCRateMode filter|latest: reduce the OSC rate with an anti-aliasing filter (default) or by sending
+                     the latest frame (no effect if -or flag is not given).
+-ft  | --features: send heart rate, HRV, breathing rate, activity and posture of the BioHarness channels as OSC
+                     messages under /BioHarness/features (no effect if -osc flag is not activated).
+-od  | --OSCDestinations <host:port,...>: also send the OSC bundles to these comma separated destinations
+                     (implies bundles, no effect if -osc flag is not activated).
+-rp  | --relayPort <port>: republish the received frames to any number of local TCP clients on <port>, clients may
+                     connect and disconnect during the acquisition (no effect if -osc flag is not activated).
+-rh  | --relayHeader: send a session file header to every relay client before the frames (no effect if -rp flag is not given).
+-shm | --sharedMemory <name>: publish the received frames in a shared memory ring buffer which other processes of this
+                     computer read with biopacndt.AcqNdtSharedRingReader(<name>) (no effect if -osc flag is not activated).
+-tpl | --template <filename>: load this graph template into AcqKnowledge before the acquisition, unless it is already loaded.
+-nc  | --noCache: discover the channels and data connection settings again instead of restoring the configuration
+                     stored in ~/.acqndt by a previous run with the same server and template.
         """
         parser = argparse.ArgumentParser(usage=help_message,add_help=False)
         parser.add_argument("-h","--help",action='store_true',help=argparse.SUPPRESS)
@@ -60,9 +89,29 @@ Options and arguments:
 
         parser.add_argument("-oh","--OSCHost",default="127.0.0.1",help=argparse.SUPPRESS)
         parser.add_argument("-op","--OSCPort",default=5005,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-ob","--OSCBatch",default=None,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-ol","--OSCLatency",default=None,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-rec","--record",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-ts","--timestamps",action="store_true",help=argparse.SUPPRESS)
+        parser.add_argument("-sc","--scale",action="store_true",help=argparse.SUPPRESS)
+        parser.add_argument("-dec","--decimate",default=None,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-ft","--features",action="store_true",help=argparse.SUPPRESS)
+        parser.add_argument("-or","--OSCRate",default=None,help=argparse.SUPPRESS,type=float)
+        parser.add_argument("-orm","--OSCRateMode",default="filter",choices=["filter","latest"],help=argparse.SUPPRESS)
+        parser.add_argument("-od","--OSCDestinations",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-rp","--relayPort",default=None,help=argparse.SUPPRESS,type=int)
+        parser.add_argument("-rh","--relayHeader",action="store_true",help=argparse.SUPPRESS)
+        parser.add_argument("-shm","--sharedMemory",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-tpl","--template",default=None,help=argparse.SUPPRESS)
+        parser.add_argument("-nc","--noCache",action="store_true",help=argparse.SUPPRESS)
 
         
         args = parser.parse_args()
+        oscSender = None
+        oscSenders = []
+        recorder = None
+        relay = None
+        sharedRing = None
 
         if args.help:
                 print(help_message)
@@ -86,28 +135,74 @@ Options and arguments:
                         acqServer.toggleAcquisition()
                         print("Current data acquistion stopped")
                 
+                # the channels and data connection settings of a previous run
+                # with the same server and template are stored in ~/.acqndt.
+                # When still valid, which takes a single batch of calls to
+                # check, they are restored without configuring AcqKnowledge
+                # again, so restarting during a session is fast.
                 
-                # instruct AcqKnowledge to send us data for all of the channels being
-                # acquired and retain the array of enabled channel objects.
-
-                enabledChannels = acqServer.DeliverAllEnabledChannels()
-
-                # change data connection method to single.  The single data connection
-                # mode means that AcqKnowledge will make a single TCP network connection
-                # to our client code to deliver the data, all channels being
-                # delivered over that same connection.
-                #
-                # When in 'single' mode, we only need one AcqNdtDataServer object
-                # which will process all channels.
+                configurationCache = biopacndt.AcqNdtConfigurationCache()
+                configuration = None
+                if not args.noCache:
+                        configuration = configurationCache.Restore(acqServer, args.template)
                 
-                if acqServer.getDataConnectionMethod() != "single":
-                        acqServer.changeDataConnectionMethod("single")
-                        print("Data Connection Method Changed to: single")
+                # without -osc, AcqKnowledge sends the data to the requested
+                # hostname and port, so a configuration for other ones is stale.
                 
-                # ask AcqKnowledge which TCP port number will be used when it tries
-                # to establish its data connection
+                if configuration is not None and not args.oscActivated:
+                        if configuration["dataConnectionHostname"] != args.AcqHost \
+                                        or configuration["singleConnectionModePort"] != args.AcqPort:
+                                configuration = None
                 
-                singleConnectPort = acqServer.getSingleConnectionModePort()
+                if configuration is not None:
+                        print("Configuración de canales restaurada desde %s" % (configurationCache.GetFilename()))
+                else:
+                        # load the graph template, which is skipped when this
+                        # process already loaded it and the graph did not change
+                        
+                        if args.template is not None:
+                                if acqServer.LoadTemplate(args.template):
+                                        print("Plantilla %s cargada" % (args.template))
+                                else:
+                                        print("Plantilla %s ya cargada" % (args.template))
+                        
+                        # change data connection method to single.  The single data connection
+                        # mode means that AcqKnowledge will make a single TCP network connection
+                        # to our client code to deliver the data, all channels being
+                        # delivered over that same connection.
+                        #
+                        # When in 'single' mode, we only need one AcqNdtDataServer object
+                        # which will process all channels.
+                        
+                        if acqServer.getDataConnectionMethod() != "single":
+                                acqServer.changeDataConnectionMethod("single")
+                                print("Data Connection Method Changed to: single")
+                        
+                        # without -osc, the data connection goes to the requested
+                        # hostname and port, which are part of the stored configuration.
+                        
+                        if not args.oscActivated:
+                                if acqServer.changeDataConnectionHostname(args.AcqHost) != 0:
+                                        print("No se puede realizar conexión al hostname %s" % (args.AcqHost))
+                                        sys.exit()
+
+                                if acqServer.changeSingleConnectionModePort(args.AcqPort) != 0:
+                                        print("No se puede realizar conexión al puerto %s" % (args.AcqPort))
+                                        sys.exit()
+                        
+                        # instruct AcqKnowledge to send us data for all of the channels being
+                        # acquired, and store the configuration for the next run.
+                        
+                        configuration = configurationCache.Refresh(acqServer, args.template)
+                
+                # the enabled channel objects, their labels, the nominal sampling
+                # rate (None if unknown) and the TCP port number AcqKnowledge
+                # will use when it tries to establish its data connection.
+                
+                enabledChannels = configuration["channels"]
+                labels = configuration["labels"]
+                sampleRate = configuration["samplingRate"]
+                singleConnectPort = configuration["singleConnectionModePort"]
 
                 if args.oscActivated:
                         print("Se intentará enviar información via OSC")
@@ -125,12 +220,126 @@ Options and arguments:
                         # objects that ar enabled for acquisition, so we will pass in that
                         # list from above.
 
-                        dataServer = biopacndt.AcqNdtDataServer(singleConnectPort, enabledChannels,OSCHostname = args.OSCHost,OSCport=args.OSCPort)
+                        # the nominal sampling rate, when available, is used by the
+                        # clock of the data server and recorded in session files.
+
+                        dataServer = biopacndt.AcqNdtDataServer(singleConnectPort, enabledChannels,OSCHostname = args.OSCHost,OSCport=args.OSCPort,
+                                                                sampleRate=sampleRate)
+
+                        # the clock of the data server fits the received sample indexes
+                        # against the host clock to time stamp the frames.
+
+                        clock = None
+                        if args.timestamps:
+                                clock = dataServer.GetClock()
+
+                        # processing stages run on every received block before it is
+                        # sent or recorded.  The output schedule describes the
+                        # processed frames.
+
+                        if args.scale:
+                                dataServer.AddStage(biopacndt.AcqNdtScaleStage())
+                        if args.decimate is not None and args.decimate > 1:
+                                dataServer.AddStage(biopacndt.AcqNdtDecimateStage(args.decimate))
+                                print("Enviando una de cada %i muestras" % (args.decimate))
+
+                        # optionally limit the rate of the frames sent via OSC, without
+                        # affecting the frames recorded or used to extract features.
+
+                        rateController = None
+                        oscSchedule = dataServer.GetOutputSchedule()
+                        if args.OSCRate is not None:
+                                if sampleRate is None:
+                                        print("No se puede limitar la frecuencia de envío OSC: se requiere la frecuencia de muestreo")
+                                else:
+                                        rateController = biopacndt.AcqNdtRateController(oscSchedule, sampleRate, args.OSCRate, args.OSCRateMode)
+                                        oscSchedule = rateController.GetOutputSchedule()
+                                        print("Enviando %.1f muestras por segundo via OSC" % (rateController.GetOutputRate()))
 
                         # add our callback functions to the AcqNdtDataServer to process
                         # channel data as it is being received.
+                        #
+                        # When batching is requested, frames are sent as typed OSC bundles
+                        # by an AcqNdtOSCSender which processes whole blocks of frames.
+                        #
+                        # Additional OSC destinations receive the same bundles from
+                        # their own AcqNdtOSCSender.
 
-                        dataServer.RegisterCallback("SendOSCData",SendOSCData)
+                        if args.OSCBatch is not None or args.OSCLatency is not None or args.OSCDestinations is not None:
+                                maxLatency = None
+                                if args.OSCLatency is not None:
+                                        maxLatency = args.OSCLatency/1000.0
+                                batchFrames = args.OSCBatch if args.OSCBatch is not None else 32
+                                destinations = [(args.OSCHost, args.OSCPort)]
+                                if args.OSCDestinations is not None:
+                                        for destination in args.OSCDestinations.split(","):
+                                                (hostname, port) = destination.rsplit(":", 1)
+                                                destinations.append((hostname, int(port)))
+                                for (hostname, port) in destinations:
+                                        oscSenders.append(biopacndt.AcqNdtOSCSender(hostname, port, oscSchedule,
+                                                                                    batchFrames=batchFrames, maxLatency=maxLatency, clock=clock))
+                                oscSender = oscSenders[0]
+
+                                def sendOSCBundles(startIndex, block):
+                                        for sender in oscSenders:
+                                                sender.Write(startIndex, block)
+
+                                if rateController is not None:
+                                        sendOSCBundles = rateController.WrapBlockCallback(sendOSCBundles)
+                                dataServer.RegisterBlockCallback("SendOSCBundles",sendOSCBundles)
+                                print("Enviando bundles OSC de hasta %i muestras a %s" \
+                                        % (oscSender.GetBatchFrames(), ", ".join(["%s:%i" % destination for destination in destinations])))
+                        else:
+                                sendOSCData = SendOSCData
+                                if clock is not None:
+                                        sendOSCData = TimestampedOSCData(clock)
+                                if rateController is not None:
+                                        dataServer.RegisterBlockCallback("SendOSCData",rateController.WrapFrameCallback(sendOSCData, dataServer.OSCClient))
+                                else:
+                                        dataServer.RegisterCallback("SendOSCData",sendOSCData)
+
+                        # optionally extract low-rate features of the BioHarness channels,
+                        # located by their labels, and send them via OSC.
+
+                        if args.features:
+                                columns = bioharness.BioHarnessFeatures.ColumnsFromLabels(labels)
+                                if sampleRate is None or len(columns) == 0:
+                                        print("No se pueden extraer características: se requieren la frecuencia de muestreo y los canales del BioHarness")
+                                else:
+                                        features = bioharness.BioHarnessFeatures(dataServer.GetOutputSchedule(), sampleRate, columns,
+                                                                                 args.OSCHost, args.OSCPort)
+                                        dataServer.RegisterBlockCallback("Features",features.Write)
+                                        print("Enviando características (%s) a /BioHarness/features" % (", ".join(sorted(columns))))
+
+                        # optionally record every received channel into a single session
+                        # file which may be read back later with AcqNdtSessionReader.
+
+                        if args.record is not None:
+                                recorder = biopacndt.AcqNdtSessionRecorder(args.record, dataServer.GetOutputSchedule(),
+                                                                           sampleRate=sampleRate, labels=labels)
+                                dataServer.RegisterBlockCallback("Record",recorder.Write)
+                                print("Grabando la sesión en %s" % (args.record))
+
+                        # optionally republish the received frames to local TCP clients
+                        # such as Max or an analysis process, which may connect and
+                        # disconnect at any time without affecting AcqKnowledge.
+
+                        if args.relayPort is not None:
+                                relay = biopacndt.AcqNdtRelayServer(args.relayPort, dataServer.GetOutputSchedule(),
+                                                                    header=args.relayHeader, sampleRate=sampleRate, labels=labels)
+                                dataServer.RegisterBlockCallback("Relay",relay.Write)
+                                relay.Start()
+                                print("Retransmitiendo los datos a clientes TCP locales en el puerto %i" % (args.relayPort))
+
+                        # optionally publish the received frames in shared memory, where
+                        # analysis processes of this computer read them without copies
+                        # through the network stack.
+
+                        if args.sharedMemory is not None:
+                                sharedRing = biopacndt.AcqNdtSharedRing(args.sharedMemory, dataServer.GetOutputSchedule(),
+                                                                        sampleRate=sampleRate, labels=labels)
+                                dataServer.RegisterBlockCallback("SharedRing",sharedRing.Write)
+                                print("Publicando los datos en la memoria compartida '%s'" % (sharedRing.GetName()))
                         
                         # start the data server.  The data server will start listening for
                         # AcqKnowledge to make its data connection and, once data starts
@@ -146,14 +355,6 @@ Options and arguments:
                                 time.sleep(1)
                 else:
                         print("Se intentará enviar información via TCP")
-                        if acqServer.changeDataConnectionHostname(args.AcqHost) != 0:
-                                print("No se puede realizar conexión al hostname %s" % (args.AcqHost))
-                                sys.exit()
-
-                        if acqServer.changeSingleConnectionModePort(args.AcqPort) != 0:
-                                print("No se puede realizar conexión al puerto %s" % (args.AcqPort))
-                                sys.exit()
-
                         print('Servidor TCP disponible en hostname %s port %i' % (args.AcqHost, args.AcqPort))
 
                 while True:
@@ -170,6 +371,14 @@ Options and arguments:
                                 # dataServer.Stop()
                                 # acqServer.toggleAcquisition()
                                 dataServer.Stop()
+                                if relay is not None:
+                                        relay.Stop()
+                                if sharedRing is not None:
+                                        sharedRing.Close()
+                                for sender in oscSenders:
+                                        sender.Close()
+                                if recorder is not None:
+                                        recorder.Close()
                         print("Servidor desconectado.")
 
                         if acqServer.getAcquisitionInProgress():
@@ -205,6 +414,25 @@ def SendOSCData(index, frame, channelsInSlice,OSCClient):
                 for data in frame:
                         msg += " " + str(data)
                 OSCClient.send_message("/BioHarness", msg)
+
+
+def TimestampedOSCData(clock):
+                """Returns a callback like SendOSCData which also sends the acquisition time of every frame.
+
+                clock:  AcqNdtSampleClock of the data server, as returned by AcqNdtDataServer.GetClock().
+
+                The wall-clock time in seconds at which the frame was acquired is
+                sent after the index, or 0 while the clock has no estimate yet.
+                """
+
+                def SendTimestampedOSCData(index, frame, channelsInSlice, OSCClient):
+                        wallClock = clock.IndexToWallClock(index)
+                        msg = str(index) + " " + repr(wallClock if wallClock is not None else 0.0)
+                        for data in frame:
+                                msg += " " + str(data)
+                        OSCClient.send_message("/BioHarness", msg)
+
+                return SendTimestampedOSCData
                 
 if __name__ == '__main__':
         main()
\ No newline at end of file
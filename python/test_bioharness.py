@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+test_bioharness.py
+
+Tests of the bioharness feature extraction on synthetic BioHarness signals.
+
+Run with:  python -m pytest -q
+"""
+
+import numpy
+
+import biopacndt
+import bioharness
+
+
+SampleRate = 250.0
+
+## R-R intervals in samples alternating between 0.8 s and 0.84 s
+Intervals = (200, 210)
+
+
+def Signals(seconds=60):
+    """Returns the hardware indexes of the R peaks and the rows of synthetic BioHarness channels in the order of their labels."""
+
+    t = numpy.arange(int(seconds*SampleRate))/SampleRate
+    peaks = []
+    peak = 125
+    while peak < len(t):
+        peaks.append(peak)
+        peak += Intervals[len(peaks) % 2]
+
+    # narrow R waves with a broader T wave on a slow baseline wander
+    ecg = 0.3*numpy.sin(2*numpy.pi*0.3*t)
+    for peak in peaks:
+        ecg += 1.5*numpy.exp(-0.5*((t - peak/SampleRate)/0.01)**2) + 0.3*numpy.exp(-0.5*((t - peak/SampleRate - 0.25)/0.04)**2)
+    breathing = 2.0 + numpy.sin(2*numpy.pi*(15/60.0)*t)
+    rows = numpy.column_stack([ecg, breathing, numpy.full(len(t), 30.0),
+                               numpy.full(len(t), 0.3), numpy.full(len(t), 0.4), numpy.zeros(len(t))])
+    return (peaks, rows.astype('>f4'))
+
+
+def Blocks(rows):
+    """Yields (startIndex, block) splitting rows in blocks of uneven sizes."""
+
+    sizes = numpy.random.default_rng(1).integers(1, 300, size=len(rows))
+    position = 0
+    for size in sizes:
+        if position >= len(rows):
+            break
+        yield (position, rows[position:position + size])
+        position += size
+
+
+def test_r_peak_detector():
+    (peaks, rows) = Signals()
+    detector = bioharness.RPeakDetector(SampleRate)
+    detected = []
+    for (index, block) in Blocks(rows):
+        detected += detector.Process(index, block[:, 0])
+
+    # peaks of the first two seconds only teach the levels, the last one may still be in the filters
+    expected = [peak for peak in peaks if peak >= 2*SampleRate + 10]
+    assert len(expected) - 1 <= len(detected) <= len(expected)
+    for (peak, detectedPeak) in zip(expected, detected):
+        assert abs(detectedPeak - peak) <= 2
+
+
+def test_breath_detector():
+    (peaks, rows) = Signals()
+    detector = bioharness.BreathDetector(SampleRate)
+    breaths = 0
+    for (index, block) in Blocks(rows):
+        breaths += detector.Process(index, block[:, 1])
+
+    assert 13 <= breaths <= 15
+    assert abs(detector.GetRate() - 15.0) < 0.5
+
+
+def test_features():
+    (peaks, rows) = Signals()
+    labels = [bioharness.ECGLabel, bioharness.BreathingLabel, bioharness.PostureLabel] + list(bioharness.AccelerationLabels)
+    columns = bioharness.BioHarnessFeatures.ColumnsFromLabels(labels)
+    assert columns == {"ecg": 0, "breathing": 1, "posture": 2, "acceleration": (3, 4, 5)}
+
+    schedule = biopacndt.AcqNdtFrameSchedule([biopacndt.AcqNdtChannel("analog", index, 4, 1, 1.0, 0.0, True) for index in range(6)])
+    reports = []
+    features = bioharness.BioHarnessFeatures(schedule, SampleRate, columns, callback=lambda index, f: reports.append((index, f)))
+    for (index, block) in Blocks(rows):
+        features.Write(index, block)
+
+    # one report per second of acquired data, sent once the first row of the next second arrives
+    assert [index for (index, f) in reports] == [int(SampleRate)*k for k in range(1, 60)]
+
+    last = features.GetFeatures()
+    assert last == reports[-1][1]
+    assert abs(last["hr"] - 60.0*SampleRate/numpy.mean(Intervals)) < 1.0
+    assert abs(last["hrv"] - 1000.0*(Intervals[1] - Intervals[0])/SampleRate) < 5.0
+    assert abs(last["breath"] - 15.0) < 0.5
+    assert abs(last["activity"] - 0.5) < 1e-6
+    assert abs(last["posture"] - 30.0) < 1e-6
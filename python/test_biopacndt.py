@@ -0,0 +1,693 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+test_biopacndt.py
+
+Tests of the biopacndt module run without AcqKnowledge: the control
+connection is served by mockacqserver.MockAcqServer and the data connection
+by replayserver.
+
+Run with:  python -m pytest -q
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy
+import pytest
+
+import biopacndt
+import mockacqserver
+import replayserver
+
+
+def Channels(dividers):
+    """Returns analog AcqNdtChannel objects with the given downsampling dividers."""
+    return [biopacndt.AcqNdtChannel("analog", index, 4, divider, 1.0, 0.0, True) for (index, divider) in enumerate(dividers)]
+
+
+def FreePort():
+    """Returns a TCP port currently free on the loopback interface."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mockServer():
+    """Serve a MockAcqServer on a free port, returns (mock, port)."""
+
+    mock = mockacqserver.MockAcqServer()
+    server = mockacqserver.MockAcqXMLRPCServer(("127.0.0.1", 0), requestHandler=mockacqserver.MockAcqRequestHandler,
+                                               logRequests=False, allow_none=True)
+    server.Mock = mock
+    mock.Register(server)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield (mock, server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def template(tmp_path):
+    """Returns the path of a graph template file."""
+    filename = tmp_path / "graph.gtl"
+    filename.write_bytes(b"TEMPLATE" * 1000)
+    return str(filename)
+
+
+def Replay(dataServer, channels, channelData, sampleRate=1000.0):
+    """Replay the data of channels into a started data server and wait for its end."""
+
+    source = replayserver.AcqReplaySource(channels, channelData, sampleRate, ["ch%i" % (i) for i in range(len(channels))])
+    replayserver.ReplaySingle(source, "127.0.0.1", dataServer.server_address[1], speed=0)
+    return dataServer.WaitForEnd(5)
+
+
+# control connection
+
+def test_mock_server(mockServer):
+    (mock, port) = mockServer
+    acqServer = biopacndt.AcqNdtServer("127.0.0.1", port)
+    assert "getEnabledChannels" in acqServer.DispatchedMethodList()
+    assert acqServer.getAcquisitionInProgress() == False
+    assert acqServer.getEnabledChannels("analog") == [0, 1, 6, 11, 13, 15]
+    assert mock.GetStatistics()[1]["getEnabledChannels"] == 1
+
+
+# frame schedule
+
+def test_schedule_mixed_dividers():
+    schedule = biopacndt.AcqNdtFrameSchedule(Channels([1, 2]))
+    assert schedule.GetPeriod() == 2
+    assert schedule.GetPeriodValues() == 3
+    assert not schedule.IsUniform()
+
+    # two periods: ch0 at 0, ch1 at 0, ch0 at 1, then ch0 at 2, ch1 at 2, ch0 at 3
+    block = numpy.array([[0, 100, 1], [2, 102, 3]], dtype='>f4')
+    (first, second) = schedule.Deinterleave(block)
+    assert first.tolist() == [0, 1, 2, 3]
+    assert second.tolist() == [100, 102]
+
+
+# dispatcher
+
+def test_dispatcher_drop_policies():
+    for (policy, delivered) in [("drop-newest", [0, 1, 2]), ("drop-oldest", [0, 2, 3])]:
+        seen = []
+        release = threading.Event()
+        def deliver(index, block, receiveTime):
+            release.wait(5)
+            seen.append(index)
+
+        dispatcher = biopacndt.AcqNdtDispatcher(deliver, maxBlocks=2, policy=policy)
+        dispatcher.Start()
+        block = numpy.zeros((3, 2))
+
+        # the consumer takes the first block and waits, the others fill the queue
+        assert dispatcher.Put(0, block)
+        while dispatcher.GetQueueDepth() > 0:
+            time.sleep(0.001)
+        for index in [1, 2, 3]:
+            dispatcher.Put(index, block)
+        release.set()
+
+        assert dispatcher.WaitUntilEmpty(5)
+        dispatcher.Stop()
+        assert seen == delivered
+        assert dispatcher.GetDroppedBlocks() == 1 and dispatcher.GetDroppedFrames() == 3
+        assert dispatcher.GetMaxQueueDepth() == 2
+
+
+def test_dispatcher_failing_callback():
+    channels = Channels([1, 1])
+    port = FreePort()
+    dataServer = biopacndt.AcqNdtDataServer(port, channels, None, None, blockFrames=16)
+    dispatcher = dataServer.EnableDispatcher(maxBlocks=4)
+
+    calls = []
+    def callback(index, block):
+        calls.append(index)
+        if len(calls) == 3:
+            raise ValueError("callback failure")
+    dataServer.RegisterBlockCallback("Failing", callback)
+
+    dataServer.Start()
+    try:
+        data = numpy.arange(1000, dtype=float)
+        assert Replay(dataServer, channels, [data, data])
+    finally:
+        dataServer.Stop()
+
+    assert dispatcher.GetFailedBlocks() == 1
+    assert isinstance(dispatcher.GetLastError(), ValueError)
+    assert dispatcher.GetDeliveredFrames() + 16 == 1000
+    assert not dispatcher.Put(0, numpy.zeros((1, 2)))
+
+
+# session files
+
+def test_session_round_trip(tmp_path):
+    channels = Channels([1, 2])
+    schedule = biopacndt.AcqNdtFrameSchedule(channels)
+    filename = str(tmp_path / "session.ndt")
+
+    block = numpy.arange(3*10, dtype=numpy.float32).reshape(10, 3)
+    recorder = biopacndt.AcqNdtSessionRecorder(filename, schedule, sampleRate=500.0, labels=["a", "b"])
+    recorder.Write(40, block[:4])
+    recorder.Write(48, block[4:])
+    recorder.Close()
+
+    reader = biopacndt.AcqNdtSessionReader(filename)
+    assert reader.GetLabels() == ["a", "b"]
+    assert reader.GetSampleRate() == 500.0
+    assert reader.GetStartIndex() == 40
+    assert reader.GetChannels() == channels
+    (expected0, expected1) = schedule.Deinterleave(block)
+    assert numpy.array_equal(reader.GetChannelData(0), expected0)
+    assert numpy.array_equal(reader.GetChannelData(1), expected1)
+
+
+# data server
+
+def test_replay_single():
+    channels = Channels([1, 2])
+    port = FreePort()
+    dataServer = biopacndt.AcqNdtDataServer(port, channels, None, None, blockFrames=64, sampleRate=1000.0)
+
+    received = []
+    dataServer.RegisterBlockCallback("Collect", lambda index, block: received.append((index, block.copy())))
+    dataServer.Start()
+    try:
+        assert Replay(dataServer, channels, [numpy.arange(1000, dtype=float), numpy.arange(500, dtype=float)])
+    finally:
+        dataServer.Stop()
+
+    assert received[0][0] == 0
+    rows = numpy.concatenate([block for (index, block) in received])
+    (first, second) = dataServer.GetFrameSchedule().Deinterleave(rows)
+    assert first.tolist() == list(range(1000))
+    assert second.tolist() == list(range(500))
+
+
+# asyncio control client and data server
+
+def test_async_server_and_data_server(mockServer):
+    (mock, port) = mockServer
+    channels = Channels([1, 2])
+    source = replayserver.AcqReplaySource(channels, [numpy.arange(1000, dtype=float), numpy.arange(500, dtype=float)],
+                                          1000.0, ["a", "b"])
+    ports = [FreePort(), FreePort()]
+    received = [[], []]
+
+    def collect(index, block):
+        received[0].append(block.copy())
+
+    async def collectAsync(index, block):
+        await asyncio.sleep(0)
+        received[1].append(block)
+
+    async def run():
+        acqServer = biopacndt.AcqNdtAsyncServer("127.0.0.1", port)
+        await acqServer.Connect()
+        enabledChannels = await acqServer.DeliverAllEnabledChannels()
+        assert len(enabledChannels) == 6 and all([c.EnabledForDelivery for c in enabledChannels])
+        assert await acqServer.CallBatch([("getSamplingRate", ()), ("getDataConnectionMethod", ())]) == [250.0, "single"]
+        await acqServer.Close()
+
+        dataServer = biopacndt.AcqNdtAsyncDataServer()
+        dataServer.AddStream(ports[0], channels[:1], blockFrames=64).RegisterBlockCallback("Collect", collect)
+        dataServer.AddStream(ports[1], channels[1:], blockFrames=64).RegisterBlockCallback("Collect", collectAsync)
+        await dataServer.Start("127.0.0.1")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, replayserver.ReplayMultiple, source, "127.0.0.1", ports, 0)
+            assert await dataServer.WaitForEnd(5)
+        finally:
+            await dataServer.Stop()
+
+    asyncio.run(run())
+
+    assert numpy.concatenate(received[0]).ravel().tolist() == list(range(1000))
+    assert numpy.concatenate(received[1]).ravel().tolist() == list(range(500))
+
+
+# sample clock
+
+def test_sample_clock_fit():
+    clock = biopacndt.AcqNdtSampleClock(1000.0)
+    assert clock.GetSampleRate() == 1000.0
+    assert clock.IndexToTime(0) is None and clock.GetJitter() is None
+
+    # the MP device runs 100 ppm fast, receive times alternate 1 ms early and late
+    rate = 1000.0*(1 + 100e-6)
+    for k in range(2000):
+        clock.Update(k*10, 100.0 + k*10/rate + (0.001 if k % 2 else -0.001))
+
+    assert clock.GetObservationCount() == 2000
+    assert abs(clock.GetSampleRate() - rate) < 0.001
+    assert abs(clock.GetDrift() - 100.0) < 1.0
+    assert abs(clock.GetJitter() - 0.001) < 1e-5
+    assert abs(clock.IndexToTime(10000) - (100.0 + 10000/rate)) < 1e-6
+    assert abs(clock.TimeToIndex(clock.IndexToTime(12345)) - 12345) < 1e-6
+    assert abs(clock.IndexToWallClock(0) - clock.IndexToTime(0) - (time.time() - time.monotonic())) < 0.01
+
+    clock.Reset()
+    assert clock.GetObservationCount() == 0
+    assert clock.GetSampleRate() == 1000.0
+    assert clock.GetDrift() is None and clock.IndexToTime(0) is None
+
+
+
+# processing stages
+
+def RunStage(stage, channels, block, splits, startIndex=0):
+    """Configure stage and process block split at the given rows, returns the index of every output row and the output rows."""
+
+    period = stage.Configure(channels)[0].SamplingDivider
+    step = channels[0].SamplingDivider
+    indexes = []
+    outputs = []
+    for (begin, end) in zip([0] + splits, splits + [len(block)]):
+        (index, output) = stage.Process(startIndex + begin*step, block[begin:end])
+        indexes.extend(index + k*period for k in range(len(output)))
+        outputs.append(output)
+    return (indexes, numpy.concatenate(outputs))
+
+
+StageFactories = {
+    "scale": lambda: biopacndt.AcqNdtScaleStage(),
+    "fir": lambda: biopacndt.AcqNdtFilterStage(biopacndt.AcqNdtDecimateStage.LowPass(0.1, 15)),
+    "iir": lambda: biopacndt.AcqNdtFilterStage([0.2, 0.1], [1.0, -0.9, 0.2]),
+    "decimate": lambda: biopacndt.AcqNdtDecimateStage(4),
+    "decimate-latest": lambda: biopacndt.AcqNdtDecimateStage(3, antiAlias=False),
+    "rms": lambda: biopacndt.AcqNdtMovingRMSStage(5),
+}
+
+
+@pytest.mark.parametrize("useScipy", [False, True])
+@pytest.mark.parametrize("name", sorted(StageFactories))
+def test_stage_block_splits(name, useScipy, monkeypatch):
+    if useScipy:
+        pytest.importorskip("scipy.signal")
+    else:
+        monkeypatch.setattr(biopacndt, "scipysignal", None)
+
+    channels = [biopacndt.AcqNdtChannel("analog", 0, 4, 2, 2.0, 1.0, True),
+                biopacndt.AcqNdtChannel("analog", 1, 4, 2, -1.0, 0.5, True)]
+    block = numpy.random.default_rng(1).normal(size=(300, 2))
+    results = []
+    for splits in ([], [1, 2, 50, 51, 197], list(range(7, 300, 7))):
+        results.append(RunStage(StageFactories[name](), channels, block, splits, startIndex=100))
+
+    (indexes, output) = results[0]
+    assert len(output) > 0 and indexes[0] >= 100
+    for (otherIndexes, otherOutput) in results[1:]:
+        assert otherIndexes == indexes
+        assert numpy.allclose(otherOutput, output)
+    if name == "scale":
+        assert numpy.allclose(output, block*[2.0, -1.0] + [1.0, 0.5])
+
+
+def test_decimate_keeps_index():
+    # the latest row of every group of 4 is kept without anti-aliasing
+    for (antiAlias, first, peak) in [(True, 0, 200), (False, 3, 203)]:
+        block = numpy.zeros((1000, 1))
+        block[peak] = 1.0
+        stage = biopacndt.AcqNdtDecimateStage(4, antiAlias=antiAlias)
+        (indexes, output) = RunStage(stage, Channels([1]), block, [37, 300, 301])
+        assert indexes == list(range(first, first + 4*len(indexes), 4))
+        assert indexes[int(numpy.argmax(output[:, 0]))] == peak
+
+    assert stage.GetDelay() == 0
+    assert biopacndt.AcqNdtDecimateStage(4).GetDelay() == 16
+
+
+# rate control
+
+def test_rate_controller_keeps_index():
+    schedule = biopacndt.AcqNdtFrameSchedule(Channels([2, 2]))
+    block = numpy.zeros((1000, 2))
+    block[99] = [1.0, -1.0]
+
+    controller = biopacndt.AcqNdtRateController(schedule, 1000.0, 60)
+    assert controller.GetFactor() == 9
+    assert controller.GetOutputSchedule().GetPeriod() == 18
+    assert abs(controller.GetOutputRate() - 500.0/9) < 1e-9
+
+    blocks = []
+    callback = controller.WrapBlockCallback(lambda index, block: blocks.append((index, block)))
+    for begin in range(0, 1000, 64):
+        callback(1000 + 2*begin, block[begin:begin + 64])
+    controller.Reset()
+    frames = []
+    callback = controller.WrapFrameCallback(lambda index, frame, channelsInSlice, OSCClient: frames.append((index, frame)))
+    for begin in range(0, 1000, 37):
+        callback(1000 + 2*begin, block[begin:begin + 37])
+
+    indexes = [index + 18*k for (index, output) in blocks for k in range(len(output))]
+    rows = numpy.concatenate([output for (index, output) in blocks])
+    assert [index for (index, frame) in frames] == indexes
+    assert numpy.allclose([frame for (index, frame) in frames], rows)
+
+    # the impulse at row 99, hardware index 1198, falls on a kept row
+    assert indexes[0] == 1000
+    assert indexes[int(numpy.argmax(rows[:, 0]))] == 1198
+    assert indexes[int(numpy.argmin(rows[:, 1]))] == 1198
+
+
+# relay server
+
+class RelayClient:
+    """Connects to a relay server and reads its stream in a thread, unless stalled."""
+
+    def __init__(self, port, stalled=False):
+        self.Socket = socket.socket()
+        if stalled:
+            self.Socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        self.Socket.connect(("127.0.0.1", port))
+        self.Data = bytearray()
+        self.Thread = None
+        if not stalled:
+            self.Thread = threading.Thread(target=self.Read, daemon=True)
+            self.Thread.start()
+
+    def Read(self):
+        while True:
+            data = self.Socket.recv(1 << 16)
+            if not data:
+                break
+            self.Data += data
+
+    def WaitFor(self, size, timeout=5):
+        deadline = time.monotonic() + timeout
+        while len(self.Data) < size and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return len(self.Data) >= size
+
+
+def test_relay_late_and_stalled_clients(tmp_path):
+    schedule = biopacndt.AcqNdtFrameSchedule(Channels([1]))
+    relay = biopacndt.AcqNdtRelayServer(0, schedule, header=True, sampleRate=1000.0, maxQueuedBytes=2 << 20)
+    port = relay.server_address[1]
+    relay.Start()
+
+    def WaitForClients(count):
+        deadline = time.monotonic() + 5
+        while relay.GetClientCount() != count and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert relay.GetClientCount() == count
+
+    rows = 1024
+    blocks = 8000
+    clients = [RelayClient(port), RelayClient(port, stalled=True)]
+    WaitForClients(2)
+    sizes = [len(relay.EncodeHeader(0)) + blocks*rows*4]
+    try:
+        for k in range(blocks):
+            if k == 1000:
+                count = relay.GetClientCount()
+                clients.append(RelayClient(port))
+                WaitForClients(count + 1)
+                sizes.append(len(relay.EncodeHeader(k*rows)) + (blocks - k)*rows*4)
+            relay.Write(k*rows, numpy.arange(k*rows, (k + 1)*rows, dtype=float).reshape(-1, 1))
+
+            # the reading clients keep up, the stalled one lets its queue grow
+            for (client, size) in zip(clients[0:1] + clients[2:], sizes):
+                assert client.WaitFor(size - (blocks - k - 1)*rows*4 - (1 << 20))
+
+        for (client, size) in zip(clients[0:1] + clients[2:], sizes):
+            assert client.WaitFor(size)
+        assert relay.GetDroppedClients() == 1
+        assert relay.GetClientCount() == 2
+    finally:
+        relay.Stop()
+        for client in clients:
+            client.Socket.close()
+
+    for (name, client, startIndex) in [("early", clients[0], 0), ("late", clients[2], 1000*rows)]:
+        filename = tmp_path / (name + ".ndt")
+        filename.write_bytes(bytes(client.Data))
+        reader = biopacndt.AcqNdtSessionReader(str(filename))
+        assert reader.GetStartIndex() == startIndex
+        assert reader.GetChannelData(0).tolist() == list(range(startIndex, blocks*rows))
+
+
+
+# shared ring
+
+def RingRows(startIndex, rows):
+    """Returns rows of the schedule of Channels([2, 2]) holding their own hardware sample index."""
+    return numpy.repeat(numpy.arange(startIndex, startIndex + 2*rows, 2, dtype=numpy.float32).reshape(-1, 1), 2, axis=1)
+
+
+def test_shared_ring():
+    channels = Channels([2, 2])
+    ring = biopacndt.AcqNdtSharedRing(None, biopacndt.AcqNdtFrameSchedule(channels), capacity=8, sampleRate=500.0, labels=["a", "b"])
+    reader = biopacndt.AcqNdtSharedRingReader(ring.GetName())
+    try:
+        assert reader.GetChannels() == channels
+        assert reader.GetLabels() == ["a", "b"] and reader.GetSampleRate() == 500.0
+        assert reader.GetCapacity() == 8 and reader.GetHeader()["capacity"] == 8
+
+        def Check(startIndex, rows, lost):
+            (indexes, block) = reader.Read()
+            assert indexes.tolist() == list(range(startIndex, startIndex + 2*rows, 2))
+            assert numpy.array_equal(block, RingRows(startIndex, rows))
+            assert reader.GetLostRows() == lost
+
+        # maxRows
+        ring.Write(100, RingRows(100, 5))
+        (indexes, block) = reader.Read(maxRows=3)
+        assert indexes.tolist() == [100, 102, 104] and numpy.array_equal(block, RingRows(100, 3))
+        Check(106, 2, 0)
+        Check(110, 0, 0)
+
+        # wraparound of the ring
+        ring.Write(110, RingRows(110, 6))
+        Check(110, 6, 0)
+
+        # the reader falls behind by more than the capacity
+        for startIndex in (122, 132, 142):
+            ring.Write(startIndex, RingRows(startIndex, 5))
+        Check(136, 8, 7)
+
+        # a single block larger than the ring
+        ring.Write(152, RingRows(152, 11))
+        Check(158, 8, 10)
+        assert reader.GetWrittenRows() == ring.GetWrittenRows() == 37
+
+        # rows overwritten by a write still in progress while they are read:
+        # the writer announces 6 rows over the oldest of the 8 unread ones
+        ring.Write(174, RingRows(174, 8))
+        ring._AcqNdtSharedRing__counters[2] = ring.GetWrittenRows() + 6
+        Check(186, 2, 16)
+        assert reader.GetWritingRows() == 51
+
+        assert not reader.IsClosed()
+        ring.Close()
+        assert reader.IsClosed()
+    finally:
+        reader.Close()
+        ring.Close()
+
+
+RingReaderScript = """
+import json, sys
+import biopacndt
+reader = biopacndt.AcqNdtSharedRingReader(sys.argv[1])
+print("attached", flush=True)
+indexes = []
+while True:
+    closed = reader.IsClosed()
+    indexes += reader.Read()[0].tolist()
+    if closed:
+        break
+print(json.dumps([indexes, reader.GetLostRows(), reader.GetLabels()]))
+"""
+
+
+def test_shared_ring_second_process():
+    ring = biopacndt.AcqNdtSharedRing(None, biopacndt.AcqNdtFrameSchedule(Channels([2, 2])), capacity=1 << 16, labels=["a", "b"])
+    environment = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(biopacndt.__file__)))
+    process = subprocess.Popen([sys.executable, "-c", RingReaderScript, ring.GetName()], stdout=subprocess.PIPE, env=environment)
+    try:
+        assert process.stdout.readline().strip() == b"attached"
+        for startIndex in range(0, 20000, 200):
+            ring.Write(startIndex, RingRows(startIndex, 100))
+        ring.Close()
+        (indexes, lost, labels) = json.loads(process.communicate(timeout=10)[0])
+    finally:
+        process.kill()
+        ring.Close()
+
+    assert indexes == list(range(0, 20000, 2))
+    assert lost == 0 and labels == ["a", "b"]
+
+
+# UDP data server
+
+@pytest.mark.parametrize("useRecvmmsg", [True, False])
+def test_udp_server(useRecvmmsg, monkeypatch):
+    if not useRecvmmsg:
+        monkeypatch.setattr(biopacndt, "recvmmsg", None)
+    elif biopacndt.recvmmsg is None:
+        pytest.skip("recvmmsg() is not available")
+    assert biopacndt.AcqNdtDatagramBuffer().UsesRecvmmsg() == useRecvmmsg
+
+    channels = Channels([1, 1])
+    dataServer = biopacndt.AcqNdtDataUDPServer(0, channels, blockFrames=64, idleTimeout=0.5, gapFill="nan", reorderDatagrams=4)
+    blocks = []
+    frames = []
+    ended = []
+    dataServer.RegisterBlockCallback("Blocks", lambda index, block: blocks.append((index, block.copy())))
+    dataServer.RegisterCallback("Frames", lambda index, frame, channelsInSlice, OSCClient: frames.append((index, frame, channelsInSlice, OSCClient)))
+    dataServer.RegisterCloseCallback("End", lambda: ended.append(True))
+    dataServer.Start()
+
+    # 100 datagrams of 10 frames: 50 is lost, 11 arrives before 10 and 20 twice
+    rows = numpy.arange(2000, dtype='>f4').reshape(1000, 2)
+    datagrams = [biopacndt.AcqNdtDataUDPServer.Header.pack(k, 10*k) + rows[10*k:10*k + 10].tobytes() for k in range(100)]
+    order = list(range(100))
+    order[10:12] = [11, 10]
+    order.remove(50)
+    order.insert(order.index(20) + 1, 20)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for (n, k) in enumerate(order):
+            sender.sendto(datagrams[k], ("127.0.0.1", dataServer.server_address[1]))
+            if n % 20 == 0:
+                time.sleep(0.001)
+        start = time.monotonic()
+        assert dataServer.WaitForEnd(5)
+        assert time.monotonic() - start >= 0.4
+    finally:
+        sender.close()
+        dataServer.Stop()
+    assert ended == [True]
+
+    indexes = [index + k for (index, block) in blocks for k in range(len(block))]
+    received = numpy.concatenate([block for (index, block) in blocks])
+    assert indexes == list(range(1000))
+    assert numpy.all(numpy.isnan(received[500:510]))
+    expected = rows.astype(float)
+    expected[500:510] = numpy.nan
+    assert numpy.array_equal(received, expected, equal_nan=True)
+
+    statistics = dataServer.GetStatistics()
+    assert statistics["datagrams"] == 100 and statistics["bytes"] == 100*(8 + 80)
+    assert statistics["malformedDatagrams"] == 0
+    assert statistics["frames"] == 990 and statistics["lostDatagrams"] == 1
+    assert statistics["lostFrames"] == 10 and statistics["filledFrames"] == 10
+    assert statistics["duplicatedFrames"] == 10 and statistics["reorderedFrames"] == 10
+
+    # per frame callbacks are invoked as by the TCP server
+    tcpServer = biopacndt.AcqNdtDataServer(FreePort(), channels, None, None, blockFrames=64)
+    tcpFrames = []
+    tcpServer.RegisterCallback("Frames", lambda index, frame, channelsInSlice, OSCClient: tcpFrames.append((index, frame, channelsInSlice, OSCClient)))
+    tcpServer.Start()
+    try:
+        assert Replay(tcpServer, channels, [rows[:, 0].astype(float), rows[:, 1].astype(float)])
+    finally:
+        tcpServer.Stop()
+    assert len(frames) == len(tcpFrames) == 1000
+    assert frames[:500] + frames[510:] == tcpFrames[:500] + tcpFrames[510:]
+
+
+# datagram assembler
+
+def Assemble(gapFill, order, drop=(), reorderDatagrams=0, frames=4, datagrams=6):
+    """Put datagrams of frames frames each into an assembler, returns the rows and statistics."""
+
+    schedule = biopacndt.AcqNdtFrameSchedule(Channels([1, 1]))
+    delivered = []
+    assembler = biopacndt.AcqNdtDatagramAssembler(schedule, lambda index, block, receiveTime: delivered.append(block.copy()),
+                                                  8, gapFill, reorderDatagrams)
+    data = numpy.arange(datagrams*frames*2, dtype='>f4').reshape(-1, 2)
+    for sequence in order:
+        if sequence not in drop:
+            assert assembler.Put(sequence, sequence*frames, data[sequence*frames:(sequence + 1)*frames].ravel(), 0.0)
+    assembler.End(0.0)
+    return (numpy.concatenate(delivered), assembler.GetStatistics())
+
+
+def test_assembler_gap_modes():
+    (rows, statistics) = Assemble(None, range(6), drop=(2,))
+    assert len(rows) == 20
+    assert statistics["lostFrames"] == 4 and statistics["filledFrames"] == 0
+
+    (rows, statistics) = Assemble("nan", range(6), drop=(2,))
+    assert len(rows) == 24 and numpy.isnan(rows[8:12]).all()
+    assert statistics["filledFrames"] == 4
+
+    (rows, statistics) = Assemble("hold", range(6), drop=(2,))
+    assert (rows[8:12] == rows[7]).all()
+
+    (rows, statistics) = Assemble("linear", range(6), drop=(2,))
+    assert numpy.allclose(rows[7:13, 0], numpy.arange(14, 26, 2))
+
+
+def test_assembler_reorder_and_duplicates():
+    (rows, statistics) = Assemble(None, [0, 1, 3, 2, 4, 5, 5, 1], reorderDatagrams=2)
+    assert numpy.array_equal(rows, numpy.arange(48).reshape(-1, 2))
+    assert statistics["reorderedFrames"] == 4
+    assert statistics["duplicatedFrames"] == 8
+
+
+# template cache
+
+def test_template_cache(mockServer, template):
+    (mock, port) = mockServer
+    acqServer = biopacndt.AcqNdtServer("127.0.0.1", port)
+    biopacndt.AcqNdtServer.LoadedTemplates.clear()
+
+    assert acqServer.LoadTemplate(template)
+    assert not acqServer.LoadTemplate(template)
+    assert acqServer.LoadTemplate(template, force=True)
+
+    # a divider changed within AcqKnowledge changes the fingerprint
+    mock._MockAcqServer__channels[("analog", 0)]["divider"] = 2
+    assert acqServer.LoadTemplate(template)
+    assert acqServer.GetAllChannels()[0].SamplingDivider == 2
+
+
+# configuration cache
+
+def test_configuration_cache(mockServer, template, tmp_path):
+    (mock, port) = mockServer
+    filename = str(tmp_path / "configuration.json")
+    biopacndt.AcqNdtServer.LoadedTemplates.clear()
+
+    acqServer = biopacndt.AcqNdtServer("127.0.0.1", port)
+    cache = biopacndt.AcqNdtConfigurationCache(filename)
+    assert cache.Restore(acqServer, template) is None
+    acqServer.LoadTemplate(template)
+    stored = cache.Refresh(acqServer, template)
+
+    # a new process restores the configuration with a single request
+    biopacndt.AcqNdtServer.LoadedTemplates.clear()
+    acqServer = biopacndt.AcqNdtServer("127.0.0.1", port)
+    (requests, calls) = mock.GetStatistics()
+    restored = biopacndt.AcqNdtConfigurationCache(filename).Restore(acqServer, template)
+    assert restored is not None and mock.GetStatistics()[0] == requests + 1
+    assert restored["channels"] == stored["channels"]
+    assert restored["labels"] == stored["labels"]
+    assert not acqServer.LoadTemplate(template)
+
+    # a data connection sent to another host within AcqKnowledge invalidates it
+    hostname = acqServer.getDataConnectionHostname()
+    acqServer.changeDataConnectionHostname("192.0.2.1")
+    assert biopacndt.AcqNdtConfigurationCache(filename).Restore(acqServer, template) is None
+    acqServer.changeDataConnectionHostname(hostname)
+    assert biopacndt.AcqNdtConfigurationCache(filename).Restore(acqServer, template) is not None
+
+    # and so does a delivery setting changed within AcqKnowledge
+    acqServer.Deliver(restored["channels"][0], False)
+    assert biopacndt.AcqNdtConfigurationCache(filename).Restore(acqServer, template) is None